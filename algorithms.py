@@ -1,50 +1,603 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 
-def filter_and_sum(
-    type_=None,
-    service_type=None,
-    org_zone=None, org_region=None, org_city=None, org_branch_code=None, org_product=None,
-    des_zone=None, des_region=None, des_city=None, des_branch_code=None,
-    csv_path="data.csv"
-):
+import perf
+
+ROW_LEVELS = ["org_zone", "org_region", "org_city", "org_branch_code", "service_type", "org_product"]
+COL_LEVELS = ["type", "des_zone", "des_region", "des_city", "des_branch_code"]
+
+# filter_and_sum keyword arguments, in cube filter-tuple order
+FILTER_ARGS = [
+    "type_", "service_type",
+    "org_zone", "org_region", "org_city", "org_branch_code", "org_product",
+    "des_zone", "des_region", "des_city", "des_branch_code",
+]
+
+# Which axis and level each filter argument selects on
+FILTER_LEVELS = {
+    "type_": ("col", "type"),
+    "service_type": ("row", "service_type"),
+    "org_zone": ("row", "org_zone"),
+    "org_region": ("row", "org_region"),
+    "org_city": ("row", "org_city"),
+    "org_branch_code": ("row", "org_branch_code"),
+    "org_product": ("row", "org_product"),
+    "des_zone": ("col", "des_zone"),
+    "des_region": ("col", "des_region"),
+    "des_city": ("col", "des_city"),
+    "des_branch_code": ("col", "des_branch_code"),
+}
+
+# Binary copies of data.csv live here, one sub-folder per source file
+CACHE_DIR = ".matrix_cache"
+
+# In-process copies of loaded stores, keyed by (absolute source path, sparse)
+_STORES = {}
+
+# Rollup cubes, keyed by source fingerprint (content hash), least recently used first;
+# only the newest MAX_CUBES are kept, so rewriting data.csv does not pile up old cubes
+_CUBES = OrderedDict()
+MAX_CUBES = 2
+
+
+# =========================
+# CSV Parsing
+# =========================
+@perf.timed
+def read_matrix_csv(csv_path="data.csv"):
+    """Parse data.csv into a numeric frame with named origin/destination levels"""
     # --- Read CSV with multi-index and multi-columns ---
     df = pd.read_csv(
         csv_path,
         skiprows=1,
         header=[0, 1, 2, 3, 4],
-        index_col=[0, 1, 2, 3, 5, 6]
+        index_col=[0, 1, 2, 3, 5, 6],
+        low_memory=False
     )
 
     # Name the index and columns for clarity
-    df.index.set_names(
-        ["org_zone", "org_region", "org_city", "org_branch_code", "service_type", "org_product"],
-        inplace=True
+    df.index.set_names(ROW_LEVELS, inplace=True)
+    df.columns.set_names(COL_LEVELS, inplace=True)
+
+    # --- Convert entire dataframe to numeric ---
+    return df.apply(pd.to_numeric, errors="coerce").fillna(0)
+
+
+# =========================
+# Columnar Binary Store
+# =========================
+def _source_stat(csv_path):
+    st = os.stat(csv_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def file_sha1(path):
+    """Content hash of a file, read in 1 MB chunks"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_dir(csv_path, cache_dir):
+    abs_path = os.path.abspath(csv_path)
+    stem = os.path.splitext(os.path.basename(abs_path))[0]
+    tag = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:10]
+    return os.path.join(cache_dir, f"{stem}_{tag}")
+
+
+def _encode_levels(index, levels):
+    """Integer-code every level of a MultiIndex; missing labels get -1"""
+    codes = np.empty((len(index), len(levels)), dtype=np.int32)
+    dims = {}
+    for k, level in enumerate(levels):
+        level_codes, uniques = pd.factorize(index.get_level_values(level))
+        codes[:, k] = level_codes
+        dims[level] = uniques.tolist()
+    return codes, dims
+
+
+def _decode_levels(codes, dims, levels):
+    """Inverse of _encode_levels: a MultiIndex from level codes, -1 decoding to NaN"""
+    arrays = []
+    for k, level in enumerate(levels):
+        labels = np.array(dims[level] + [np.nan], dtype=object)
+        arrays.append(labels[np.asarray(codes)[:, k]])
+    return pd.MultiIndex.from_arrays(arrays, names=levels)
+
+
+def to_csr(values, nonzero=None):
+    """
+    Compressed sparse rows of a dense matrix: nonzero values, their column indices
+    and row pointers. nonzero overrides which cells are stored.
+    """
+    values = np.asarray(values)
+    if nonzero is None:
+        nonzero = values != 0
+    return {
+        "indptr": np.concatenate(([0], np.cumsum(nonzero.sum(axis=1)))).astype(np.int64),
+        "indices": np.nonzero(nonzero)[1].astype(np.int32),
+        "data": values[nonzero],
+        "shape": values.shape,
+    }
+
+
+def csr_rows(csr):
+    """Row index of every stored entry"""
+    return np.repeat(np.arange(csr["shape"][0]), np.diff(csr["indptr"]))
+
+
+def csr_to_dense(csr):
+    """Dense matrix of a to_csr result"""
+    out = np.zeros(csr["shape"])
+    out[csr_rows(csr), csr["indices"]] = csr["data"]
+    return out
+
+
+@perf.timed
+def build_matrix_store(csv_path="data.csv", cache_dir=CACHE_DIR):
+    """One-time conversion of data.csv into a float matrix plus encoded row/column dimension tables"""
+    stat = _source_stat(csv_path)
+    sha1 = file_sha1(csv_path)
+    df = read_matrix_csv(csv_path)
+
+    row_codes, row_dims = _encode_levels(df.index, ROW_LEVELS)
+    col_codes, col_dims = _encode_levels(df.columns, COL_LEVELS)
+
+    out_dir = _store_dir(csv_path, cache_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Drop the old meta first so a half-written store is never picked up
+    meta_path = os.path.join(out_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    values = np.ascontiguousarray(df.to_numpy(dtype=np.float64))
+    np.save(os.path.join(out_dir, "values.npy"), values)
+    csr = to_csr(values)
+    for key in ("indptr", "indices", "data"):
+        np.save(os.path.join(out_dir, f"csr_{key}.npy"), csr[key])
+    np.save(os.path.join(out_dir, "row_codes.npy"), row_codes)
+    np.save(os.path.join(out_dir, "col_codes.npy"), col_codes)
+
+    meta = {
+        "source": os.path.abspath(csv_path),
+        "mtime_ns": stat[0],
+        "size": stat[1],
+        "sha1": sha1,
+        "row_dims": row_dims,
+        "col_dims": col_dims,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return out_dir
+
+
+def _read_store(out_dir, meta, mmap, sparse=False):
+    mode = "r" if mmap else None
+    store = {
+        "row_codes": np.load(os.path.join(out_dir, "row_codes.npy"), mmap_mode=mode),
+        "col_codes": np.load(os.path.join(out_dir, "col_codes.npy"), mmap_mode=mode),
+        "row_dims": meta["row_dims"],
+        "col_dims": meta["col_dims"],
+        "row_lookup": {lvl: {v: i for i, v in enumerate(cats)} for lvl, cats in meta["row_dims"].items()},
+        "col_lookup": {lvl: {v: i for i, v in enumerate(cats)} for lvl, cats in meta["col_dims"].items()},
+        "fingerprint": meta["sha1"],
+    }
+    if sparse:
+        store["csr"] = {
+            key: np.load(os.path.join(out_dir, f"csr_{key}.npy"), mmap_mode=mode)
+            for key in ("indptr", "indices", "data")
+        }
+        store["csr"]["shape"] = (len(store["row_codes"]), len(store["col_codes"]))
+    else:
+        store["values"] = np.load(os.path.join(out_dir, "values.npy"), mmap_mode=mode)
+    return store
+
+
+@perf.timed
+def load_matrix_store(csv_path="data.csv", cache_dir=CACHE_DIR, mmap=True, sparse=False):
+    """
+    Return the binary store for csv_path, converting the CSV only when needed.
+
+    The store is reused while the source mtime/size match; if they changed but the
+    content hash did not (e.g. a touch or copy), the store is kept and re-stamped.
+    With sparse=True the matrix comes as a "csr" dict (see to_csr) instead of
+    dense "values".
+    """
+    abs_path = os.path.abspath(csv_path)
+    stat = _source_stat(csv_path)
+
+    cached = _STORES.get((abs_path, sparse))
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+
+    out_dir = _store_dir(csv_path, cache_dir)
+    meta_path = os.path.join(out_dir, "meta.json")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if (meta["mtime_ns"], meta["size"]) != stat:
+            if meta["sha1"] == file_sha1(csv_path):
+                meta["mtime_ns"], meta["size"] = stat
+                with open(meta_path, "w") as f:
+                    json.dump(meta, f)
+            else:
+                meta = None
+
+    # Stores written before the sparse copy existed are rebuilt once
+    if meta is not None and sparse and not os.path.exists(os.path.join(out_dir, "csr_data.npy")):
+        meta = None
+
+    if meta is None:
+        build_matrix_store(csv_path, cache_dir)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+    store = _read_store(out_dir, meta, mmap, sparse)
+    _STORES[abs_path, sparse] = (stat, store)
+    return store
+
+
+def store_to_frame(store):
+    """The read_matrix_csv frame of a dense or sparse store"""
+    values = csr_to_dense(store["csr"]) if "csr" in store else np.asarray(store["values"])
+    return pd.DataFrame(
+        values,
+        index=_decode_levels(store["row_codes"], store["row_dims"], ROW_LEVELS),
+        columns=_decode_levels(store["col_codes"], store["col_dims"], COL_LEVELS),
+    )
+
+
+def _level_mask(codes, lookup, levels, filters):
+    """Boolean mask of entries whose encoded levels match every non-None filter"""
+    mask = np.ones(len(codes), dtype=bool)
+    for k, (level, value) in enumerate(zip(levels, filters)):
+        if value is None:
+            continue
+        code = lookup[level].get(value)
+        if code is None:
+            return np.zeros(len(codes), dtype=bool)
+        mask &= codes[:, k] == code
+    return mask
+
+
+# =========================
+# Rollup Cube
+# =========================
+def _runs(mask):
+    """Split a boolean mask into contiguous [start, end) runs"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _leaf_axis(codes):
+    """Sorted unique code tuples (leaves) and the leaf id of every entry"""
+    leaves, inverse = np.unique(codes, axis=0, return_inverse=True)
+    return leaves, inverse.reshape(-1)
+
+
+def _group_sum(values, groups, n_groups):
+    """Sum the rows of values that share a group id (sorted reduce, no scatter-add)"""
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    out = np.zeros((n_groups, values.shape[1]))
+    if len(order):
+        out[sorted_groups[starts]] = np.add.reduceat(values[order], starts, axis=0)
+    return out
+
+
+def _grid_sum(store, row_gid, n_row_groups, col_gid, n_col_groups):
+    """
+    (row group x column group) sums of the store matrix.
+
+    Dense stores are reduced rows first, then columns; sparse stores scatter
+    only their stored entries into the grid.
+    """
+    if "csr" not in store:
+        by_row = _group_sum(np.asarray(store["values"]), row_gid, n_row_groups)
+        return _group_sum(by_row.T, col_gid, n_col_groups).T
+
+    csr = store["csr"]
+    cells = row_gid[csr_rows(csr)] * n_col_groups + col_gid[np.asarray(csr["indices"])]
+    grid = np.bincount(cells, weights=np.asarray(csr["data"]), minlength=n_row_groups * n_col_groups)
+    return grid.reshape(n_row_groups, n_col_groups)
+
+
+@perf.timed
+def build_rollup_cube(store):
+    """
+    Pre-aggregate the store into a cube of partial sums.
+
+    Axes are (service_type/product, type, origin leaf, destination leaf), where a
+    leaf is a zone/region/city/branch path. Leaves are sorted hierarchically, so a
+    zone, region, city or branch filter selects a few contiguous leaf ranges, and
+    the cube holds 2D prefix sums over the two leaf axes: any range is then four
+    lookups instead of a scan.
+    """
+    row_codes = np.asarray(store["row_codes"])
+    col_codes = np.asarray(store["col_codes"])
+
+    org_leaves, org_leaf = _leaf_axis(row_codes[:, 0:4])
+    prods, prod = _leaf_axis(row_codes[:, 4:6])
+    types, type_ = _leaf_axis(col_codes[:, 0:1])
+    des_leaves, des_leaf = _leaf_axis(col_codes[:, 1:5])
+
+    n_org, n_prod = len(org_leaves), len(prods)
+    n_des, n_type = len(des_leaves), len(types)
+
+    # Collapse rows to (product, origin leaf) and columns to (type, destination leaf)
+    grid = _grid_sum(store, prod * n_org + org_leaf, n_prod * n_org, type_ * n_des + des_leaf, n_type * n_des)
+    cells = grid.reshape(n_prod, n_org, n_type, n_des).transpose(0, 2, 1, 3)
+    prefix = np.zeros((n_prod, n_type, n_org + 1, n_des + 1))
+    prefix[:, :, 1:, 1:] = cells.cumsum(axis=2).cumsum(axis=3)
+
+    return {
+        "prefix": prefix,
+        "org_leaves": org_leaves,
+        "prods": prods,
+        "types": types,
+        "des_leaves": des_leaves,
+        "row_lookup": store["row_lookup"],
+        "col_lookup": store["col_lookup"],
+    }
+
+
+def load_rollup_cube(csv_path="data.csv", sparse=False):
+    """Return the rollup cube for csv_path, building it once per source fingerprint (the last MAX_CUBES are kept)"""
+    store = load_matrix_store(csv_path, sparse=sparse)
+    fingerprint = store["fingerprint"]
+    cube = _CUBES.get(fingerprint)
+    if cube is None:
+        cube = build_rollup_cube(store)
+        _CUBES[fingerprint] = cube
+        while len(_CUBES) > MAX_CUBES:
+            _CUBES.popitem(last=False)
+    else:
+        _CUBES.move_to_end(fingerprint)
+    return fingerprint, cube
+
+
+def _axis_bounds(leaves, lookup, levels, filters):
+    """Prefix-sum indices and signs covering the leaves that match the filters"""
+    starts, ends = _runs(_level_mask(leaves, lookup, levels, filters))
+    return np.concatenate((starts, ends)), np.concatenate((-np.ones(len(starts)), np.ones(len(ends))))
+
+
+def cube_sum(cube, filters):
+    """Sum of the cells matched by an 11-value filter tuple (filter_and_sum argument order)"""
+    type_, service_type, org_zone, org_region, org_city, org_branch_code, org_product, \
+        des_zone, des_region, des_city, des_branch_code = filters
+
+    prods = np.flatnonzero(_level_mask(cube["prods"], cube["row_lookup"], ROW_LEVELS[4:6], [service_type, org_product]))
+    types = np.flatnonzero(_level_mask(cube["types"], cube["col_lookup"], COL_LEVELS[0:1], [type_]))
+    org_idx, org_sign = _axis_bounds(
+        cube["org_leaves"], cube["row_lookup"], ROW_LEVELS[0:4],
+        [org_zone, org_region, org_city, org_branch_code]
     )
-    df.columns.set_names(
-        ["type", "des_zone", "des_region", "des_city", "des_branch_code"],
-        inplace=True
+    des_idx, des_sign = _axis_bounds(
+        cube["des_leaves"], cube["col_lookup"], COL_LEVELS[1:5],
+        [des_zone, des_region, des_city, des_branch_code]
     )
+    if not (len(prods) and len(types) and len(org_idx) and len(des_idx)):
+        return 0.0
 
-    # --- Convert entire dataframe to numeric ---
-    df = df.apply(pd.to_numeric, errors="coerce").fillna(0)
-
-    # --- Apply row filters ---
-    row_filters = [org_zone, org_region, org_city, org_branch_code, service_type, org_product]
-    if any(val is not None for val in row_filters):
-        row_mask = pd.Series(True, index=df.index)
-        for level_name, value in zip(df.index.names, row_filters):
-            if value is not None:
-                row_mask &= df.index.get_level_values(level_name) == value
-        df = df[row_mask]
-
-    # --- Apply column filters ---
-    col_filters = [type_, des_zone, des_region, des_city, des_branch_code]
-    if any(val is not None for val in col_filters):
-        col_mask = pd.Series(True, index=df.columns)
-        for level_name, value in zip(df.columns.names, col_filters):
-            if value is not None:
-                col_mask &= df.columns.get_level_values(level_name) == value
-        df = df.loc[:, col_mask]
-
-    # --- Return numeric sum ---
-    return round(df.to_numpy().sum(), 3)
\ No newline at end of file
+    corners = cube["prefix"][np.ix_(prods, types, org_idx, des_idx)]
+    return float(np.einsum("ptij,i,j->", corners, org_sign, des_sign))
+
+
+@lru_cache(maxsize=4096)
+def _cached_cube_sum(fingerprint, filters):
+    return round(cube_sum(_CUBES[fingerprint], filters), 3)
+
+
+# =========================
+# Filter & Sum
+# =========================
+@perf.timed
+def filter_and_sum(
+    type_=None,
+    service_type=None,
+    org_zone=None, org_region=None, org_city=None, org_branch_code=None, org_product=None,
+    des_zone=None, des_region=None, des_city=None, des_branch_code=None,
+    csv_path="data.csv", sparse=False
+):
+    fingerprint, _ = load_rollup_cube(csv_path, sparse)
+    filters = (
+        type_, service_type,
+        org_zone, org_region, org_city, org_branch_code, org_product,
+        des_zone, des_region, des_city, des_branch_code,
+    )
+    return _cached_cube_sum(fingerprint, filters)
+
+
+def _spec_groups(codes, lookup, levels, args, specs):
+    """Group the axis entries by the levels named in args, and locate each spec's group (-1 if absent)"""
+    if not args:
+        return np.zeros(len(codes), dtype=np.intp), 1, np.zeros(len(specs), dtype=np.intp)
+
+    cols = [levels.index(FILTER_LEVELS[a][1]) for a in args]
+    keys, gid = _leaf_axis(np.asarray(codes)[:, cols])
+    key_to_group = {tuple(k): g for g, k in enumerate(keys.tolist())}
+
+    spec_codes = [[lookup[FILTER_LEVELS[a][1]].get(v, -2) for v in specs[a]] for a in args]
+    spec_gid = np.array([key_to_group.get(k, -1) for k in zip(*spec_codes)], dtype=np.intp)
+    return gid, len(keys), spec_gid
+
+
+def _pattern_sums(store, args, specs):
+    """Sums for specs that all filter on the same argument set, from one grouped pass over the matrix"""
+    row_args = [a for a in args if FILTER_LEVELS[a][0] == "row"]
+    col_args = [a for a in args if FILTER_LEVELS[a][0] == "col"]
+
+    row_gid, n_row_groups, spec_row = _spec_groups(store["row_codes"], store["row_lookup"], ROW_LEVELS, row_args, specs)
+    col_gid, n_col_groups, spec_col = _spec_groups(store["col_codes"], store["col_lookup"], COL_LEVELS, col_args, specs)
+
+    grid = _grid_sum(store, row_gid, n_row_groups, col_gid, n_col_groups)
+
+    found = (spec_row >= 0) & (spec_col >= 0)
+    sums = np.zeros(len(specs))
+    sums[found] = grid[spec_row[found], spec_col[found]]
+    return [round(x, 3) for x in sums.tolist()]
+
+
+@perf.timed
+def filter_and_sum_many(specs, csv_path="data.csv", sparse=False):
+    """
+    Evaluate many filter_and_sum queries against one loaded matrix.
+
+    specs is a list of dicts or a DataFrame whose columns are filter_and_sum
+    argument names; missing, empty or NaN values mean "no filter". The matrix is
+    loaded once, and specs that filter on the same set of arguments share a
+    single grouped pass over it. Returns the specs frame (same index) with a
+    "sum" column appended. sparse=True runs on the sparse copy of the store.
+    """
+    df_specs = specs.copy() if isinstance(specs, pd.DataFrame) else pd.DataFrame(list(specs))
+    store = load_matrix_store(csv_path, sparse=sparse)
+
+    filters = df_specs.reindex(columns=FILTER_ARGS).astype(object)
+    filters = filters.where(filters.notna() & (filters != ""), None)
+    filters = filters.reset_index(drop=True)
+
+    # Specs are grouped by which arguments they set (encoded as a bitmask)
+    is_set = filters.notna().to_numpy()
+    patterns = is_set @ (1 << np.arange(len(FILTER_ARGS)))
+    sums = np.zeros(len(filters))
+    for pattern in np.unique(patterns):
+        rows = np.flatnonzero(patterns == pattern)
+        args = [a for k, a in enumerate(FILTER_ARGS) if pattern >> k & 1]
+        sums[rows] = _pattern_sums(store, args, filters.iloc[rows].reset_index(drop=True))
+
+    df_specs["sum"] = sums
+    return df_specs
+
+
+# =========================
+# Breakdowns & OD Flows
+# =========================
+def _block_grid(store, row_level, col_level, filters):
+    """
+    Sums of the filtered block of the store grouped by one row level and one column
+    level (None keeps that axis as a single group), with the group labels.
+    """
+    unknown = set(filters) - set(FILTER_ARGS)
+    if unknown:
+        raise TypeError(f"Unknown filters: {sorted(unknown)}")
+    if row_level not in ROW_LEVELS + [None] or col_level not in COL_LEVELS + [None]:
+        raise ValueError(f"Unknown levels: {row_level!r}, {col_level!r}")
+
+    axis_filters = {"row": [None] * len(ROW_LEVELS), "col": [None] * len(COL_LEVELS)}
+    for arg, value in filters.items():
+        axis, level = FILTER_LEVELS[arg]
+        levels = ROW_LEVELS if axis == "row" else COL_LEVELS
+        axis_filters[axis][levels.index(level)] = value
+
+    groups = []
+    for axis, level, levels in (("row", row_level, ROW_LEVELS), ("col", col_level, COL_LEVELS)):
+        codes = np.asarray(store[f"{axis}_codes"])
+        mask = _level_mask(codes, store[f"{axis}_lookup"], levels, axis_filters[axis])
+        labels = store[f"{axis}_dims"][level] if level is not None else [None]
+        gid = codes[:, levels.index(level)] if level is not None else np.zeros(len(codes), dtype=np.intp)
+        # Filtered-out entries go to one extra group that is dropped after summing
+        groups.append((np.where(mask, gid, len(labels)), labels))
+
+    (row_gid, row_labels), (col_gid, col_labels) = groups
+    grid = _grid_sum(store, row_gid, len(row_labels) + 1, col_gid, len(col_labels) + 1)
+    return grid[:len(row_labels), :len(col_labels)], row_labels, col_labels
+
+
+@perf.timed
+def store_breakdown(store, row_level=None, col_level=None, **filters):
+    """
+    The filtered block of a loaded store split by a row level, a column level or
+    both (an origin x destination pivot in long form), from one grouped pass.
+
+    filters are filter_and_sum keyword arguments. Returns one row per non-zero
+    group with the level columns and "sum", largest first.
+    """
+    grid, row_labels, col_labels = _block_grid(store, row_level, col_level, filters)
+    row_idx, col_idx = np.nonzero(grid)
+    sums = grid[row_idx, col_idx]
+    order = np.argsort(-sums, kind="stable")
+
+    result = {}
+    if row_level is not None:
+        result[row_level] = np.asarray(row_labels, dtype=object)[row_idx[order]]
+    if col_level is not None:
+        result[col_level] = np.asarray(col_labels, dtype=object)[col_idx[order]]
+    result["sum"] = np.round(sums[order], 3)
+    return pd.DataFrame(result)
+
+
+def filter_and_breakdown(row_level=None, col_level=None, csv_path="data.csv", sparse=False, **filters):
+    """store_breakdown on the binary store of csv_path"""
+    return store_breakdown(load_matrix_store(csv_path, sparse=sparse), row_level, col_level, **filters)
+
+
+@perf.timed
+def store_flows(store, origin_level, destination_level, top_k=None, **filters):
+    """
+    Origin -> destination sums of a loaded store, aggregated to one row level
+    (e.g. "org_region") and one column level (e.g. "des_branch_code").
+
+    filters are filter_and_sum keyword arguments that restrict the matrix first.
+    Returns origin, destination, sum rows for the non-zero flows, largest first;
+    top_k keeps only the k largest.
+    """
+    if origin_level is None or destination_level is None:
+        raise ValueError("Flows need both an origin and a destination level")
+    flows = store_breakdown(store, origin_level, destination_level, **filters)
+    flows.columns = ["origin", "destination", "sum"]
+    return flows if top_k is None else flows.head(top_k)
+
+
+def od_flows(origin_level, destination_level, top_k=None, csv_path="data.csv", sparse=False, **filters):
+    """store_flows on the binary store of csv_path"""
+    return store_flows(load_matrix_store(csv_path, sparse=sparse), origin_level, destination_level, top_k, **filters)
+
+
+# =========================
+# Header Hierarchy
+# =========================
+class HeaderHierarchy:
+    """
+    Cascading selector options over the data.csv header rows, as dictionary lookups.
+
+    cascades maps a target column (or a tuple of columns, e.g. branch code and
+    name) to the columns that narrow it. The sorted option list for every
+    combination of set/unset narrowing columns is built once, so
+    options(target, **selection) never scans the headers.
+    """
+
+    @perf.timed
+    def __init__(self, headers, cascades):
+        self.cascades = {target: list(by) for target, by in cascades.items()}
+        self._options = {}
+        for target, by in self.cascades.items():
+            cols = list(target) if isinstance(target, tuple) else [target]
+            frame = headers[cols + by].dropna(subset=cols)
+            frame = frame[(frame[cols] != "").all(axis=1)].drop_duplicates()
+            values = list(zip(*(frame[c] for c in cols))) if len(cols) > 1 else frame[cols[0]].tolist()
+            keys = list(zip(*(frame[b].where(frame[b].notna(), None) for b in by))) if by else [()] * len(frame)
+
+            table = {}
+            for key, value in zip(keys, values):
+                # Register the value under every subset of its narrowing values
+                for subset in range(1 << len(by)):
+                    masked = tuple(k if subset >> i & 1 else None for i, k in enumerate(key))
+                    table.setdefault(masked, set()).add(value)
+            self._options[target] = {key: sorted(found) for key, found in table.items()}
+
+    def options(self, target, **selection):
+        """Sorted options of target under the selection (falsy values mean "not selected")"""
+        key = tuple(selection.get(b) or None for b in self.cascades[target])
+        return self._options[target].get(key, [])
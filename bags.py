@@ -5,243 +5,79 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import json
+import os
 
-# ---------- Helpers ----------
-def find_elbow(x, y):
-    """Find elbow (knee) using max perpendicular distance from line connecting first and last points."""
-    if len(x) < 2:
-        return 0
-    p1, p2 = np.array([x[0], y[0]]), np.array([x[-1], y[-1]])
-    line_vec = p2 - p1
-    line_vec = line_vec / np.linalg.norm(line_vec)
-    distances = []
-    for i in range(len(x)):
-        p = np.array([x[i], y[i]])
-        proj_len = np.dot(p - p1, line_vec)
-        proj_point = p1 + proj_len * line_vec
-        dist = np.linalg.norm(p - proj_point)
-        distances.append(dist)
-    return int(np.argmax(distances))
-
-
-# ---------- Load Data ----------
-df_abs = pd.read_csv("all_data.csv")
-df_pct = pd.read_csv("all_data_percentage.csv")
-df_office = pd.read_csv("office_location.csv")
-
-# Import flow analysis functions from processing
+# Import shared pipeline functions from processing
 from processing import (
     load_flow_analysis_data, 
     get_region_flow_summary, 
     get_region_receiving_summary, 
-    get_all_india_flow_summary
-)
-
-# ---------- Dynamic Flow Analysis Functions ----------
-def calculate_dynamic_flow_analysis(df_abs, df_optimal, type_name):
-    """Calculate flow analysis dynamically based on current optimal branches"""
-    
-    # Create region mapping from branch codes to regions
-    region_mapping = {
-        'A': 'AMD', 'B': 'BLR', 'C': 'CHE', 'E': 'CJB', 'H': 'HYD', 
-        'I': 'IDR', 'J': 'HHPT', 'K': 'CCU', 'M': 'MUM', 'N': 'DDL',
-        'O': 'COK', 'P': 'PNQ', 'Q': 'JAI', 'R': 'NGP', 'T': 'PAT',
-        'U': 'UPT', 'V': 'VJA', 'W': 'BBI', 'X': 'GAU'
-    }
-    
-    # Get all unique regions
-    regions = df_abs['Region'].unique()
-    
-    # Create a dictionary to store optimal branches for each combination
-    optimal_branches_dict = {}
-    for _, row in df_optimal.iterrows():
-        key = (row['Region'], row['Service_Type'], row['Type'])
-        branches = [b.strip() for b in str(row['Branches']).split(',') if b.strip()]
-        optimal_branches_dict[key] = set(branches)
-    
-    # Initialize flow matrices
-    flow_matrix = pd.DataFrame(0, index=regions, columns=regions)
-    optimal_matrix = pd.DataFrame(0, index=regions, columns=regions)
-    non_optimal_matrix = pd.DataFrame(0, index=regions, columns=regions)
-    
-    # Process each row (origin region)
-    for _, row in df_abs.iterrows():
-        if row['Type'] != type_name:
-            continue
-            
-        origin_region = row['Region']
-        service_type = row['Service_Type']
-        
-        # Get optimal branches for this combination
-        key = (origin_region, service_type, type_name)
-        optimal_branches = optimal_branches_dict.get(key, set())
-        
-        # Get branch columns (exclude Region, Type, Service_Type, Total)
-        branch_cols = [col for col in df_abs.columns if col not in ['Region', 'Type', 'Service_Type', 'Total']]
-        
-        for branch in branch_cols:
-            flow_value = row[branch]
-            if pd.isna(flow_value) or flow_value == 0:
-                continue
-                
-            # Determine destination region from branch code
-            dest_region = None
-            if branch and len(branch) > 0:
-                first_letter = branch[0]
-                dest_region = region_mapping.get(first_letter)
-            
-            if dest_region and dest_region in regions:
-                # Add to total flow matrix
-                flow_matrix.loc[origin_region, dest_region] += flow_value
-                
-                # Determine if this is optimal or non-optimal based on optimal_branches
-                if branch in optimal_branches:
-                    optimal_matrix.loc[origin_region, dest_region] += flow_value
-                else:
-                    non_optimal_matrix.loc[origin_region, dest_region] += flow_value
-    
-    # Calculate percentages correctly (optimal/total * 100 for each origin-destination pair)
-    optimal_pct_matrix = pd.DataFrame(0.0, index=regions, columns=regions)
-    non_optimal_pct_matrix = pd.DataFrame(0.0, index=regions, columns=regions)
-    
-    for origin in regions:
-        for dest in regions:
-            total_flow = flow_matrix.loc[origin, dest]
-            if total_flow > 0:
-                optimal_pct_matrix.loc[origin, dest] = (optimal_matrix.loc[origin, dest] / total_flow * 100).round(2)
-                non_optimal_pct_matrix.loc[origin, dest] = (non_optimal_matrix.loc[origin, dest] / total_flow * 100).round(2)
-    
-    return flow_matrix, optimal_matrix, non_optimal_matrix, optimal_pct_matrix, non_optimal_pct_matrix
-
-
-def calculate_dynamic_receiving_analysis(df_abs, df_optimal, type_name):
-    """Calculate receiving analysis dynamically based on current optimal branches"""
-    
-    # Create region mapping from branch codes to regions
-    region_mapping = {
-        'A': 'AMD', 'B': 'BLR', 'C': 'CHE', 'E': 'CJB', 'H': 'HYD', 
-        'I': 'IDR', 'J': 'HHPT', 'K': 'CCU', 'M': 'MUM', 'N': 'DDL',
-        'O': 'COK', 'P': 'PNQ', 'Q': 'JAI', 'R': 'NGP', 'T': 'PAT',
-        'U': 'UPT', 'V': 'VJA', 'W': 'BBI', 'X': 'GAU'
-    }
-    
-    # Get all unique regions
-    regions = df_abs['Region'].unique()
-    
-    # Create a dictionary to store optimal branches for each combination
-    optimal_branches_dict = {}
-    for _, row in df_optimal.iterrows():
-        key = (row['Region'], row['Service_Type'], row['Type'])
-        branches = [b.strip() for b in str(row['Branches']).split(',') if b.strip()]
-        optimal_branches_dict[key] = set(branches)
-    
-    # Initialize receiving matrices
-    total_receiving = pd.Series(0, index=regions)
-    optimal_receiving = pd.Series(0, index=regions)
-    non_optimal_receiving = pd.Series(0, index=regions)
-    
-    # Process each row (origin region)
-    for _, row in df_abs.iterrows():
-        if row['Type'] != type_name:
-            continue
-            
-        origin_region = row['Region']
-        service_type = row['Service_Type']
-        
-        # Get optimal branches for this origin region combination
-        key = (origin_region, service_type, type_name)
-        optimal_branches = optimal_branches_dict.get(key, set())
-        
-        # Get branch columns (exclude Region, Type, Service_Type, Total)
-        branch_cols = [col for col in df_abs.columns if col not in ['Region', 'Type', 'Service_Type', 'Total']]
-        
-        for branch in branch_cols:
-            flow_value = row[branch]
-            if pd.isna(flow_value) or flow_value == 0:
-                continue
-                
-            # Determine destination region from branch code
-            dest_region = None
-            if branch and len(branch) > 0:
-                first_letter = branch[0]
-                dest_region = region_mapping.get(first_letter)
-            
-            if dest_region and dest_region in regions:
-                # Add to total receiving
-                total_receiving[dest_region] += flow_value
-                
-                # Determine if this is optimal or non-optimal based on optimal_branches
-                if branch in optimal_branches:
-                    optimal_receiving[dest_region] += flow_value
-                else:
-                    non_optimal_receiving[dest_region] += flow_value
-    
-    # Calculate percentages correctly (optimal/total * 100 for each region)
-    optimal_pct = pd.Series(0.0, index=regions)
-    non_optimal_pct = pd.Series(0.0, index=regions)
-    
-    for region in regions:
-        if total_receiving[region] > 0:
-            optimal_pct[region] = (optimal_receiving[region] / total_receiving[region] * 100).round(2)
-            non_optimal_pct[region] = (non_optimal_receiving[region] / total_receiving[region] * 100).round(2)
-    
-    return total_receiving, optimal_receiving, non_optimal_receiving, optimal_pct, non_optimal_pct
-
-# Melt wide → long
-df_abs_long = df_abs.melt(
-    id_vars=["Region", "Type", "Service_Type", "Total"],
-    var_name="Branch",
-    value_name="Value"
-)
-df_pct_long = df_pct.melt(
-    id_vars=["Region", "Type", "Service_Type"],
-    var_name="Branch",
-    value_name="Percentage"
+    get_all_india_flow_summary,
+    ThresholdSweep,
+    threshold_grid_path,
+    load_threshold_grid,
+    FlowAnalysis,
+    find_knees,
+    KNEE_METHODS,
+    DEFAULT_KNEE_METHOD,
+    TARGET_CUMULATIVE_PCT,
+    ELBOW_PLOT_DIR,
+    ELBOW_MANIFEST,
+    elbow_plot_path,
+    elbow_fingerprint,
+    load_elbow_manifest,
+    load_long_table,
+    long_to_wide,
+    group_totals
 )
+from algorithms import file_sha1
+import perf
 
-df_merge = pd.merge(
-    df_abs_long,
-    df_pct_long,
-    on=["Region", "Type", "Service_Type", "Branch"],
-    how="inner"
-)
+st.set_page_config(layout="wide", page_title="Optimal Bagging Dashboard")
+perf.sidebar_toggle()
 
-# Mapping file
-with open("des_mappings.json", "r") as f:
-    mapping = json.load(f)
-
-rows = []
-for zone, regions in mapping.items():
-    for region, cities in regions.items():
-        for city, branches in cities.items():
-            for branch_code, branch_name in branches.items():
-                rows.append({
-                    "Zone": zone,
-                    "Region": region,
-                    "City": city,
-                    "BranchCode": branch_code,
-                    "BranchName": branch_name
-                })
-df_mapping = pd.DataFrame(rows)
-df_region_counts = df_mapping.groupby("Region").size().reset_index(name="Self_Branches")
-
-# Create branch code to name mapping from office_location.csv
-branch_name_mapping = dict(zip(df_office['office'], df_office['name']))
-
-def get_branch_names(branch_codes_str):
-    """Convert branch codes string to branch names string"""
-    if not isinstance(branch_codes_str, str) or branch_codes_str.strip() == "":
-        return ""
-    branch_codes = [b.strip() for b in branch_codes_str.split(",") if b.strip()]
-    branch_names = []
-    for code in branch_codes:
-        name = branch_name_mapping.get(code, code)  # Use code if name not found
-        branch_names.append(f"{code} - {name}")
-    return ", ".join(branch_names)
+# ---------- Load Data ----------
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+# One categorical long table (Region, Type, Service_Type, Total, Branch, Value, Percentage),
+# shared by every session instead of per-session wide, melted and merged copies; keyed on
+# all_data.csv's (mtime_ns, size), so an edited file is reloaded
+@st.cache_resource(max_entries=2)
+def load_long(fingerprint):
+    return load_long_table()
+
+all_data_key = _file_fingerprint("all_data.csv")
+with perf.stage("bags.load"):
+    df_long = load_long(all_data_key)
+    df_totals = group_totals(df_long)
+    df_office = pd.read_csv("office_location.csv")
+
+    # Mapping file
+    with open("des_mappings.json", "r") as f:
+        mapping = json.load(f)
+
+    rows = []
+    for zone, regions in mapping.items():
+        for region, cities in regions.items():
+            for city, branches in cities.items():
+                for branch_code, branch_name in branches.items():
+                    rows.append({
+                        "Zone": zone,
+                        "Region": region,
+                        "City": city,
+                        "BranchCode": branch_code,
+                        "BranchName": branch_name
+                    })
+    df_mapping = pd.DataFrame(rows)
+    df_region_counts = df_mapping.groupby("Region").size().reset_index(name="Self_Branches")
+
+    # Create branch code to name mapping from office_location.csv
+    branch_name_mapping = dict(zip(df_office['office'], df_office['name']))
 
 
 # ---------- Streamlit UI ----------
-st.set_page_config(layout="wide", page_title="Optimal Bagging Dashboard")
 st.title("📦 Optimal Bagging Dashboard")
 
 # Threshold sliders
@@ -253,68 +89,52 @@ with col2:
 
 thresholds = {"Volume": vol_thresh, "Billed Wt": wt_thresh}
 
+# Knee method used for the optimal branches; a method's tables are built on first use, then looked up
+KNEE_LABELS = {
+    "chord": "Chord distance (bags.ipynb)",
+    "kneedle": "Kneedle",
+    "l_method": "L-method",
+    "curvature": "Max curvature",
+    "target": "Target cumulative %",
+}
+col1, col2 = st.columns(2)
+with col1:
+    knee_method = st.selectbox(
+        "Knee Method", list(KNEE_METHODS), index=KNEE_METHODS.index(DEFAULT_KNEE_METHOD), format_func=KNEE_LABELS.get
+    )
+with col2:
+    target_pct = TARGET_CUMULATIVE_PCT
+    if knee_method == "target":
+        target_pct = float(st.slider("Target Cumulative %", 5, 100, int(TARGET_CUMULATIVE_PCT), step=5))
+
 # Type + Region filters
 col1, col2 = st.columns(2)
 with col1:
-    type_sel = st.selectbox("Select Type", df_abs["Type"].unique())
+    type_sel = st.selectbox("Select Type", list(df_long["Type"].unique()))
 with col2:
-    regions = ["All India"] + sorted(df_abs["Region"].unique())
+    regions = ["All India"] + sorted(df_long["Region"].unique())
     region_sel = st.selectbox("Select Region", regions)
 
 
 
 # ---------- Compute Bag Summary ----------
-results = []
-for (region, stype, type_), group in df_merge.groupby(["Region", "Service_Type", "Type"]):
-    thresh = thresholds.get(type_, 0)
-    filtered = group[group["Value"] >= thresh]
-    num_branches = len(filtered)
-    cum_pct = filtered["Percentage"].sum()
-    branch_list = filtered["Branch"].tolist()
-    results.append({
-        "Region": region,
-        "Service_Type": stype,
-        "Type": type_,
-        "Num_Branches": num_branches,
-        "Cumulative_Percentage": cum_pct,
-        "Branches": ", ".join(branch_list) if branch_list else "",
-        "Branch_Names": get_branch_names(", ".join(branch_list)) if branch_list else ""
-    })
-df_summary = pd.DataFrame(results)
+# Every slider position is precomputed once per process, so moving a slider is a lookup
+@st.cache_resource(max_entries=4)
+def load_threshold_sweep(fingerprint, target_pct):
+    return ThresholdSweep(load_long(fingerprint), target_pct=target_pct)
+
+sweep = load_threshold_sweep(all_data_key, target_pct)
+# Branch memberships stay as per-group masks; names are only rendered for the tables below
+with perf.stage("bags.bag_summary"):
+    bag_sets, optimal_sets = sweep.branch_sets(thresholds, knee_method)
+    branch_labels = {code: f"{code} - {branch_name_mapping.get(code, code)}" for code in sweep.branches}
+    df_summary = sweep.bag_summary(thresholds, knee_method)
+    df_summary["Branch_Names"] = bag_sets.to_strings(branch_labels)
 
 # ---------- Compute Optimal Branches ----------
-optimal_results = []
-for _, row in df_summary.iterrows():
-    branches_str = row["Branches"]
-    if not isinstance(branches_str, str) or branches_str.strip() == "":
-        continue
-    branches = [b.strip() for b in branches_str.split(",") if b.strip()]
-    subset = df_pct_long[
-        (df_pct_long["Region"] == row["Region"]) &
-        (df_pct_long["Service_Type"] == row["Service_Type"]) &
-        (df_pct_long["Type"] == row["Type"]) &
-        (df_pct_long["Branch"].isin(branches))
-    ].copy()
-    if subset.empty:
-        continue
-    subset = subset.sort_values("Percentage", ascending=False).reset_index(drop=True)
-    subset["Cumulative_Percentage"] = subset["Percentage"].cumsum()
-    x = np.arange(1, len(subset) + 1)
-    y = subset["Cumulative_Percentage"].values
-    elbow_idx = find_elbow(x, y)
-    opt_num_branches = x[elbow_idx]
-    opt_cum_pct = y[elbow_idx]
-    opt_branches = subset.loc[:elbow_idx, "Branch"].tolist()
-    optimal_results.append({
-        "Region": row["Region"],
-        "Service_Type": row["Service_Type"],
-        "Type": row["Type"],
-        "Optimal_Num_Branches": opt_num_branches,
-        "Optimal_Cumulative_Percentage": opt_cum_pct,
-        "Branches": ", ".join(opt_branches),
-        "Branch_Names": get_branch_names(", ".join(opt_branches))
-    })
-df_optimal = pd.DataFrame(optimal_results)
+with perf.stage("bags.optimal"):
+    df_optimal = sweep.optimal_branches(thresholds, knee_method)
+    df_optimal["Branch_Names"] = optimal_sets.to_strings(branch_labels)[optimal_sets.rows(df_optimal)]
 
 # ---------- Sorting Location Requirement ----------
 df_sum_opt = df_optimal.groupby(["Region", "Type"])["Optimal_Num_Branches"].sum().reset_index()
@@ -329,19 +149,16 @@ if region_sel == "All India" and not df_optimal.empty:
     st.subheader("🇮🇳 All India Summary")
     
     # Calculate total units - sum of all service types across all regions for selected type
-    total_units_all = df_abs[df_abs["Type"] == type_sel]["Total"].sum()
+    total_units_all = df_totals.xs(type_sel, level="Type").sum()
     
     # Calculate total units through optimal branches for the selected type only
     total_units_through_optimal = 0
-    for _, row in df_optimal[df_optimal["Type"] == type_sel].iterrows():
-        # Get total units for this service type
-        total_process = df_abs[
-            (df_abs["Region"] == row["Region"]) &
-            (df_abs["Type"] == row["Type"]) &
-            (df_abs["Service_Type"] == row["Service_Type"])
-        ]["Total"].iloc[0]
+    with perf.stage("bags.all_india"):
+        for _, row in df_optimal[df_optimal["Type"] == type_sel].iterrows():
+            # Get total units for this service type
+            total_process = df_totals[row["Region"], row["Service_Type"], row["Type"]]
         
-        total_units_through_optimal += total_process * row["Optimal_Cumulative_Percentage"] / 100
+            total_units_through_optimal += total_process * row["Optimal_Cumulative_Percentage"] / 100
     
     # Calculate percentage
     pct_through_optimal_all = (total_units_through_optimal / total_units_all * 100) if total_units_all > 0 else 0
@@ -376,20 +193,17 @@ if region_sel == "All India":
     df_display = df_fd[df_fd["Type"] == type_sel].copy()
     
     # Get total units for regions that exist in df_display
-    region_totals = df_abs[df_abs["Type"] == type_sel].groupby("Region")["Total"].sum()
+    region_totals = df_totals.xs(type_sel, level="Type").groupby(level="Region").sum()
     df_display["Total_Units"] = df_display["Region"].map(region_totals).fillna(0)
 
     # Compute Optimal Units per region for the selected type
     region_opt_units = {}
-    for _, row in df_optimal[df_optimal["Type"] == type_sel].iterrows():
-        total_process = df_abs[
-            (df_abs["Region"] == row["Region"]) &
-            (df_abs["Type"] == row["Type"]) &
-            (df_abs["Service_Type"] == row["Service_Type"])
-        ]["Total"].iloc[0]
-        region_opt_units[row["Region"]] = region_opt_units.get(row["Region"], 0) + (
-            total_process * row["Optimal_Cumulative_Percentage"] / 100
-        )
+    with perf.stage("bags.all_india"):
+        for _, row in df_optimal[df_optimal["Type"] == type_sel].iterrows():
+            total_process = df_totals[row["Region"], row["Service_Type"], row["Type"]]
+            region_opt_units[row["Region"]] = region_opt_units.get(row["Region"], 0) + (
+                total_process * row["Optimal_Cumulative_Percentage"] / 100
+            )
 
     df_display["Optimal_Units"] = df_display["Region"].map(region_opt_units).fillna(0)
     df_display["Optimal_%"] = np.where(
@@ -410,15 +224,12 @@ if region_sel == "All India":
 else:
     df_display = df_fd[(df_fd["Region"] == region_sel) & (df_fd["Type"] == type_sel)].copy()
     if not df_display.empty:
-        total_units = df_abs[(df_abs["Region"] == region_sel) & (df_abs["Type"] == type_sel)]["Total"].sum()
+        total_units = df_totals.xs((region_sel, type_sel), level=["Region", "Type"]).sum()
         opt_units = 0
-        for _, row in df_optimal[(df_optimal["Region"] == region_sel) & (df_optimal["Type"] == type_sel)].iterrows():
-            total_process = df_abs[
-                (df_abs["Region"] == row["Region"]) &
-                (df_abs["Type"] == row["Type"]) &
-                (df_abs["Service_Type"] == row["Service_Type"])
-            ]["Total"].iloc[0]
-            opt_units += total_process * row["Optimal_Cumulative_Percentage"] / 100
+        with perf.stage("bags.region_units"):
+            for _, row in df_optimal[(df_optimal["Region"] == region_sel) & (df_optimal["Type"] == type_sel)].iterrows():
+                total_process = df_totals[row["Region"], row["Service_Type"], row["Type"]]
+                opt_units += total_process * row["Optimal_Cumulative_Percentage"] / 100
         overall_pct = (opt_units / total_units * 100) if total_units > 0 else 0
         df_display["Total_Units"] = total_units
         df_display["Optimal_Units"] = opt_units
@@ -435,51 +246,102 @@ else:
     else:
         st.info("No sorting data for this Region × Type")
 
+# ---------- Joint Threshold Grid ----------
+st.subheader("🗺️ Volume × Billed Wt Threshold Grid")
+
+# Grid files are pipeline artifacts (python pipeline.py threshold_grid --knee-method ...); the app only reads them
+@st.cache_data(max_entries=4)
+def load_grid(path, fingerprint):
+    return load_threshold_grid(path)
+
+@st.cache_data(max_entries=2)
+def all_data_sha1(fingerprint):
+    return file_sha1("all_data.csv")
+
+grid = None
+grid_path = threshold_grid_path(knee_method, target_pct)
+grid_command = f"python pipeline.py threshold_grid --knee-method {knee_method}"
+if knee_method == "target":
+    grid_command += f" --target-pct {target_pct:g}"
+with perf.stage("bags.threshold_grid"):
+    if os.path.exists(grid_path):
+        grid = load_grid(grid_path, _file_fingerprint(grid_path))
+
+if grid is None:
+    st.info(f"No threshold grid for the {KNEE_LABELS[knee_method]} method yet. Build it with `{grid_command}`.")
+else:
+    if "source" in grid and str(grid["source"]) != all_data_sha1(all_data_key):
+        st.warning(f"The threshold grid was built from an older all_data.csv. Rebuild it with `{grid_command}`.")
+    grid_metrics = {
+        "Sorting Locations Needed (Volume + Billed Wt)": "sorting_location_needed",
+        "Sorting Locations Needed (Volume)": "sorting_location_needed_volume",
+        "Sorting Locations Needed (Billed Wt)": "sorting_location_needed_billed_wt",
+        "% Through Optimal (Volume)": "pct_through_optimal_volume",
+        "% Through Optimal (Billed Wt)": "pct_through_optimal_billed_wt",
+    }
+    grid_metric = st.selectbox("Grid Metric", list(grid_metrics))
+    grid_regions = list(grid["regions"])
+    if region_sel in grid_regions:
+        grid_values = grid[grid_metrics[grid_metric]][grid_regions.index(region_sel)]
+        fig, ax = plt.subplots(figsize=(6, 4))
+        mesh = ax.pcolormesh(grid["volume_thresholds"], grid["billed_wt_thresholds"], grid_values.T, shading="nearest")
+        ax.scatter(vol_thresh, wt_thresh, color="red", marker="x", zorder=5, label="Current Thresholds")
+        ax.set_xlabel("Volume Threshold", fontsize=8)
+        ax.set_ylabel("Billed Wt Threshold", fontsize=8)
+        ax.set_title(f"{grid_metric} — {region_sel} ({KNEE_LABELS[knee_method]})", fontsize=10)
+        ax.tick_params(axis='both', labelsize=8)
+        ax.legend(fontsize=8)
+        fig.colorbar(mesh, ax=ax)
+        st.pyplot(fig)
+    else:
+        st.info("No threshold grid data for this region")
+
 # ---------- Comprehensive Service Type Summary ----------
 st.subheader("📈 Comprehensive Service Type Summary")
 
 # Create comprehensive summary table
 comprehensive_results = []
-for (region, stype, type_), group in df_merge.groupby(["Region", "Service_Type", "Type"]):
-    if region_sel != "All India" and region != region_sel:
-        continue
-    if type_ != type_sel:
-        continue
-    
-    # Get total units for this service type
-    total_units = group["Value"].sum()
-    
-    # Get threshold and filtered data
-    thresh = thresholds.get(type_, 0)
-    filtered = group[group["Value"] >= thresh]
-    num_branches_threshold = len(filtered)
-    pct_through_threshold = filtered["Percentage"].sum() if not filtered.empty else 0
-    units_through_threshold = filtered["Value"].sum() if not filtered.empty else 0
-    
-    # Get optimal branches data
-    opt_row = df_optimal[(df_optimal["Region"] == region) & 
-                        (df_optimal["Service_Type"] == stype) & 
-                        (df_optimal["Type"] == type_)]
-    if not opt_row.empty:
-        opt_num_branches = opt_row.iloc[0]["Optimal_Num_Branches"]
-        opt_pct = opt_row.iloc[0]["Optimal_Cumulative_Percentage"]
-        opt_units = total_units * opt_pct / 100
-    else:
-        opt_num_branches = 0
-        opt_pct = 0
-        opt_units = 0
+with perf.stage("bags.comprehensive_summary"):
+    for (region, stype, type_), group in df_long.groupby(["Region", "Service_Type", "Type"], observed=True):
+        if region_sel != "All India" and region != region_sel:
+            continue
+        if type_ != type_sel:
+            continue
     
-    comprehensive_results.append({
-        "Region": region,
-        "Service_Type": stype,
-        "Total_Units": total_units,
-        "Threshold_Branches": num_branches_threshold,
-        "Pct_Through_Threshold": round(pct_through_threshold, 2),
-        "Units_Through_Threshold": round(units_through_threshold, 0),
-        "Optimal_Branches": opt_num_branches,
-        "Pct_Through_Optimal": round(opt_pct, 2),
-        "Units_Through_Optimal": round(opt_units, 0)
-    })
+        # Get total units for this service type
+        total_units = group["Value"].sum()
+    
+        # Get threshold and filtered data
+        thresh = thresholds.get(type_, 0)
+        filtered = group[group["Value"] >= thresh]
+        num_branches_threshold = len(filtered)
+        pct_through_threshold = filtered["Percentage"].sum() if not filtered.empty else 0
+        units_through_threshold = filtered["Value"].sum() if not filtered.empty else 0
+    
+        # Get optimal branches data
+        opt_row = df_optimal[(df_optimal["Region"] == region) & 
+                            (df_optimal["Service_Type"] == stype) & 
+                            (df_optimal["Type"] == type_)]
+        if not opt_row.empty:
+            opt_num_branches = opt_row.iloc[0]["Optimal_Num_Branches"]
+            opt_pct = opt_row.iloc[0]["Optimal_Cumulative_Percentage"]
+            opt_units = total_units * opt_pct / 100
+        else:
+            opt_num_branches = 0
+            opt_pct = 0
+            opt_units = 0
+    
+        comprehensive_results.append({
+            "Region": region,
+            "Service_Type": stype,
+            "Total_Units": total_units,
+            "Threshold_Branches": num_branches_threshold,
+            "Pct_Through_Threshold": round(pct_through_threshold, 2),
+            "Units_Through_Threshold": round(units_through_threshold, 0),
+            "Optimal_Branches": opt_num_branches,
+            "Pct_Through_Optimal": round(opt_pct, 2),
+            "Units_Through_Optimal": round(opt_units, 0)
+        })
 
 df_comprehensive = pd.DataFrame(comprehensive_results)
 
@@ -540,6 +402,22 @@ if not optimal_display.empty:
 else:
     st.info("No optimal branch data available for the selected filters")
 
+with st.expander("Compare knee methods"):
+    # Expander bodies run even when collapsed; only build the other methods' tables on request
+    if st.checkbox("Show every method", value=False, key="compare_knees"):
+        knee_frames = []
+        for method in KNEE_METHODS:
+            df_knee = sweep.summary(thresholds, method)
+            df_knee = df_knee[(df_knee["Type"] == type_sel) & (df_knee["Num_Branches"] > 0)]
+            if region_sel != "All India":
+                df_knee = df_knee[df_knee["Region"] == region_sel]
+            knee_frames.append(df_knee.set_index(["Region", "Service_Type"])[
+                ["Optimal_Num_Branches", "Optimal_Cumulative_Percentage"]
+            ].rename(columns=lambda c: (KNEE_LABELS[method], c.replace("Optimal_", ""))))
+        df_knees = pd.concat(knee_frames, axis=1)
+        df_knees.columns = pd.MultiIndex.from_tuples(df_knees.columns)
+        st.dataframe(df_knees.round(2), use_container_width=True)
+
 # ---------- Service Type Analysis ----------
 st.subheader("📊 Service Type Analysis")
 
@@ -553,6 +431,14 @@ else:
 
 service_types = bag_view["Service_Type"].unique()
 
+# plots.py writes every group's elbow plot with a manifest; a plot drawn from the same curve and elbow is served as is
+@st.cache_data
+def load_manifest(mtime):
+    return load_elbow_manifest(ELBOW_PLOT_DIR)
+
+manifest_path = os.path.join(ELBOW_PLOT_DIR, ELBOW_MANIFEST)
+elbow_manifest = load_manifest(os.path.getmtime(manifest_path)) if os.path.exists(manifest_path) else {}
+
 if region_sel == "All India":
     st.info("Elbow plots and optimal branches are not available for All India view. Please select a specific region.")
 else:
@@ -568,13 +454,13 @@ else:
 
                 # Plot
                 if not subset.empty and not opt_subset.empty:
-                    branches = [b.strip() for b in subset.iloc[0]["Branches"].split(",") if b.strip()]
-                    sub_pct = df_pct_long[
-                        (df_pct_long["Region"] == region_sel) &
-                        (df_pct_long["Service_Type"] == stype) &
-                        (df_pct_long["Type"] == type_sel) &
-                        (df_pct_long["Branch"].isin(branches))
-                    ].copy()
+                    branches = bag_sets.codes(bag_sets.rows(subset)[0])
+                    sub_pct = df_long[
+                        (df_long["Region"] == region_sel) &
+                        (df_long["Service_Type"] == stype) &
+                        (df_long["Type"] == type_sel) &
+                        (df_long["Branch"].isin(branches))
+                    ][["Branch", "Percentage"]].copy()
 
                     if not sub_pct.empty:
                         sub_pct = sub_pct.sort_values("Percentage", ascending=False).reset_index(drop=True)
@@ -583,49 +469,49 @@ else:
                         y = sub_pct["Cumulative_Percentage"].values
 
                         if len(x) > 1:
-                            elbow_idx = find_elbow(x, y)
-                            opt_num_branches = x[elbow_idx]
-                            opt_cum_pct = y[elbow_idx]
-
-                            fig, ax = plt.subplots(figsize=(4, 3))
-                            ax.plot(x, y, marker="o", label="Cumulative %")
-                            ax.axvline(opt_num_branches, color="r", linestyle="--")
-                            ax.axhline(opt_cum_pct, color="r", linestyle="--")
-                            ax.scatter(opt_num_branches, opt_cum_pct, color="red", zorder=5, label="Elbow Point")
-                            ax.text(opt_num_branches, opt_cum_pct,
-                                    f"Opt = {opt_num_branches}\nCum% = {opt_cum_pct:.2f}",
-                                    fontsize=8, ha="left", va="bottom", color="red")
-                            ax.set_title(stype, fontsize=10)
-                            ax.set_xlabel("Branches", fontsize=8)
-                            ax.set_ylabel("Cum%", fontsize=8)
-                            ax.tick_params(axis='both', labelsize=8)
-                            ax.legend(fontsize=8)
-                            st.pyplot(fig)
+                            with perf.stage("bags.elbow_search"):
+                                elbow_idx = find_knees(y[None, :], [len(y)], knee_method, target_pct)[0]
+                                opt_num_branches = x[elbow_idx]
+                                opt_cum_pct = y[elbow_idx]
+
+                            plot_path = elbow_plot_path(region_sel, stype, type_sel)
+                            entry = elbow_manifest.get(os.path.basename(plot_path))
+                            if entry and entry["fingerprint"] == elbow_fingerprint(y, elbow_idx) and os.path.exists(plot_path):
+                                st.image(plot_path)
+                            else:
+                                with perf.stage("bags.elbow_plot"):
+                                    fig, ax = plt.subplots(figsize=(4, 3))
+                                    ax.plot(x, y, marker="o", label="Cumulative %")
+                                    ax.axvline(opt_num_branches, color="r", linestyle="--")
+                                    ax.axhline(opt_cum_pct, color="r", linestyle="--")
+                                    ax.scatter(opt_num_branches, opt_cum_pct, color="red", zorder=5, label="Elbow Point")
+                                    ax.text(opt_num_branches, opt_cum_pct,
+                                            f"Opt = {opt_num_branches}\nCum% = {opt_cum_pct:.2f}",
+                                            fontsize=8, ha="left", va="bottom", color="red")
+                                    ax.set_title(stype, fontsize=10)
+                                    ax.set_xlabel("Branches", fontsize=8)
+                                    ax.set_ylabel("Cum%", fontsize=8)
+                                    ax.tick_params(axis='both', labelsize=8)
+                                    ax.legend(fontsize=8)
+                                    st.pyplot(fig)
 
                 # Optimal branches in expander
                 if not opt_subset.empty:
                     with st.expander(f"Show Optimal Branches ({stype})"):
-                        branch_codes_str = opt_subset.iloc[0]["Branches"]
-                        branch_names_str = get_branch_names(branch_codes_str)
-                        if branch_names_str:
+                        branch_codes = optimal_sets.codes(optimal_sets.rows(opt_subset)[0])
+                        if branch_codes:
                             # Create a DataFrame with code, name, and amount for selected type
-                            branch_codes = [b.strip() for b in branch_codes_str.split(",") if b.strip()]
                             branch_data = []
-                            # Get the source row for amounts for this Region × Service_Type × Type
-                            src_rows = df_abs[
-                                (df_abs["Region"] == region_sel) &
-                                (df_abs["Service_Type"] == stype) &
-                                (df_abs["Type"] == type_sel)
+                            # Branch amounts for this Region × Service_Type × Type
+                            src_rows = df_long[
+                                (df_long["Region"] == region_sel) &
+                                (df_long["Service_Type"] == stype) &
+                                (df_long["Type"] == type_sel)
                             ]
-                            src_row = src_rows.iloc[0] if not src_rows.empty else None
+                            amounts = dict(zip(src_rows["Branch"].astype(object), src_rows["Value"]))
                             for code in branch_codes:
                                 name = branch_name_mapping.get(code, "Name not found")
-                                amount = 0.0
-                                if src_row is not None and code in src_row.index:
-                                    try:
-                                        amount = float(src_row[code])
-                                    except Exception:
-                                        amount = 0.0
+                                amount = float(np.nan_to_num(amounts.get(code, 0.0)))
                                 branch_data.append({
                                     "Branch Code": code,
                                     "Branch Name": name,
@@ -641,8 +527,30 @@ else:
 st.subheader("🔄 Flow Analysis")
 
 # Calculate dynamic flow analysis based on current thresholds and optimal branches
-flow_matrix, optimal_matrix, non_optimal_matrix, optimal_pct_matrix, non_optimal_pct_matrix = calculate_dynamic_flow_analysis(df_abs, df_optimal, type_sel)
-total_receiving, optimal_receiving, non_optimal_receiving, optimal_pct, non_optimal_pct = calculate_dynamic_receiving_analysis(df_abs, df_optimal, type_sel)
+# The flow state survives reruns, so a slider move only applies the memberships that entered or left
+def _memberships(sets):
+    return [(region, stype, branch) for region, stype, type_, branch in sets.members() if type_ == type_sel]
+
+flow_key = f"flow_analysis_{type_sel}"
+with perf.stage("bags.flow_analysis"):
+    flow_state = st.session_state.get(flow_key)
+    if flow_state is None or flow_state["source"] != all_data_key:
+        flow_state = st.session_state[flow_key] = {
+            "source": all_data_key,
+            "analysis": FlowAnalysis(long_to_wide(df_long), optimal_sets, type_sel),
+            "sets": optimal_sets,
+        }
+    elif flow_state["sets"] is not optimal_sets:
+        previous = flow_state["sets"]
+        flow_state["analysis"].apply(
+            _memberships(optimal_sets.difference(previous)), _memberships(previous.difference(optimal_sets))
+        )
+        flow_state["sets"] = optimal_sets
+    flow = flow_state["analysis"].tables()
+flow_matrix, optimal_matrix, non_optimal_matrix = flow["flow"], flow["optimal"], flow["non_optimal"]
+optimal_pct_matrix, non_optimal_pct_matrix = flow["optimal_pct"], flow["non_optimal_pct"]
+total_receiving, optimal_receiving, non_optimal_receiving = flow["receiving"], flow["optimal_receiving"], flow["non_optimal_receiving"]
+optimal_pct, non_optimal_pct = flow["optimal_receiving_pct"], flow["non_optimal_receiving_pct"]
 
 if region_sel == "All India":
     # All India Flow Analysis
@@ -795,3 +703,5 @@ else:
         st.dataframe(incoming_df, use_container_width=True)
     else:
         st.info("No incoming flow data available for this region.")
+
+perf.sidebar_panel()
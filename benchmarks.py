@@ -0,0 +1,526 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import algorithms
+import processing
+import synthetic
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# =========================
+# filter_and_sum: CSV vs Binary Store
+# =========================
+def bench_filter_and_sum(csv_path="data.csv", repeat=5):
+    """Time a filter_and_sum query cold (CSV conversion), warm from disk, warm in-process and cached"""
+    query = dict(type_="Billed Wt", service_type="Air White", org_region="BBI")
+
+    # Cold: no binary store on disk, so the CSV is parsed and converted
+    store_dir = algorithms._store_dir(csv_path, algorithms.CACHE_DIR)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    algorithms._STORES.clear()
+    algorithms._CUBES.clear()
+    algorithms._cached_cube_sum.cache_clear()
+    cold_result, cold = _timed(algorithms.filter_and_sum, csv_path=csv_path, **query)
+
+    # Warm from disk: store exists, process has not loaded it (or built the cube) yet
+    disk_times = []
+    for _ in range(repeat):
+        algorithms._STORES.clear()
+        algorithms._CUBES.clear()
+        algorithms._cached_cube_sum.cache_clear()
+        _, t = _timed(algorithms.filter_and_sum, csv_path=csv_path, **query)
+        disk_times.append(t)
+
+    # Warm in-process: store memory-mapped and rollup cube built, result cache cleared
+    mem_times = []
+    for _ in range(repeat):
+        algorithms._cached_cube_sum.cache_clear()
+        warm_result, t = _timed(algorithms.filter_and_sum, csv_path=csv_path, **query)
+        mem_times.append(t)
+
+    # Repeat query: answered by the LRU result cache
+    lru_times = []
+    for _ in range(repeat):
+        _, t = _timed(algorithms.filter_and_sum, csv_path=csv_path, **query)
+        lru_times.append(t)
+
+    # Reference: the plain CSV parse every query used to pay
+    _, csv_parse = _timed(algorithms.read_matrix_csv, csv_path)
+
+    assert cold_result == warm_result
+    return {
+        "csv_parse_s": csv_parse,
+        "cold_s": cold,
+        "warm_disk_s": min(disk_times),
+        "warm_memory_s": min(mem_times),
+        "lru_hit_s": min(lru_times),
+        "store_bytes": sum(
+            os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir)
+        ),
+    }
+
+
+# =========================
+# filter_and_sum_many: batch vs per-query
+# =========================
+def bench_filter_and_sum_many(csv_path="data.csv"):
+    """Time one batch over every origin branch x destination region against a per-query loop"""
+    store = algorithms.load_matrix_store(csv_path)
+    branches = [b for b in store["row_dims"]["org_branch_code"] if isinstance(b, str)]
+    regions = [r for r in store["col_dims"]["des_region"] if isinstance(r, str)]
+    specs = [dict(org_branch_code=b, des_region=r) for b in branches for r in regions]
+
+    algorithms._cached_cube_sum.cache_clear()
+    batch, batch_s = _timed(algorithms.filter_and_sum_many, specs, csv_path)
+
+    algorithms._cached_cube_sum.cache_clear()
+    start = time.perf_counter()
+    looped = [algorithms.filter_and_sum(csv_path=csv_path, **spec) for spec in specs]
+    loop_s = time.perf_counter() - start
+
+    assert np.allclose(batch["sum"].to_numpy(), looped)
+    return {"queries": len(specs), "batch_s": batch_s, "loop_s": loop_s}
+
+
+# =========================
+# build_optimal_branches: scale
+# =========================
+def bench_optimal_branches(n_groups=2000, n_branches=1000, seed=0):
+    """Time build_optimal_branches on a synthetic long frame with many groups and branches"""
+    rng = np.random.default_rng(seed)
+    branches = np.array([f"B{i:05d}" for i in range(n_branches)])
+    pct = rng.pareto(1.5, size=(n_groups, n_branches))
+    pct = pct / pct.sum(axis=1, keepdims=True) * 100
+
+    df_pct_long = pd.DataFrame({
+        "Region": np.repeat([f"R{g // 6:04d}" for g in range(n_groups)], n_branches),
+        "Type": np.repeat(["Volume", "Billed Wt"] * (n_groups // 2) + ["Volume"] * (n_groups % 2), n_branches),
+        "Service_Type": np.repeat([f"S{g % 3}" for g in range(n_groups)], n_branches),
+        "Branch": np.tile(branches, n_groups),
+        "Percentage": pct.ravel(),
+    })
+    df_bag = (
+        df_pct_long[df_pct_long["Percentage"] >= 0.01]
+        .groupby(["Region", "Service_Type", "Type"])["Branch"].agg(", ".join)
+        .rename("Branches").reset_index()
+    )
+    _, seconds = _timed(processing.build_optimal_branches, df_bag, df_pct_long)
+    return {"groups": len(df_bag), "rows": len(df_pct_long), "build_s": seconds}
+
+
+# =========================
+# Long table: peak and retained memory
+# =========================
+def _traced(fn):
+    """(result, retained MB, peak MB) of a call, from tracemalloc"""
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained / 2**20, peak / 2**20
+
+
+def bench_long_table():
+    """Memory of load_data's five frames against the canonical long table, and derived vs read percentages"""
+    _, before_retained, before_peak = _traced(processing.load_data)
+    df_long, after_retained, after_peak = _traced(processing.load_long_table)
+
+    _, derive_s = _timed(processing.load_long_table)
+    _, read_pct_s = _timed(processing.load_long_table, pct_path=processing.PCT_PATH)
+    return {
+        "rows": len(df_long),
+        "before_peak_mb": before_peak,
+        "before_kept_mb": before_retained,
+        "after_peak_mb": after_peak,
+        "after_kept_mb": after_retained,
+        "derived_pct_s": derive_s,
+        "read_pct_csv_s": read_pct_s,
+    }
+
+
+# =========================
+# ThresholdSweep: lookup speed
+# =========================
+def bench_threshold_sweep(pairs=((25, 35), (0, 0), (100, 100), (5, 10), (60, 80), (37, 13))):
+    """Time sweep lookups against build_bag_summary / build_optimal_branches at several slider positions"""
+    df_long = processing.load_long_table()
+    df_pct_long = df_long[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    sweep, init_s = _timed(processing.ThresholdSweep, df_long)
+
+    result = {"init_s": init_s, "lookup_s": 0.0, "rebuild_s": 0.0}
+    for vol, wt in pairs:
+        thresholds = {"Volume": vol, "Billed Wt": wt}
+        _, lookup_s = _timed(lambda: (sweep.bag_summary(thresholds), sweep.optimal_branches(thresholds)))
+        bag, bag_s = _timed(processing.build_bag_summary, df_long, thresholds)
+        _, optimal_s = _timed(processing.build_optimal_branches, bag, df_pct_long)
+        result["lookup_s"] += lookup_s
+        result["rebuild_s"] += bag_s + optimal_s
+    return result
+
+
+# =========================
+# Knee methods: lazy tables + comparison
+# =========================
+def bench_knee_methods(pairs=((25, 35), (0, 0), (60, 80))):
+    """Time each knee method's sweep tables (built on first use) and compare_knees"""
+    df_long = processing.load_long_table()
+    df_pct_long = df_long[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    sweep, init_s = _timed(processing.ThresholdSweep, df_long)
+
+    result = {"init_s": init_s}
+    for method in processing.KNEE_METHODS:
+        _, result[f"{method}_s"] = _timed(sweep.knee_tables, method)
+    result["compare_s"] = 0.0
+    for vol, wt in pairs:
+        bag = processing.build_bag_summary(df_long, {"Volume": vol, "Billed Wt": wt})
+        _, compare_s = _timed(processing.compare_knees, bag, df_pct_long)
+        result["compare_s"] += compare_s
+    return result
+
+
+# =========================
+# Flow analysis: full build + incremental updates
+# =========================
+def bench_flow_analysis():
+    """Time build_flow_analysis from all_data.csv and optimal_branches.csv"""
+    df_abs = pd.read_csv("all_data.csv")
+    df_optimal = pd.read_csv("optimal_branches.csv")
+    _, seconds = _timed(processing.build_flow_analysis, df_abs, df_optimal)
+    return {"build_s": seconds}
+
+
+def bench_flow_updates(steps=((25, 35), (26, 35), (26, 40), (0, 0), (25, 35))):
+    """Time FlowAnalysis.apply of BranchSets diffs, FlowAnalysis.update and full rebuilds over a series of thresholds"""
+    df_long = processing.load_long_table()
+    df_abs = processing.long_to_wide(df_long)
+    sweep = processing.ThresholdSweep(df_long)
+    optimal = [sweep.branch_sets({"Volume": vol, "Billed Wt": wt})[1] for vol, wt in steps]
+
+    result = {"updates": 0, "cells": 0, "apply_s": 0.0, "update_s": 0.0, "rebuild_s": 0.0}
+    for type_name in df_abs["Type"].unique():
+        def memberships(sets):
+            return [(r, s, b) for r, s, t, b in sets.members() if t == type_name]
+
+        analysis = processing.FlowAnalysis(df_abs, optimal[0], type_name)
+        full = processing.FlowAnalysis(df_abs, optimal[0], type_name)
+        for previous, sets in zip(optimal, optimal[1:]):
+            cells, apply_s = _timed(
+                analysis.apply, memberships(sets.difference(previous)), memberships(previous.difference(sets))
+            )
+            _, update_s = _timed(full.update, sets)
+            _, rebuild_s = _timed(processing.build_flow_tensor, df_abs, sets, type_name)
+            result["updates"] += 1
+            result["cells"] += cells
+            result["apply_s"] += apply_s
+            result["update_s"] += update_s
+            result["rebuild_s"] += rebuild_s
+    return result
+
+
+# =========================
+# Sparse OD storage: memory + time
+# =========================
+def _synthetic_wide_table(n_service_types, n_branches, density, rng):
+    regions = sorted(set(processing.BRANCH_PREFIX_REGION.values()))
+    prefixes = list(processing.BRANCH_PREFIX_REGION)
+    branches = [f"{prefixes[i % len(prefixes)]}{i:04d}" for i in range(n_branches)]
+    ids = pd.DataFrame(
+        [(r, t, f"S{s:03d}") for r in regions for t in ("Volume", "Billed Wt") for s in range(n_service_types)],
+        columns=["Region", "Type", "Service_Type"],
+    )
+    values = np.where(rng.random((len(ids), n_branches)) < density, rng.pareto(1.5, (len(ids), n_branches)) * 50, 0.0)
+    totals = values.sum(axis=1)
+    df_abs = pd.concat([ids, pd.DataFrame(values, columns=branches)], axis=1)
+    df_abs["Total"] = totals
+    pct = values / np.where(totals > 0, totals, 1.0)[:, None] * 100
+    df_pct = pd.concat([ids, pd.DataFrame(pct, columns=branches)], axis=1)
+    return df_abs, df_pct
+
+
+def bench_sparse_storage(n_rows=4500, n_cols=3000, n_service_types=60, n_branches=3000, density=0.02, seed=0):
+    """Dense vs sparse memory and run time for the rollup cube, bag summary and flow analysis at branch-level scale"""
+    rng = np.random.default_rng(seed)
+    result = {}
+
+    # data.csv block: origin branch/product rows x type/destination branch columns
+    dense = synthetic.synthetic_store(n_rows, n_cols, density, rng)
+    csr, result["store_to_csr_s"] = _timed(algorithms.to_csr, dense["values"])
+    sparse = {k: v for k, v in dense.items() if k != "values"}
+    sparse["csr"] = csr
+    cube_dense, result["cube_dense_s"] = _timed(algorithms.build_rollup_cube, dense)
+    cube_sparse, result["cube_sparse_s"] = _timed(algorithms.build_rollup_cube, sparse)
+    assert np.allclose(cube_dense["prefix"], cube_sparse["prefix"])
+    result["store_dense_mb"] = dense["values"].nbytes / 2**20
+    result["store_sparse_mb"] = sum(csr[k].nbytes for k in ("indptr", "indices", "data")) / 2**20
+
+    # all_data.csv layout: (region, type, service type) rows x destination branch columns
+    df_abs, df_pct = _synthetic_wide_table(n_service_types, n_branches, density, rng)
+    table, result["table_to_sparse_s"] = _timed(processing.to_sparse_table, df_abs, df_pct)
+    df_merge = df_abs.melt(id_vars=processing.FLOW_ID_COLUMNS, var_name="Branch", value_name="Value").merge(
+        df_pct.melt(id_vars=["Region", "Type", "Service_Type"], var_name="Branch", value_name="Percentage"),
+        on=["Region", "Type", "Service_Type", "Branch"],
+    )
+    result["wide_dense_mb"] = (
+        df_abs.memory_usage(deep=True).sum() + df_pct.memory_usage(deep=True).sum()
+        + df_merge.memory_usage(deep=True).sum()
+    ) / 2**20
+    result["wide_sparse_mb"] = (
+        table["ids"].memory_usage(deep=True).sum()
+        + sum(table["values"][k].nbytes for k in ("indptr", "indices", "data")) + table["percentages"].nbytes
+    ) / 2**20
+
+    thresholds = {"Volume": 25, "Billed Wt": 35}
+    bag_dense, result["bag_dense_s"] = _timed(processing.build_bag_summary, df_merge, thresholds)
+    bag_sparse, result["bag_sparse_s"] = _timed(processing.build_sparse_bag_summary, table, thresholds)
+    assert (bag_dense["Branches"].to_numpy() == bag_sparse["Branches"].to_numpy()).all()
+
+    df_optimal = processing.build_optimal_branches(bag_sparse, df_merge[["Region", "Type", "Service_Type", "Branch", "Percentage"]])
+    (flow_dense, _), result["flow_dense_s"] = _timed(processing.build_flow_analysis, df_abs, df_optimal)
+    (flow_sparse, _), result["flow_sparse_s"] = _timed(processing.build_flow_analysis, table, df_optimal)
+    assert np.allclose(flow_dense["Optimal_Flow_Units"], flow_sparse["Optimal_Flow_Units"])
+    return result
+
+
+# =========================
+# OD flows (map arcs)
+# =========================
+def bench_od_flows(n_rows=3000, n_cols=2000, density=0.02, top_k=25, seed=0):
+    """Time store_flows on the dense and sparse forms of the same synthetic matrix"""
+    rng = np.random.default_rng(seed)
+    dense = synthetic.synthetic_store(n_rows, n_cols, density, rng)
+    sparse = {k: v for k, v in dense.items() if k != "values"}
+    sparse["csr"] = algorithms.to_csr(dense["values"])
+    origin = dense["row_dims"]["org_region"][1]
+    type_ = dense["col_dims"]["type"][0]
+
+    flows, dense_s = _timed(algorithms.store_flows, dense, "org_branch_code", "des_region", top_k,
+                            org_region=origin, type_=type_)
+    _, sparse_s = _timed(algorithms.store_flows, sparse, "org_branch_code", "des_region", top_k,
+                         org_region=origin, type_=type_)
+    return {"flows": len(flows), "dense_s": dense_s, "sparse_s": sparse_s}
+
+
+# =========================
+# Map rendering: per-marker HTML vs GeoJSON layer
+# =========================
+def bench_map_rendering(location_path="branch_locations.csv"):
+    """HTML size and build+render time of create_interactive_map vs create_geojson_map"""
+    import geoplot  # streamlit/folium are only needed for this benchmark
+
+    branches_df, org_summary, des_summary = geoplot.load_data()
+    locations = pd.read_csv(location_path)
+    totals = geoplot.build_branch_totals(org_summary, des_summary)
+    result = {"locations": len(locations)}
+    for mode, create in (("markers", geoplot.create_interactive_map), ("geojson", geoplot.create_geojson_map)):
+        start = time.perf_counter()
+        html = create(locations, org_summary, des_summary, None, None, None, totals).get_root().render()
+        result[f"{mode}_s"] = time.perf_counter() - start
+        result[f"{mode}_kb"] = len(html.encode()) / 1024
+    return result
+
+
+# =========================
+# Scaling: synthetic inputs vs stored baselines
+# =========================
+# (n_regions, n_branches, n_service_types); "today" is roughly the shipped network
+SCALING_SIZES = {
+    "small": (10, 190, 3),
+    "today": (19, 380, 3),
+    "2x": (19, 760, 6),
+    "4x": (19, 1520, 6),
+}
+BASELINE_PATH = "benchmark_baseline.json"
+THRESHOLDS = {"Volume": 25, "Billed Wt": 35}
+
+
+def _measured(fn, reset=None):
+    """(result, seconds, peak MB): one plain timed run, then one traced run for memory"""
+    if reset:
+        reset()
+    result, seconds = _timed(fn)
+    if reset:
+        reset()
+    _, _, peak = _traced(fn)
+    return result, seconds, peak
+
+
+def _clear_store(csv_path):
+    shutil.rmtree(algorithms._store_dir(csv_path, algorithms.CACHE_DIR), ignore_errors=True)
+    algorithms._STORES.clear()
+    algorithms._CUBES.clear()
+    algorithms._cached_cube_sum.cache_clear()
+
+
+def bench_scaling_size(n_regions, n_branches, n_service_types, density=0.05, seed=0):
+    """Time and peak memory of each pipeline stage on one synthetic network"""
+    with tempfile.TemporaryDirectory() as out_dir:
+        paths = synthetic.write_synthetic_data(out_dir, n_regions, n_branches, n_service_types, density, seed)
+        csv_path = paths["data"]
+        query = dict(type_="Billed Wt", service_type="Air Red", org_region=processing.BRANCH_PREFIX_REGION["A"])
+        result = {"rows": paths["rows"], "columns": paths["columns"]}
+
+        def record(stage, fn, reset=None):
+            value, result[f"{stage}_s"], result[f"{stage}_mb"] = _measured(fn, reset)
+            return value
+
+        try:
+            record("store_build", lambda: algorithms.filter_and_sum(csv_path=csv_path, **query),
+                   lambda: _clear_store(csv_path))
+            record("filter_sum", lambda: algorithms.filter_and_sum(csv_path=csv_path, **query),
+                   algorithms._cached_cube_sum.cache_clear)
+        finally:
+            _clear_store(csv_path)
+        record("all_data", lambda: processing.build_all_data(algorithms.read_matrix_csv(csv_path)))
+        df_long = record("long_table", lambda: processing.load_long_table(paths["all_data"]))
+        df_bag = record("bag_summary", lambda: processing.build_bag_summary(df_long, THRESHOLDS))
+        df_optimal = record("optimal", lambda: processing.build_optimal_branches(df_bag, df_long))
+        record("final_sorting", lambda: processing.build_final_sorting(df_optimal, paths["des_mappings"]))
+        df_abs = pd.read_csv(paths["all_data"])
+        record("flow_analysis", lambda: processing.build_flow_analysis(df_abs, df_optimal))
+    return result
+
+
+def bench_scaling(sizes=("small", "today", "2x"), density=0.05, seed=0):
+    """bench_scaling_size for each named size in SCALING_SIZES"""
+    return {name: bench_scaling_size(*SCALING_SIZES[name], density=density, seed=seed) for name in sizes}
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_seconds=0.05, min_mb=1.0):
+    """
+    Stage timings/peaks that grew by more than tolerance over the baseline.
+
+    Growth below min_seconds / min_mb is ignored, so tiny stages do not flag
+    on timer noise. Sizes or stages missing from the baseline are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            base = baseline.get(name, {}).get(key)
+            floor = min_seconds if key.endswith("_s") else min_mb if key.endswith("_mb") else None
+            if base is None or floor is None:
+                continue
+            if value > base * (1 + tolerance) and value - base > floor:
+                regressions.append(f"{name} {key}: {base:,.4f} -> {value:,.4f} (+{(value / base - 1) * 100:.0f}%)"
+                                   if base else f"{name} {key}: 0 -> {value:,.4f}")
+    return regressions
+
+
+def run_scaling(sizes, baseline_path=BASELINE_PATH, save_baseline=False, tolerance=0.25):
+    """Print the scaling results, then compare against (or overwrite) the stored baseline; returns the regressions"""
+    results = {}
+    for name in sizes:
+        n_regions, n_branches, n_service_types = SCALING_SIZES[name]
+        print(f"Scaling: {name} ({n_regions} regions x {n_branches} branches x {n_service_types} service types)")
+        results.update(bench_scaling([name]))
+        for key, value in results[name].items():
+            print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+    if save_baseline:
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline for {', '.join(sizes)} saved to {baseline_path}")
+        return []
+    if not os.path.exists(baseline_path):
+        # Timings are machine-specific, so no baseline is shipped; record one on the machine that compares
+        print(f"No baseline at {baseline_path}; run with --save-baseline first to record one on this machine")
+        return []
+    with open(baseline_path) as f:
+        regressions = compare_to_baseline(results, json.load(f), tolerance)
+    print(f"Regressions vs {baseline_path} (tolerance {tolerance:.0%})")
+    for line in regressions or ["none"]:
+        print(f"  {line}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the sorter clubbing optimizer")
+    parser.add_argument("--csv", default="data.csv", help="Path to the OD matrix CSV")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scaling", nargs="*", choices=list(SCALING_SIZES), metavar="SIZE",
+                        help=f"Only run the synthetic scaling suite ({', '.join(SCALING_SIZES)}; default small today 2x)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Scaling baseline JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="Record the scaling results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed growth over the baseline")
+    args = parser.parse_args()
+
+    if args.scaling is not None:
+        sizes = args.scaling or ["small", "today", "2x"]
+        if run_scaling(sizes, args.baseline, args.save_baseline, args.tolerance):
+            raise SystemExit(1)
+        return
+
+    csv_path = args.csv
+    if not os.path.exists(csv_path):
+        # data.csv is not shipped; time the OD-matrix queries on a synthetic matrix of today's size instead
+        n_regions, n_branches, n_service_types = SCALING_SIZES["today"]
+        csv_path = synthetic.write_synthetic_data(
+            tempfile.mkdtemp(prefix="bench_od_"), n_regions, n_branches, n_service_types
+        )["data"]
+        print(f"{args.csv} not found; using a synthetic matrix ({n_regions} regions x {n_branches} branches)")
+
+    print(f"filter_and_sum ({os.path.basename(csv_path)} -> binary store)")
+    for key, value in bench_filter_and_sum(csv_path, args.repeat).items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+    print("build_optimal_branches (synthetic 2000 groups x 1000 branches)")
+    for key, value in bench_optimal_branches().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+    print("load_data vs load_long_table (memory)")
+    for key, value in bench_long_table().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    print("ThresholdSweep lookups vs build_bag_summary/build_optimal_branches")
+    for key, value in bench_threshold_sweep().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    print("Knee methods: sweep tables and compare_knees")
+    for key, value in bench_knee_methods().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    print("build_flow_analysis (all_data.csv, optimal_branches.csv)")
+    for key, value in bench_flow_analysis().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    print("FlowAnalysis.apply/update vs full rebuild")
+    for key, value in bench_flow_updates().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    print("Sparse vs dense OD storage (synthetic branch-level scale)")
+    for key, value in bench_sparse_storage().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+    print("store_flows dense vs sparse (synthetic, top 25)")
+    for key, value in bench_od_flows().items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    for location_path in ("branch_locations.csv", "office_location.csv"):
+        print(f"Map rendering: markers vs GeoJSON ({location_path})")
+        for key, value in bench_map_rendering(location_path).items():
+            print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+    print("filter_and_sum_many (origin branch x destination region)")
+    for key, value in bench_filter_and_sum_many(csv_path).items():
+        print(f"  {key:<16} {value:,.4f}" if isinstance(value, float) else f"  {key:<16} {value:,}")
+
+
+if __name__ == "__main__":
+    main()
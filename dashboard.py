@@ -1,8 +1,10 @@
 import streamlit as st
 import pandas as pd
-from algorithms import filter_and_sum
+from algorithms import HeaderHierarchy, filter_and_breakdown, filter_and_sum, load_rollup_cube
+import perf
 
 st.title("Data Filter and Sum UI")
+perf.sidebar_toggle()
 
 st.write("""
 This app allows you to filter the data from `data.csv` using various parameters and computes the sum of the filtered values.
@@ -10,6 +12,7 @@ This app allows you to filter the data from `data.csv` using various parameters
 
 # --- Helper to load and structure the CSV ---
 @st.cache_data
+@perf.timed
 def load_data(csv_path):
     try:
         df = pd.read_csv(csv_path, header=None, low_memory=False, skiprows=1)  # Skip first row
@@ -37,14 +40,41 @@ if row_headers is None or col_headers is None:
     st.error("Could not load data. Check CSV path or format.")
     st.stop()
 
-# --- Utility for cascading filter ---
-def cascade_options(df, filters, column):
-    """Filter DataFrame using given filters dict and return sorted unique values of column."""
-    filtered_df = df.copy()
-    for col, val in filters.items():
-        if val:
-            filtered_df = filtered_df[filtered_df[col] == val]
-    return sorted(filtered_df[column].dropna().unique())
+# --- Build the rollup cube once so "Compute Sum" is answered from partial sums ---
+@st.cache_resource
+def warm_rollup_cube(csv_path):
+    return load_rollup_cube(csv_path)[0]
+
+warm_rollup_cube(csv_path)
+
+# --- Cascading selector options, indexed once per process ---
+ORIGIN_CASCADES = {
+    'service_type': [],
+    'org_zone': [],
+    'org_region': ['org_zone'],
+    'org_city': ['org_zone', 'org_region'],
+    ('org_branch_code', 'org_branch_name'): ['org_zone', 'org_region', 'org_city'],
+    'org_product': ['service_type', 'org_zone', 'org_region', 'org_city', 'org_branch_code'],
+}
+DESTINATION_CASCADES = {
+    'type': [],
+    'des_zone': [],
+    'des_region': ['des_zone'],
+    'des_city': ['des_zone', 'des_region'],
+    ('des_branch_code', 'des_branch_name'): ['des_zone', 'des_region', 'des_city'],
+}
+
+@st.cache_resource
+def load_hierarchy(csv_path):
+    row_headers, col_headers = load_data(csv_path)
+    return HeaderHierarchy(row_headers, ORIGIN_CASCADES), HeaderHierarchy(col_headers, DESTINATION_CASCADES)
+
+origin_index, destination_index = load_hierarchy(csv_path)
+
+def branch_options(index, target, **selection):
+    """Display options ("code - name") and the branch code behind each"""
+    code_mapping = {f"{code} - {name}": code for code, name in index.options(target, **selection)}
+    return sorted(code_mapping), code_mapping
 
 # =========================
 # TYPE & SERVICE TYPE
@@ -52,12 +82,10 @@ def cascade_options(df, filters, column):
 colA, colB = st.columns(2)
 
 with colA:
-    type_values = sorted(col_headers['type'].dropna().unique())
-    type_ = st.selectbox("Type", options=[""] + type_values)
+    type_ = st.selectbox("Type", options=[""] + destination_index.options('type'))
 
 with colB:
-    service_type_values = sorted(row_headers['service_type'].dropna().unique())
-    service_type = st.selectbox("Service Type", options=[""] + service_type_values)
+    service_type = st.selectbox("Service Type", options=[""] + origin_index.options('service_type'))
 
 # =========================
 # ORIGIN PARAMETERS
@@ -66,78 +94,29 @@ st.markdown("**Origin Parameters**")
 col1, col2, col3, col4, col5 = st.columns([1, 1, 1, 1.5, 1.5])
 
 with col1:
-    zone_options = sorted(row_headers['org_zone'].dropna().unique())
-    org_zone = st.selectbox("Origin Zone", options=[""] + zone_options)
+    org_zone = st.selectbox("Origin Zone", options=[""] + origin_index.options('org_zone'))
 
 with col2:
-    def get_regions_for_zone():
-        filtered_df = row_headers.copy()
-        if org_zone:
-            filtered_df = filtered_df[filtered_df['org_zone'] == org_zone]
-        regions = filtered_df['org_region'].dropna().unique()
-        return sorted([r for r in regions if r])
-    
-    region_options = get_regions_for_zone()
+    region_options = origin_index.options('org_region', org_zone=org_zone)
     org_region = st.selectbox("Origin Region", options=[""] + region_options)
 
 with col3:
-    def get_cities_for_selection():
-        filtered_df = row_headers.copy()
-        if org_zone:
-            filtered_df = filtered_df[filtered_df['org_zone'] == org_zone]
-        if org_region:
-            filtered_df = filtered_df[filtered_df['org_region'] == org_region]
-        cities = filtered_df['org_city'].dropna().unique()
-        return sorted([c for c in cities if c])
-    
-    city_options = get_cities_for_selection()
+    city_options = origin_index.options('org_city', org_zone=org_zone, org_region=org_region)
     org_city = st.selectbox("Origin City", options=[""] + city_options)
 
 with col4:
-    def get_branch_codes_for_selection():
-        filtered_df = row_headers.copy()
-        if org_zone:
-            filtered_df = filtered_df[filtered_df['org_zone'] == org_zone]
-        if org_region:
-            filtered_df = filtered_df[filtered_df['org_region'] == org_region]
-        if org_city:
-            filtered_df = filtered_df[filtered_df['org_city'] == org_city]
-        
-        branch_data = filtered_df[['org_branch_code', 'org_branch_name']].dropna().drop_duplicates()
-        display_options = []
-        code_mapping = {}
-        for _, row in branch_data.iterrows():
-            code = row['org_branch_code']
-            name = row['org_branch_name']
-            display_text = f"{code} - {name}"
-            display_options.append(display_text)
-            code_mapping[display_text] = code
-        
-        return sorted(display_options), code_mapping
-    
-    branch_display_options, branch_code_mapping = get_branch_codes_for_selection()
+    branch_display_options, branch_code_mapping = branch_options(
+        origin_index, ('org_branch_code', 'org_branch_name'),
+        org_zone=org_zone, org_region=org_region, org_city=org_city
+    )
     org_branch_display = st.selectbox("Origin Branch", options=[""] + branch_display_options, key="org_branch_display")
     org_branch_code = branch_code_mapping.get(org_branch_display) if org_branch_display else None
 
 with col5:
-    def get_products_for_selection():
-        filtered_df = row_headers.copy()
-        
-        if service_type:
-            filtered_df = filtered_df[filtered_df['service_type'] == service_type]
-        if org_zone:
-            filtered_df = filtered_df[filtered_df['org_zone'] == org_zone]
-        if org_region:
-            filtered_df = filtered_df[filtered_df['org_region'] == org_region]
-        if org_city:
-            filtered_df = filtered_df[filtered_df['org_city'] == org_city]
-        if org_branch_code:
-            filtered_df = filtered_df[filtered_df['org_branch_code'] == org_branch_code]
-        
-        products = filtered_df['org_product'].dropna().unique()
-        return sorted([p for p in products if p])
-    
-    product_options = get_products_for_selection()
+    product_options = origin_index.options(
+        'org_product', service_type=service_type, org_zone=org_zone, org_region=org_region,
+        org_city=org_city, org_branch_code=org_branch_code
+    )
     org_product = st.selectbox("Origin Product", options=[""] + product_options)
 
 # =========================
@@ -147,43 +126,43 @@ st.markdown("**Destination Parameters**")
 col6, col7, col8, col9 = st.columns([1, 1, 1, 1.5])
 
 with col6:
-    des_zone = st.selectbox("Destination Zone", options=[""] + sorted(col_headers['des_zone'].dropna().unique()))
+    des_zone = st.selectbox("Destination Zone", options=[""] + destination_index.options('des_zone'))
 with col7:
     des_region = st.selectbox(
         "Destination Region",
-        options=[""] + cascade_options(col_headers, {'des_zone': des_zone}, 'des_region')
+        options=[""] + destination_index.options('des_region', des_zone=des_zone)
     )
 with col8:
     des_city = st.selectbox(
         "Destination City",
-        options=[""] + cascade_options(col_headers, {'des_zone': des_zone, 'des_region': des_region}, 'des_city')
+        options=[""] + destination_index.options('des_city', des_zone=des_zone, des_region=des_region)
     )
 with col9:
-    def get_des_branch_codes_for_selection():
-        filtered_df = col_headers.copy()
-        if des_zone:
-            filtered_df = filtered_df[filtered_df['des_zone'] == des_zone]
-        if des_region:
-            filtered_df = filtered_df[filtered_df['des_region'] == des_region]
-        if des_city:
-            filtered_df = filtered_df[filtered_df['des_city'] == des_city]
-        
-        branch_data = filtered_df[['des_branch_code', 'des_branch_name']].dropna().drop_duplicates()
-        display_options = []
-        code_mapping = {}
-        for _, row in branch_data.iterrows():
-            code = row['des_branch_code']
-            name = row['des_branch_name']
-            display_text = f"{code} - {name}"
-            display_options.append(display_text)
-            code_mapping[display_text] = code
-        
-        return sorted(display_options), code_mapping
-    
-    des_branch_display_options, des_branch_code_mapping = get_des_branch_codes_for_selection()
+    des_branch_display_options, des_branch_code_mapping = branch_options(
+        destination_index, ('des_branch_code', 'des_branch_name'),
+        des_zone=des_zone, des_region=des_region, des_city=des_city
+    )
     des_branch_display = st.selectbox("Destination Branch", options=[""] + des_branch_display_options, key="des_branch_display")
     des_branch_code = des_branch_code_mapping.get(des_branch_display) if des_branch_display else None
 
+# =========================
+# BREAKDOWN
+# =========================
+# Levels a selection can be split into, coarsest first
+ORIGIN_DRILL_LEVELS = ['org_zone', 'org_region', 'org_city', 'org_branch_code', 'org_product']
+DESTINATION_DRILL_LEVELS = ['des_zone', 'des_region', 'des_city', 'des_branch_code']
+
+def next_level(levels, selection):
+    """Level below the deepest selected one (the top level when nothing is selected)"""
+    deepest = max([k for k, level in enumerate(levels) if selection.get(level)], default=-1)
+    return levels[deepest + 1] if deepest + 1 < len(levels) else None
+
+breakdown = st.selectbox(
+    "Break down by",
+    options=["", "Next origin level", "Next destination level", "Origin x Destination"],
+    help="Split the selection into its children on one axis, or pivot origin against destination"
+)
+
 # =========================
 # COMPUTE BUTTON
 # =========================
@@ -191,7 +170,7 @@ if st.button("Compute Sum"):
     def none_if_empty(s):
         return s if s and s.strip() else None
 
-    result = filter_and_sum(
+    filters = dict(
         type_=none_if_empty(type_),
         service_type=none_if_empty(service_type),
         org_zone=none_if_empty(org_zone),
@@ -203,7 +182,37 @@ if st.button("Compute Sum"):
         des_region=none_if_empty(des_region),
         des_city=none_if_empty(des_city),
         des_branch_code=none_if_empty(des_branch_code),
-        csv_path=csv_path
     )
+    row_level = col_level = None
+    if breakdown:
+        row_level = next_level(ORIGIN_DRILL_LEVELS, filters) if breakdown != "Next destination level" else None
+        col_level = next_level(DESTINATION_DRILL_LEVELS, filters) if breakdown != "Next origin level" else None
+
+    # With a breakdown, its groups partition the selection, so the total comes from the same pass
+    df_breakdown = None
+    if row_level is not None or col_level is not None:
+        df_breakdown = filter_and_breakdown(row_level, col_level, csv_path=csv_path, **filters)
+        result = round(float(df_breakdown["sum"].sum()), 3)
+    else:
+        result = filter_and_sum(**filters, csv_path=csv_path)
     st.markdown("### Result")
-    st.success(f"Sum of filtered values: {result}")
\ No newline at end of file
+    st.success(f"Sum of filtered values: {result}")
+
+    if breakdown:
+        if df_breakdown is None:
+            st.info("The selection is already at the finest level.")
+        else:
+            if breakdown == "Origin x Destination" and (row_level is None or col_level is None):
+                finest = "Origin" if row_level is None else "Destination"
+                st.info(f"{finest} is already at its finest level, so only the other axis is broken down.")
+            st.markdown(f"### Breakdown by {' x '.join(l for l in (row_level, col_level) if l)}")
+            if row_level is not None and col_level is not None:
+                pivot = df_breakdown.pivot_table(index=row_level, columns=col_level, values="sum", fill_value=0)
+                st.dataframe(pivot, use_container_width=True)
+                st.bar_chart(pivot)
+            else:
+                level = row_level or col_level
+                st.dataframe(df_breakdown, use_container_width=True, hide_index=True)
+                st.bar_chart(df_breakdown.set_index(level)["sum"])
+
+perf.sidebar_panel()
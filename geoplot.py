@@ -1,20 +1,125 @@
+import os
+import json
+
+import numpy as np
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import folium
-from streamlit_folium import folium_static
+from branca.element import MacroElement
+from folium.plugins import MarkerCluster
+from jinja2 import Template
+
+import perf
+from algorithms import load_matrix_store, od_flows
+from processing import BRANCH_PREFIX_REGION
+
+# Files behind load_data(), in its return order
+DATA_FILES = ('branch_locations.csv', 'org_summary.csv', 'des_summary.csv')
+
+# Location sets that can be drawn on the map
+LOCATION_FILES = {
+    "Branches": 'branch_locations.csv',
+    "Hubs": 'hub_locations.csv',
+    "All Offices": 'office_location.csv',
+}
+
+# Marker color by zone
+ZONE_COLORS = {
+    'NORTH': 'red',
+    'SOUTH': 'blue',
+    'EAST': 'green',
+    'WEST': 'orange'
+}
+
+# GeoJSON mode clusters markers below this zoom level
+CLUSTER_UNTIL_ZOOM = 8
+
+# OD matrix behind filter_and_sum, and the offices flow arcs start and end at
+OD_MATRIX = 'data.csv'
+OFFICE_FILE = 'office_location.csv'
+
+# Matrix row level a flow origin is chosen at
+ORIGIN_LEVELS = {"Region": "org_region", "Branch": "org_branch_code"}
+
+# Region arcs are drawn below this zoom level, branch arcs from it on
+FLOW_BRANCH_ZOOM = 7
+
+# Points per precomputed arc
+ARC_POINTS = 16
+
+# Rendered maps kept per filter state (least recently used are evicted)
+MAP_CACHE_SIZE = 32
+
+# File versions kept per data cache: the current one and the one before, per fingerprint key
+# (the summaries, each location file and the office list are separate keys)
+DATA_CACHE_SIZE = 2
 
 # -------------------- Data Loading --------------------
+def data_fingerprint(paths):
+    """(path, mtime, size) per file, so cache keys change whenever an input file does"""
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+@st.cache_resource(max_entries=4 * DATA_CACHE_SIZE)
+@perf.timed
+def _read_files(fingerprint):
+    """Read each fingerprinted file once per version, shared by all sessions (do not mutate)"""
+    return tuple(pd.read_csv(path) for path, _, _ in fingerprint)
+
+
 def load_data():
     """Load all required data files"""
     try:
-        branches_df = pd.read_csv('branch_locations.csv')
-        org_summary = pd.read_csv('org_summary.csv')
-        des_summary = pd.read_csv('des_summary.csv')
+        branches_df, org_summary, des_summary = _read_files(data_fingerprint(DATA_FILES))
         return branches_df, org_summary, des_summary
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return None, None, None
 
+
+def load_locations(path):
+    """Load a location file (zone, region, city, office, name, lat, lon)"""
+    return _read_files(data_fingerprint([path]))[0]
+
+# -------------------- Branch Aggregates --------------------
+@perf.timed
+def build_branch_totals(org_summary, des_summary):
+    """
+    Origin and destination sums per (office, type, service_type), built once.
+
+    A type or service_type of None is the "all" roll-up over that column, so every
+    filter combination of the map is a single dictionary lookup returning
+    (origin_sum, destination_sum); offices with no rows are absent (use .get).
+    """
+    totals = {}
+    for position, summary, code_col in ((0, org_summary, 'org_branch_code'), (1, des_summary, 'des_branch_code')):
+        for keys in (['type', 'service_type'], ['type'], ['service_type'], []):
+            sums = summary.groupby([code_col] + keys)['sum'].sum()
+            for key, value in sums.items():
+                key = key if isinstance(key, tuple) else (key,)
+                office = key[0]
+                data_type = key[1 + keys.index('type')] if 'type' in keys else None
+                service_type = key[1 + keys.index('service_type')] if 'service_type' in keys else None
+                pair = totals.setdefault((office, data_type, service_type), [0, 0])
+                pair[position] = value
+    return {key: tuple(pair) for key, pair in totals.items()}
+
+
+@st.cache_resource(max_entries=DATA_CACHE_SIZE)
+def _branch_totals(fingerprint):
+    _, org_summary, des_summary = _read_files(fingerprint)
+    return build_branch_totals(org_summary, des_summary)
+
+
+def load_branch_totals():
+    """build_branch_totals for the current DATA_FILES, computed once per file version"""
+    return _branch_totals(data_fingerprint(DATA_FILES))
+
 # -------------------- Branch Search --------------------
 def find_branch_coordinates(branches_df, branch_code):
     """Find coordinates for a given branch code"""
@@ -30,9 +135,8 @@ def find_branch_coordinates(branches_df, branch_code):
     return None
 
 # -------------------- Map Creation --------------------
-def create_interactive_map(branches_df, org_summary, des_summary, data_type=None, service_type=None, selected_branch=None):
-    """Create an interactive map with branch locations and clickable markers"""
-    
+def _base_map(branches_df, selected_branch=None):
+    """Empty map centered on the selected branch, or on India when there is none"""
     # Determine map center based on selected branch or default to India center
     if selected_branch:
         branch_coords = find_branch_coordinates(branches_df, selected_branch)
@@ -45,9 +149,9 @@ def create_interactive_map(branches_df, org_summary, des_summary, data_type=None
     else:
         center_lat, center_lon = 23.5937, 78.9629  # Center of India
         zoom_level = 5
-    
+
     # Create map with determined center
-    m = folium.Map(
+    return folium.Map(
         location=[center_lat, center_lon],
         zoom_start=zoom_level,
         tiles='OpenStreetMap',
@@ -57,13 +161,22 @@ def create_interactive_map(branches_df, org_summary, des_summary, data_type=None
         doubleClickZoom=True
     )
 
-    # Marker color by zone
-    zone_colors = {
-        'NORTH': 'red',
-        'SOUTH': 'blue',
-        'EAST': 'green',
-        'WEST': 'orange'
-    }
+
+def _add_tile_layers(m):
+    """Add the optional tile layers and the layer control"""
+    folium.TileLayer('CartoDB positron', name='Light Theme').add_to(m)
+    folium.TileLayer('CartoDB dark_matter', name='Dark Theme').add_to(m)
+
+    folium.LayerControl().add_to(m)
+
+
+@perf.timed
+def create_interactive_map(branches_df, org_summary, des_summary, data_type=None, service_type=None, selected_branch=None,
+                           branch_totals=None):
+    """Create an interactive map with branch locations and clickable markers"""
+    if branch_totals is None:
+        branch_totals = build_branch_totals(org_summary, des_summary)
+    m = _base_map(branches_df, selected_branch)
 
     # Add branch markers
     for idx, row in branches_df.iterrows():
@@ -74,23 +187,8 @@ def create_interactive_map(branches_df, org_summary, des_summary, data_type=None
             continue
 
         if pd.notna(lat) and pd.notna(lon):
-            # Filter summary data for this branch with optional type/service filters
-            org_filter = (org_summary['org_branch_code'] == row['office'])
-            if data_type is not None:
-                org_filter = org_filter & (org_summary['type'] == data_type)
-            if service_type is not None:
-                org_filter = org_filter & (org_summary['service_type'] == service_type)
-            org_data = org_summary[org_filter]
-
-            des_filter = (des_summary['des_branch_code'] == row['office'])
-            if data_type is not None:
-                des_filter = des_filter & (des_summary['type'] == data_type)
-            if service_type is not None:
-                des_filter = des_filter & (des_summary['service_type'] == service_type)
-            des_data = des_summary[des_filter]
-
-            org_sum = org_data['sum'].sum() if not org_data.empty else 0
-            des_sum = des_data['sum'].sum() if not des_data.empty else 0
+            # Precomputed sums for this branch under the type/service filters
+            org_sum, des_sum = branch_totals.get((row['office'], data_type, service_type), (0, 0))
 
             # Popup content
             type_label = data_type if data_type is not None else "All Types"
@@ -123,7 +221,7 @@ def create_interactive_map(branches_df, org_summary, des_summary, data_type=None
             </div>
             """
 
-            color = zone_colors.get(str(row.get('zone', '')).upper(), 'gray')
+            color = ZONE_COLORS.get(str(row.get('zone', '')).upper(), 'gray')
             
             # Make selected branch marker larger and highlighted
             is_selected = selected_branch and row['office'] == selected_branch
@@ -144,14 +242,278 @@ def create_interactive_map(branches_df, org_summary, des_summary, data_type=None
                 tooltip=f"{row.get('name', '')} ({row.get('office', '')}) - {row.get('city', '')}"
             ).add_to(m)
 
-    # Add optional tile layers
-    folium.TileLayer('CartoDB positron', name='Light Theme').add_to(m)
-    folium.TileLayer('CartoDB dark_matter', name='Dark Theme').add_to(m)
+    _add_tile_layers(m)
 
-    folium.LayerControl().add_to(m)
+    return m
+
+# -------------------- GeoJSON Map --------------------
+# Feature properties shown in the popup, in display order
+POPUP_FIELDS = ['name', 'office', 'city', 'region', 'zone', 'origin', 'destination', 'total']
+POPUP_ALIASES = ['Name:', 'Branch Code:', 'City:', 'Region:', 'Zone:', 'Origin:', 'Destination:', 'Total:']
+
+
+@perf.timed
+def build_branch_features(branches_df, branch_totals, data_type=None, service_type=None, selected_branch=None):
+    """
+    One GeoJSON FeatureCollection for all locations with valid coordinates.
+
+    Each feature carries the popup fields (sums already formatted) plus the marker
+    style (color, radius, weight), so the browser builds popups and styles from the
+    properties instead of receiving one HTML popup per marker.
+    """
+    lat = pd.to_numeric(branches_df['lat'], errors='coerce')
+    lon = pd.to_numeric(branches_df['lon'], errors='coerce')
+    valid = lat.notna() & lon.notna()
+
+    # Blank out missing labels: NaN is not valid JSON
+    records = branches_df[valid].drop(columns=['lat', 'lon']).fillna('').to_dict('records')
+
+    features = []
+    for row, y, x in zip(records, lat[valid], lon[valid]):
+        org_sum, des_sum = branch_totals.get((row['office'], data_type, service_type), (0, 0))
+        is_selected = bool(selected_branch) and row['office'] == selected_branch
+        color = 'purple' if is_selected else ZONE_COLORS.get(str(row.get('zone', '')).upper(), 'gray')
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(x), float(y)]},
+            'properties': {
+                'name': row.get('name', ''),
+                'office': row.get('office', ''),
+                'city': row.get('city', ''),
+                'region': row.get('region', ''),
+                'zone': row.get('zone', ''),
+                'origin': f"{org_sum:,.0f}",
+                'destination': f"{des_sum:,.0f}",
+                'total': f"{org_sum + des_sum:,.0f}",
+                'tooltip': f"{row.get('name', '')} ({row.get('office', '')}) - {row.get('city', '')}",
+                'color': color,
+                'radius': 12 if is_selected else 6,
+                'weight': 3 if is_selected else 1,
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# Styles each circle and binds its popup/tooltip in the browser from its feature properties.
+# Bound per child layer: MarkerCluster pulls the circles out of the GeoJson group and never
+# adds the group to the map, so a popup bound on the group would never open.
+FEATURE_STYLE_JS = folium.JsCode("""
+function(feature, layer) {
+    var props = feature.properties;
+    var fields = %s;
+    var aliases = %s;
+    function escape(value) {
+        return String(value).replace(/[&<>"']/g, function(c) {
+            return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+        });
+    }
+    layer.setStyle({
+        color: props.color,
+        fillColor: props.color,
+        fillOpacity: 0.8,
+        radius: props.radius,
+        weight: props.weight
+    });
+    layer.bindPopup(function() {
+        var rows = fields.map(function(field, i) {
+            return '<tr><th style="text-align: left; padding-right: 8px;">' + aliases[i] + '</th><td>'
+                + escape(props[field]) + '</td></tr>';
+        });
+        return '<table>' + rows.join('') + '</table>';
+    }, {maxWidth: 300});
+    layer.bindTooltip(escape(props.tooltip));
+}
+""" % (json.dumps(POPUP_FIELDS), json.dumps(POPUP_ALIASES)))
+
+
+@perf.timed
+def create_geojson_map(branches_df, org_summary, des_summary, data_type=None, service_type=None, selected_branch=None,
+                       branch_totals=None):
+    """Same map as create_interactive_map, drawn as one clustered GeoJSON layer with client-side popups"""
+    if branch_totals is None:
+        branch_totals = build_branch_totals(org_summary, des_summary)
+    m = _base_map(branches_df, selected_branch)
+
+    features = build_branch_features(branches_df, branch_totals, data_type, service_type, selected_branch)
+    cluster = MarkerCluster(name='Branches', options={'disableClusteringAtZoom': CLUSTER_UNTIL_ZOOM}).add_to(m)
+    folium.GeoJson(
+        features,
+        name='Branches',
+        marker=folium.CircleMarker(fill=True),
+        on_each_feature=FEATURE_STYLE_JS,
+    ).add_to(cluster)
+
+    _add_tile_layers(m)
 
     return m
 
+# -------------------- Flow Arcs --------------------
+def flow_endpoints(offices_df):
+    """
+    Arc end points: {"Branch": {office: (lat, lon)}, "Region": {region code: (lat, lon)}}.
+
+    Region points are the centroid of the region's offices, whose code prefix gives
+    the region (BRANCH_PREFIX_REGION) as used in the OD matrix.
+    """
+    offices = offices_df.assign(
+        lat=pd.to_numeric(offices_df['lat'], errors='coerce'),
+        lon=pd.to_numeric(offices_df['lon'], errors='coerce'),
+    ).dropna(subset=['lat', 'lon']).drop_duplicates('office')
+    region_code = offices['office'].astype(str).str[:1].map(BRANCH_PREFIX_REGION)
+    centroids = offices.groupby(region_code)[['lat', 'lon']].mean()
+    return {
+        "Branch": dict(zip(offices['office'], zip(offices['lat'], offices['lon']))),
+        "Region": dict(zip(centroids.index, zip(centroids['lat'], centroids['lon']))),
+    }
+
+
+def arc_paths(start, end, n_points=ARC_POINTS, bend=0.2):
+    """
+    Quadratic Bezier arcs from start to end ((k, 2) lat/lon arrays) as (k, n_points, 2)
+    paths, bowed sideways by bend times the chord length so opposite flows don't overlap.
+    """
+    start = np.asarray(start, dtype=float).reshape(-1, 2)
+    end = np.asarray(end, dtype=float).reshape(-1, 2)
+    chord = end - start
+    control = (start + end) / 2 + bend * np.column_stack([-chord[:, 1], chord[:, 0]])
+    t = np.linspace(0, 1, n_points)[None, :, None]
+    return (1 - t) ** 2 * start[:, None] + 2 * (1 - t) * t * control[:, None] + t ** 2 * end[:, None]
+
+
+def build_flow_features(flows, origin_points, destination_points):
+    """
+    LineString FeatureCollection of od_flows rows whose ends both have coordinates.
+
+    Self-flows are skipped; line weight (1-8) scales with the flow's sum.
+    """
+    keep = (
+        flows['origin'].isin(list(origin_points)) & flows['destination'].isin(list(destination_points))
+        & (flows['origin'] != flows['destination'])
+    )
+    flows = flows[keep]
+    if flows.empty:
+        return {'type': 'FeatureCollection', 'features': []}
+
+    start = [origin_points[o] for o in flows['origin']]
+    end = [destination_points[d] for d in flows['destination']]
+    paths = arc_paths(start, end)[:, :, ::-1].round(5)  # GeoJSON is (lon, lat)
+    weights = 1 + 7 * flows['sum'].to_numpy() / flows['sum'].max()
+
+    features = []
+    for path, origin, destination, total, weight in zip(paths.tolist(), flows['origin'], flows['destination'],
+                                                       flows['sum'], weights):
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': path},
+            'properties': {
+                'origin': origin,
+                'destination': destination,
+                'sum': f"{total:,.0f}",
+                'weight': round(float(weight), 2),
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+@perf.timed
+def load_flows(origin_scope, origin, type_, service_type=None, top_k=20, csv_path=OD_MATRIX):
+    """
+    Top-k flows out of one region or branch, at both zoom levels.
+
+    Returns (far, near): far is aggregated to destination regions (from the origin
+    region, or from the origin branch itself), near is branch -> branch.
+    """
+    filters = {ORIGIN_LEVELS[origin_scope]: origin, 'type_': type_}
+    if service_type is not None:
+        filters['service_type'] = service_type
+    far = od_flows(ORIGIN_LEVELS[origin_scope], 'des_region', top_k, csv_path, **filters)
+    near = od_flows('org_branch_code', 'des_branch_code', top_k, csv_path, **filters)
+    return far, near
+
+
+class _ZoomSwitch(MacroElement):
+    """Shows one layer below a zoom level and another from it on"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            function update() {
+                var near = map.getZoom() >= {{ this.zoom }};
+                [[{{ this.far.get_name() }}, !near], [{{ this.near.get_name() }}, near]].forEach(function(pair) {
+                    if (pair[1]) { map.addLayer(pair[0]); } else { map.removeLayer(pair[0]); }
+                });
+            }
+            map.on('zoomend', update);
+            update();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, far, near, zoom):
+        super().__init__()
+        self._name = 'ZoomSwitch'
+        self.far = far
+        self.near = near
+        self.zoom = zoom
+
+
+# Sets each arc's width in the browser from its feature properties
+FLOW_STYLE_JS = folium.JsCode("""
+function(feature, layer) {
+    layer.setStyle({color: '#d62728', opacity: 0.6, weight: feature.properties.weight});
+}
+""")
+
+
+def add_flow_arcs(m, far, near, endpoints, origin_scope):
+    """Add region-level and branch-level arc layers to m, switched by zoom level"""
+    layers = []
+    for name, flows, origin_points, destination_points in (
+        ("Region flows", far, endpoints[origin_scope], endpoints["Region"]),
+        ("Branch flows", near, endpoints["Branch"], endpoints["Branch"]),
+    ):
+        group = folium.FeatureGroup(name=name).add_to(m)
+        folium.GeoJson(
+            build_flow_features(flows, origin_points, destination_points),
+            on_each_feature=FLOW_STYLE_JS,
+            tooltip=folium.GeoJsonTooltip(fields=['origin', 'destination', 'sum'],
+                                          aliases=['From:', 'To:', 'Flow:']),
+        ).add_to(group)
+        layers.append(group)
+    _ZoomSwitch(layers[0], layers[1], FLOW_BRANCH_ZOOM).add_to(m)
+    return m
+
+# -------------------- Map Cache --------------------
+@st.cache_resource(max_entries=DATA_CACHE_SIZE)
+def _flow_endpoints(office_key):
+    return flow_endpoints(_read_files(office_key)[0])
+
+
+@st.cache_data(max_entries=MAP_CACHE_SIZE)
+def render_map_html(data_key, location_key, geojson=True, data_type=None, service_type=None, selected_branch=None,
+                    flow=None):
+    """
+    Standalone HTML of a built map, cached per filter state.
+
+    data_key and location_key are data_fingerprint() of DATA_FILES and of the location
+    file, so a changed input file misses the cache instead of serving a stale map.
+    flow is None or (od_key, origin_scope, origin, type_, top_k) with od_key the
+    data_fingerprint() of the OD matrix and OFFICE_FILE; it adds the flow arcs.
+    """
+    _, org_summary, des_summary = _read_files(data_key)
+    locations_df = _read_files(location_key)[0]
+    create_map = create_geojson_map if geojson else create_interactive_map
+    map_obj = create_map(
+        locations_df, org_summary, des_summary, data_type, service_type, selected_branch, _branch_totals(data_key)
+    )
+    if flow is not None:
+        od_key, origin_scope, origin, type_, top_k = flow
+        far, near = load_flows(origin_scope, origin, type_, service_type, top_k, od_key[0][0])
+        add_flow_arcs(map_obj, far, near, _flow_endpoints(od_key[1:]), origin_scope)
+    with perf.stage("geoplot.render_html"):
+        return folium.Figure().add_child(map_obj).render()
+
 # -------------------- Main App --------------------
 def main():
     st.set_page_config(
@@ -163,6 +525,7 @@ def main():
 
     # Sidebar controls
     st.sidebar.title("🛠️ Controls")
+    perf.sidebar_toggle()
 
     # Load data
     branches_df, org_summary, des_summary = load_data()
@@ -188,6 +551,17 @@ def main():
     service_type = st.sidebar.selectbox("Service Type:", service_options, index=0)
     if service_type == "All Services":
         service_type = None
+
+    # Location set and rendering mode
+    locations = st.sidebar.selectbox("Locations:", list(LOCATION_FILES), index=0)
+    location_key = data_fingerprint([LOCATION_FILES[locations]])
+    branches_df = _read_files(location_key)[0]
+    rendering = st.sidebar.radio(
+        "Rendering:",
+        ["GeoJSON (clustered)", "Markers"],
+        index=0,
+        help="GeoJSON draws one layer with popups built in the browser; Markers draws one marker per location"
+    )
     
     # Branch search dropdown
     branch_options = ["All Branches"] + branches_df['office'].tolist()
@@ -200,6 +574,20 @@ def main():
     if selected_branch == "All Branches":
         selected_branch = None
 
+    # Flow arcs from one origin, drawn from the OD matrix
+    flow = None
+    st.sidebar.markdown("---")
+    if not os.path.exists(OD_MATRIX):
+        st.sidebar.caption(f"Flow arcs need {OD_MATRIX}.")
+    elif st.sidebar.checkbox("Show flow arcs", value=False):
+        store = load_matrix_store(OD_MATRIX)
+        origin_scope = st.sidebar.radio("Flow origin:", list(ORIGIN_LEVELS), index=0, horizontal=True)
+        origin = st.sidebar.selectbox("Origin:", store["row_dims"][ORIGIN_LEVELS[origin_scope]])
+        flow_type = st.sidebar.selectbox("Flow measure:", store["col_dims"]["type"])
+        top_k = st.sidebar.slider("Top flows:", min_value=5, max_value=100, value=20, step=5)
+        od_key = data_fingerprint([OD_MATRIX, OFFICE_FILE])
+        flow = (od_key, origin_scope, origin, flow_type, top_k)
+
     # Sidebar instructions
     st.sidebar.markdown("---")
     st.sidebar.markdown("**🗺️ Map Controls:**")
@@ -216,6 +604,7 @@ def main():
     - **Green:** East Zone  
     - **Orange:** West Zone  
     - **Purple:** Selected Branch (larger marker)
+    - **Numbered circles:** Clustered markers (GeoJSON mode, zoom in to split)
     """)
 
     st.sidebar.markdown("**📊 Data Display:**")
@@ -224,15 +613,20 @@ def main():
     - Summary data updates with type/service selection  
     - Origin vs Destination comparison  
     - Use search to quickly navigate to specific branches
-    """)
+    - Flow arcs: region level when zoomed out, branch level from zoom %d
+    """ % FLOW_BRANCH_ZOOM)
 
     # Main page title
     st.title("🗺️ Branch Map Dashboard")
     st.markdown("---")
 
     # Create and display interactive map
-    map_obj = create_interactive_map(branches_df, org_summary, des_summary, data_type, service_type, selected_branch)
-    folium_static(map_obj, width=1200, height=700)
+    map_html = render_map_html(
+        data_fingerprint(DATA_FILES), location_key, rendering == "GeoJSON (clustered)",
+        data_type, service_type, selected_branch, flow
+    )
+    components.html(map_html, width=1200, height=710)
+    perf.sidebar_panel()
 
 # -------------------- Run App --------------------
 if __name__ == "__main__":
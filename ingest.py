@@ -0,0 +1,484 @@
+import argparse
+import glob
+import json
+import os
+import tempfile
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+# =========================
+# Raw OD Export Layout
+# =========================
+RAW_PATH = "origin_destination_flow.csv"
+HEADER_ROWS = 5          # type, zone, region, city, "code-name" of every destination column
+ORIGIN_COLS = 5          # zone, region, city, "code-name", product (merged cells, filled down)
+DOC_TYPE_COL = 5
+DATA_START_COL = 6       # first destination column
+NON_DOCUMENTS = "NON DOCUMENTS"
+CHUNK_ROWS = 2000
+
+REGION_ALIASES = {"EUP": "UPT", "WUP": "UPT", "NDL": "DDL", "SDL": "DDL", "GGN": "DDL"}
+SERVICE_TYPES = {"EP": "Air Red", "BP": "Air Red", "ES": "Air White", "BS": "Air White", "GP": "Ground"}
+HUB_PATTERN = r"Hub|Apex"
+PER_DAY = 25
+
+
+def _read_raw(raw_path, chunksize):
+    """Raw export in row chunks, every cell kept as text (NaN for blanks)"""
+    return pd.read_csv(raw_path, dtype=str, chunksize=chunksize)
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _per_day(block):
+    """
+    Vectorized clean_number_per_day: strip thousands separators, parse, divide by 25.
+
+    Returns (values, parsed); unparseable or blank cells are 0 and not parsed.
+    Parsing follows Python's float(), so the result matches the notebook cell by cell.
+    """
+    values = np.zeros(block.shape)
+    parsed = np.zeros(block.shape, dtype=bool)
+    present = ~pd.isna(block)
+    text = pd.Series(block[present], dtype=object).str.replace(",", "", regex=False)
+    numbers = np.zeros(len(text))
+    ok = pd.to_numeric(text, errors="coerce").notna().to_numpy()
+    try:
+        numbers[ok] = text[ok].astype(float).to_numpy()
+        slow = np.flatnonzero(~ok)
+    except ValueError:
+        ok[:] = False
+        slow = np.arange(len(text))
+    for i in slow:
+        number = _to_float(text.iat[i])
+        if number is not None:
+            numbers[i], ok[i] = number, True
+
+    values[present] = numbers / PER_DAY
+    parsed[present] = ok
+    return values, parsed
+
+
+def _split_code_name(values):
+    """Split "code-name" cells on the first '-' into (code, name); NaN where there is nothing to split"""
+    parts = pd.Series(values, dtype=object).str.split("-", n=1, expand=True).reindex(columns=[0, 1])
+    return parts[0].to_numpy(dtype=object), parts[1].to_numpy(dtype=object)
+
+
+def _normalize_regions(values):
+    """Map EUP/WUP to UPT and NDL/SDL/GGN to DDL, leaving other cells as they are"""
+    mapped = pd.Series(values, dtype=object).map(REGION_ALIASES)
+    return np.where(mapped.notna(), mapped, values)
+
+
+def _fill_down(values, carry):
+    """Forward-fill each column of an object array, seeding leading blanks from carry"""
+    filled = values.copy()
+    rows = np.arange(len(values))
+    for j in range(values.shape[1]):
+        last = np.where(pd.isna(values[:, j]), -1, rows)
+        np.maximum.accumulate(last, out=last)
+        filled[:, j] = np.where(last >= 0, values[last, j], carry[j])
+    return filled
+
+
+def _layout(raw):
+    """
+    Raw rows (object array) -> data.csv column order.
+
+    Output columns are zone, region, city, branch_code, branch_name, service_type,
+    product and then the destination columns; the doc-type column is dropped.
+    """
+    code, name = _split_code_name(raw[:, 3])
+    service = pd.Series(raw[:, 4], dtype=object).map(SERVICE_TYPES).to_numpy(dtype=object)
+    return np.column_stack((raw[:, :3], code, name, service, raw[:, 4], raw[:, DATA_START_COL:]))
+
+
+def _is_hub(values):
+    return pd.Series(values, dtype=object).astype(str).str.contains(HUB_PATTERN, case=False, na=False).to_numpy()
+
+
+def _header(first_chunk):
+    """
+    The six data.csv header rows and the column names, from the raw header rows.
+
+    Types, zones, regions and cities are filled right across merged cells and
+    regions normalized; the "code-name" row is split into a code row and a name row.
+    """
+    head = first_chunk.iloc[:HEADER_ROWS].to_numpy(dtype=object)
+    head[:4, DATA_START_COL:] = _fill_down(head[:4, DATA_START_COL:].T, [np.nan] * 4).T
+    head[:, 1] = _normalize_regions(head[:, 1])
+    head[2, DOC_TYPE_COL:] = _normalize_regions(head[2, DOC_TYPE_COL:])
+
+    rows = _layout(head)
+    codes = np.full(rows.shape[1], None, dtype=object)
+    names = np.full(rows.shape[1], None, dtype=object)
+    for j, value in enumerate(rows[4]):
+        if isinstance(value, str) and "-" in value:
+            codes[j], names[j] = value.split("-", 1)
+        else:
+            codes[j] = value
+    rows = np.vstack((rows[:4], codes, names))
+    rows[:, 5] = pd.Series(rows[:, 6], dtype=object).map(SERVICE_TYPES).to_numpy(dtype=object)
+
+    columns = list(first_chunk.columns[:3]) + ["branch_code", "branch_name", "service_type"]
+    columns += [first_chunk.columns[4]] + list(first_chunk.columns[DATA_START_COL:])
+    if _is_hub(rows[:, 4]).any():
+        raise ValueError("A header row is named like a hub/apex branch; the layout is not supported")
+    return rows, columns
+
+
+def _origin_rows(chunks):
+    """
+    (raw row numbers, object array) of NON DOCUMENTS origin rows per chunk, with
+    merged origin cells filled down across chunk boundaries and regions normalized.
+    """
+    carry = [np.nan] * ORIGIN_COLS
+    for chunk in chunks:
+        data = chunk[chunk.index >= HEADER_ROWS]
+        if data.empty:
+            continue
+        raw = data.to_numpy(dtype=object)
+        raw[:, :ORIGIN_COLS] = _fill_down(raw[:, :ORIGIN_COLS], carry)
+        carry = raw[-1, :ORIGIN_COLS]
+        raw[:, 1] = _normalize_regions(raw[:, 1])
+        kept = raw[:, DOC_TYPE_COL] == NON_DOCUMENTS
+        if kept.any():
+            yield data.index[kept], raw[kept]
+
+
+def _scan(raw_path, chunksize):
+    """
+    First pass: count NON DOCUMENTS rows and find the destination columns in which
+    any counted cell parses as a number.
+
+    The notebook's shift drops the last NON DOCUMENTS row, so it is not counted;
+    columns where nothing parses stay integer and are written as 0 rather than 0.0.
+    """
+    n_rows, first_row = 0, None
+    any_number, held = None, None
+    for index, kept in _origin_rows(_read_raw(raw_path, chunksize)):
+        block = kept[:, DATA_START_COL:]
+        if first_row is None:
+            first_row = index[0]
+            any_number = np.zeros(block.shape[1], dtype=bool)
+            held = np.zeros(block.shape[1], dtype=bool)
+        any_number |= held
+
+        # Only columns with no number so far still need parsing
+        pending = np.flatnonzero(~any_number)
+        _, parsed = _per_day(block[:, pending])
+        any_number[pending] |= parsed[:-1].any(axis=0)
+        held[:] = False
+        held[pending] = parsed[-1]
+        n_rows += len(kept)
+
+    # data.csv row 5 is written over raw row 5, which must itself be a kept row
+    if first_row != HEADER_ROWS:
+        raise ValueError(
+            f"raw row {HEADER_ROWS} is not a {NON_DOCUMENTS} row; the notebook would misplace "
+            "the branch-name header row for this file"
+        )
+    return n_rows, any_number
+
+
+def _write_mappings(out_path, origins, org_path, des_path):
+    """org_mappings.json from the written origins and des_mappings.json from the data.csv header"""
+    origin_mapping = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    for (zone, region, city, branch_code), branch_name in origins.items():
+        origin_mapping[zone][region][city][branch_code] = branch_name
+    with open(org_path, "w") as f:
+        json.dump(origin_mapping, f, indent=4)
+
+    header = pd.read_csv(out_path, skiprows=1, header=[0, 1, 2, 3, 4, 5], index_col=[0, 1, 2, 3, 4], nrows=1)
+    header.columns.set_names(
+        ["type", "des_zone", "des_region", "des_city", "des_branch_code", "des_branch_name"], inplace=True
+    )
+    col_df = header.columns.to_frame(index=False)
+    levels = ["des_zone", "des_region", "des_city", "des_branch_code", "des_branch_name"]
+    volume_df = col_df[col_df["type"] == "Volume"][levels].drop_duplicates()
+    billed_df = col_df[col_df["type"] == "Billed Wt"][levels].drop_duplicates()
+
+    flat_volume = dict(zip(volume_df["des_branch_code"], volume_df["des_branch_name"]))
+    flat_billed = dict(zip(billed_df["des_branch_code"], billed_df["des_branch_name"]))
+    if flat_volume != flat_billed:
+        return {
+            code: (flat_volume.get(code), flat_billed.get(code))
+            for code in set(flat_volume) | set(flat_billed)
+            if flat_volume.get(code) != flat_billed.get(code)
+        }
+
+    des_mapping = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    for zone, region, city, branch_code, branch_name in volume_df.itertuples(index=False):
+        des_mapping[zone][region][city][branch_code] = branch_name
+    with open(des_path, "w") as f:
+        json.dump(des_mapping, f, indent=4)
+    return {}
+
+
+# =========================
+# Ingest
+# =========================
+def ingest(raw_path=RAW_PATH, out_path="data.csv", org_path="org_mappings.json",
+           des_path="des_mappings.json", chunksize=CHUNK_ROWS):
+    """
+    Convert a raw OD export into data.csv and the origin/destination mapping JSONs.
+
+    Reads the raw file twice in row chunks, so memory stays bounded by the chunk
+    size, and writes the same bytes as raw_data_processor.ipynb: NON DOCUMENTS
+    rows only, per-day values, hub/apex rows and columns removed and regions
+    normalized. The des mapping is only written when Volume and Billed Wt list
+    the same branches; otherwise the differing codes are returned in the
+    summary, as the notebook printed them.
+    """
+    if chunksize <= HEADER_ROWS:
+        raise ValueError(f"chunksize must exceed the {HEADER_ROWS} header rows")
+    n_rows, any_number = _scan(raw_path, chunksize)
+
+    chunks = _read_raw(raw_path, chunksize)
+    first = next(chunks)
+    header, columns = _header(first)
+    keep_cols = ~_is_hub(header[5])
+    int_cols = ~any_number[keep_cols[7:]]
+
+    written, seen, origins = 0, 0, {}
+    with open(out_path, "w", newline="") as f:
+        pd.DataFrame(header[:, keep_cols], columns=np.array(columns, dtype=object)[keep_cols]).to_csv(f, index=False)
+
+        def rest():
+            yield first
+            yield from chunks
+
+        for _, kept in _origin_rows(rest()):
+            # The notebook's shift drops the last NON DOCUMENTS row
+            seen += len(kept)
+            if seen == n_rows:
+                kept = kept[:-1]
+            if not len(kept):
+                continue
+
+            rows = _layout(kept)
+            rows = rows[~_is_hub(rows[:, 4])]
+            values, _ = _per_day(rows[:, 7:])
+            rows = rows[:, keep_cols]
+            data = values[:, keep_cols[7:]].astype(object)
+            data[:, int_cols] = 0
+            rows[:, 7:] = data
+
+            for zone, region, city, branch_code, branch_name in rows[:, :5]:
+                origins[zone, region, city, branch_code] = branch_name
+            pd.DataFrame(rows).to_csv(f, index=False, header=False)
+            written += len(rows)
+
+    mismatches = _write_mappings(out_path, origins, org_path, des_path)
+    return {
+        "rows": written,
+        "columns": int(keep_cols.sum()),
+        "origins": len(origins),
+        "des_mapping_written": not mismatches,
+        "des_mismatches": mismatches,
+    }
+
+
+# =========================
+# Batch Ingest
+# =========================
+ROW_KEYS = ["zone", "region", "city", "branch_code", "service_type", "product"]
+COL_KEYS = ["type", "des_zone", "des_region", "des_city", "des_branch_code"]
+
+
+def _ingest_one(raw_path, work_dir, chunksize):
+    """Worker: ingest one raw file into its own directory; failures come back as text, not exceptions"""
+    out_dir = os.path.join(work_dir, os.path.splitext(os.path.basename(raw_path))[0])
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, "data.csv")
+    try:
+        summary = ingest(
+            raw_path, out_path, os.path.join(out_dir, "org_mappings.json"),
+            os.path.join(out_dir, "des_mappings.json"), chunksize,
+        )
+    except Exception as exc:
+        return {"file": raw_path, "error": f"{type(exc).__name__}: {exc}", "traceback": traceback.format_exc()}
+    return {"file": raw_path, "out": out_path, "summary": summary}
+
+
+def _read_ingested(out_path):
+    """
+    An ingested data.csv as a numeric frame keyed by branch codes.
+
+    Returns (frame, origin names, destination names): names are dropped from the
+    row/column keys so files that spell a branch differently still line up.
+    """
+    df = pd.read_csv(out_path, skiprows=1, header=[0, 1, 2, 3, 4, 5], index_col=[0, 1, 2, 3, 4, 5, 6])
+    df.index.set_names(ROW_KEYS[:4] + ["branch_name"] + ROW_KEYS[4:], inplace=True)
+    df.columns.set_names(COL_KEYS + ["des_branch_name"], inplace=True)
+
+    rows = df.index.to_frame(index=False)
+    cols = df.columns.to_frame(index=False)
+    org_names = dict(zip(rows["branch_code"], rows["branch_name"]))
+    des_names = dict(zip(cols["des_branch_code"], cols["des_branch_name"]))
+
+    df = df.apply(pd.to_numeric, errors="coerce").fillna(0)
+    df.index = pd.MultiIndex.from_frame(rows[ROW_KEYS])
+    df.columns = pd.MultiIndex.from_frame(cols[COL_KEYS])
+    df = df.groupby(level=ROW_KEYS, sort=False).sum()
+    return df.T.groupby(level=COL_KEYS, sort=False).sum().T, org_names, des_names
+
+
+def _write_matrix(df, org_names, des_names, out_path):
+    """Write a code-keyed matrix back in data.csv layout, with branch names restored from the mappings"""
+    rows = df.index.to_frame(index=False)
+    cols = df.columns.to_frame(index=False)
+    rows.insert(4, "branch_name", rows["branch_code"].map(org_names))
+    cols["des_branch_name"] = cols["des_branch_code"].map(des_names)
+
+    head = np.full((len(cols.columns), len(rows.columns)), np.nan, dtype=object)
+    body = np.column_stack((rows.to_numpy(dtype=object), df.to_numpy().astype(object)))
+    out = np.vstack((np.column_stack((head, cols.to_numpy(dtype=object).T)), body))
+    columns = ["zone", "region", "city", "branch_code", "branch_name", "service_type", "product"]
+    columns += [f"Unnamed: {j}" for j in range(len(columns), out.shape[1])]
+    with open(out_path, "w", newline="") as f:
+        pd.DataFrame(out, columns=columns).to_csv(f, index=False)
+    return {
+        (zone, region, city, code): name
+        for zone, region, city, code, name in rows.iloc[:, :5].itertuples(index=False)
+    }
+
+
+def ingest_batch(raw_dir, out_path="data.csv", org_path="org_mappings.json", des_path="des_mappings.json",
+                 pattern="*.csv", workers=None, average=False, chunksize=CHUNK_ROWS, work_dir=None,
+                 progress=None):
+    """
+    Ingest every raw OD export in raw_dir in a process pool and merge them into one data.csv.
+
+    Files are aligned on the union of origin rows and destination columns, keyed by
+    branch code as in org_mappings.json/des_mappings.json; the first file (in name
+    order) to list a code decides its name and later spellings are reported as
+    conflicts. Values are summed, or averaged over the ingested files with
+    average=True. A file that fails is recorded in the report and left out of the
+    merge instead of aborting the run. progress, if given, is called with
+    (done, total, result) as each file finishes.
+    """
+    paths = sorted(glob.glob(os.path.join(raw_dir, pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No files matching {pattern} in {raw_dir}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = work_dir or tmp
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_ingest_one, path, work_dir, chunksize) for path in paths]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results[result["file"]] = result
+                if progress is not None:
+                    progress(done, len(paths), result)
+
+        # Merge in file-name order so the output does not depend on completion order
+        merged, org_names, des_names, conflicts = None, {}, {}, []
+        ingested = [results[path] for path in paths if "error" not in results[path]]
+        for result in ingested:
+            df, org, des = _read_ingested(result["out"])
+            for names, found, axis in ((org_names, org, "origin"), (des_names, des, "destination")):
+                for code, name in found.items():
+                    if names.setdefault(code, name) != name:
+                        conflicts.append({"file": result["file"], "axis": axis, "branch_code": code,
+                                          "kept": names[code], "found": name})
+            if merged is None:
+                merged = df
+            else:
+                index = merged.index.union(df.index, sort=False)
+                columns = merged.columns.union(df.columns, sort=False)
+                merged = merged.reindex(index=index, columns=columns, fill_value=0) + df.reindex(
+                    index=index, columns=columns, fill_value=0
+                )
+
+    failures = {path: results[path]["error"] for path in paths if "error" in results[path]}
+    report = {
+        "files": len(paths),
+        "ingested": len(ingested),
+        "failed": failures,
+        "name_conflicts": conflicts,
+        "rows": 0,
+        "columns": 0,
+        "des_mapping_written": False,
+        "des_mismatches": {},
+    }
+    if merged is None:
+        return report
+    if average:
+        merged = merged / len(ingested)
+
+    origins = _write_matrix(merged, org_names, des_names, out_path)
+    mismatches = _write_mappings(out_path, origins, org_path, des_path)
+    report.update({
+        "rows": len(merged),
+        "columns": merged.shape[1],
+        "des_mapping_written": not mismatches,
+        "des_mismatches": mismatches,
+    })
+    return report
+
+
+def _print_progress(done, total, result):
+    name = os.path.basename(result["file"])
+    if "error" in result:
+        print(f"[{done}/{total}] {name}: FAILED ({result['error']})")
+    else:
+        print(f"[{done}/{total}] {name}: {result['summary']['rows']:,} origin rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw OD exports into data.csv and the mapping JSONs")
+    parser.add_argument("raw", nargs="?", default=RAW_PATH,
+                        help="Raw origin-destination export CSV, or a directory of them to ingest and merge")
+    parser.add_argument("--out", default="data.csv")
+    parser.add_argument("--org-mappings", default="org_mappings.json")
+    parser.add_argument("--des-mappings", default="des_mappings.json")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--pattern", default="*.csv", help="File pattern inside a raw directory")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for a raw directory")
+    parser.add_argument("--average", action="store_true", help="Average instead of summing a raw directory")
+    parser.add_argument("--report", default=None, help="Write the batch failure report to this JSON file")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.raw):
+        summary = ingest_batch(
+            args.raw, args.out, args.org_mappings, args.des_mappings, args.pattern,
+            args.workers, args.average, args.chunksize, progress=_print_progress,
+        )
+        print(f"{summary['ingested']}/{summary['files']} files merged")
+        for path, error in summary["failed"].items():
+            print(f"Failed: {path}: {error}")
+        for conflict in summary["name_conflicts"]:
+            print(f"Branch code {conflict['branch_code']} ({conflict['axis']}): kept '{conflict['kept']}', "
+                  f"{os.path.basename(conflict['file'])} has '{conflict['found']}'")
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(summary, f, indent=4)
+        if not summary["ingested"]:
+            return
+    else:
+        summary = ingest(args.raw, args.out, args.org_mappings, args.des_mappings, args.chunksize)
+
+    print(f"{summary['rows']:,} origin rows x {summary['columns']:,} columns written to {args.out}")
+    if summary["des_mapping_written"]:
+        print(f"Origin and destination mappings saved as {args.org_mappings} and {args.des_mappings}")
+    else:
+        print(f"Origin mapping saved as {args.org_mappings}; Volume and Billed Wt branch mappings differ, "
+              f"{args.des_mappings} not written")
+        for code, (volume, billed) in summary["des_mismatches"].items():
+            print(f"Branch code {code}: Volume='{volume}', Billed='{billed}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import pandas as pd
+
+# Set SORTER_PERF=1 (or =memory) to record stages without calling enable()
+ENV_VAR = "SORTER_PERF"
+RECORD_COLUMNS = ["stage", "calls", "seconds", "alloc_mb", "peak_mb"]
+
+_NULL = nullcontext()
+
+
+class _State(threading.local):
+    """Per-thread switch and records, so each Streamlit session run only sees its own stages"""
+    enabled = os.environ.get(ENV_VAR, "") not in ("", "0")
+    memory = os.environ.get(ENV_VAR, "") == "memory"
+
+    def __init__(self):
+        self.records = {}
+        self.stack = []
+
+
+_state = _State()
+_started_tracing = False
+
+
+# =========================
+# Switches
+# =========================
+def enable(memory=False):
+    """Record stages in this thread; memory=True also tracks allocations with tracemalloc (slower)"""
+    global _started_tracing
+    _state.enabled = True
+    _state.memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+
+def disable():
+    """Stop recording in this thread (records are kept until reset)"""
+    global _started_tracing
+    _state.enabled = False
+    _state.memory = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+if _State.memory:
+    enable(memory=True)
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def reset():
+    _state.records = {}
+    _state.stack = []
+
+
+# =========================
+# Stages
+# =========================
+class _Stage:
+    __slots__ = ("name", "start", "current", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _state.stack
+        if _state.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak seen so far; this stage measures its own
+            if stack and stack[-1].current is not None:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.current, self.peak = current, current
+        else:
+            self.current = None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        stack = _state.stack
+        stack.pop()
+        alloc = peak = 0
+        if self.current is not None and tracemalloc.is_tracing():
+            current, traced_peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, traced_peak)
+            alloc, peak = current - self.current, self.peak - self.current
+            if stack and stack[-1].current is not None:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        record = _state.records.get(self.name)
+        if record is None:
+            _state.records[self.name] = [1, seconds, alloc, peak]
+        else:
+            record[0] += 1
+            record[1] += seconds
+            record[2] += alloc
+            record[3] = max(record[3], peak)
+        return False
+
+
+def stage(name):
+    """
+    Context manager recording wall time, calls and (with memory on) allocations under name.
+
+    Disabled, it returns a shared no-op context, so instrumented code pays one
+    attribute lookup. Nested stages are recorded separately; a stage's time
+    includes its children. alloc_mb is the net memory still held at exit,
+    peak_mb the highest point above the stage's starting level.
+    """
+    return _Stage(name) if _state.enabled else _NULL
+
+
+def timed(name=None):
+    """Decorator form of stage(); the default name is module.qualname (file stem, also under streamlit run)"""
+    def decorate(fn):
+        module = os.path.splitext(os.path.basename(fn.__globals__.get("__file__") or fn.__module__))[0]
+        label = name or f"{module}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _Stage(label):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    if callable(name):
+        fn, name = name, None
+        return decorate(fn)
+    return decorate
+
+
+# =========================
+# Reports
+# =========================
+def report():
+    """{stage: {calls, seconds, alloc_mb, peak_mb}} for this thread, in first-entered order"""
+    return {
+        name: {"calls": calls, "seconds": seconds, "alloc_mb": alloc / 2**20, "peak_mb": peak / 2**20}
+        for name, (calls, seconds, alloc, peak) in _state.records.items()
+    }
+
+
+def to_frame():
+    rows = [{"stage": name, **values} for name, values in report().items()]
+    return pd.DataFrame(rows, columns=RECORD_COLUMNS)
+
+
+def to_json(path=None):
+    """The report as JSON text, also written to path when given"""
+    text = json.dumps(report(), indent=2)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text)
+    return text
+
+
+# =========================
+# Streamlit Panel
+# =========================
+def sidebar_toggle(key="perf"):
+    """Sidebar switches for the panel; call before the app's work so this run is recorded"""
+    import streamlit as st
+
+    st.sidebar.markdown("---")
+    if st.sidebar.checkbox("Show performance panel", value=False, key=f"{key}_panel"):
+        enable(memory=st.sidebar.checkbox("Track memory (slower)", value=False, key=f"{key}_memory"))
+        reset()
+        return True
+    if is_enabled():
+        disable()
+    return False
+
+
+def sidebar_panel(key="perf"):
+    """Last run's per-stage breakdown in the sidebar, with a JSON download"""
+    import streamlit as st
+
+    if not is_enabled():
+        return
+    df = to_frame().sort_values("seconds", ascending=False)
+    st.sidebar.markdown("**⏱️ Last run**")
+    if df.empty:
+        st.sidebar.caption("No instrumented stages ran (cached results are not re-timed).")
+        return
+    if not _state.memory:
+        df = df.drop(columns=["alloc_mb", "peak_mb"])
+    st.sidebar.dataframe(df.round(4), use_container_width=True, hide_index=True)
+    st.sidebar.download_button(
+        "📥 Download timings (JSON)", data=to_json(), file_name="perf.json", mime="application/json", key=f"{key}_json"
+    )
@@ -0,0 +1,359 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+import ingest
+import processing
+from algorithms import file_sha1, read_matrix_csv
+
+# Where stage fingerprints and file digests are kept between runs
+STATE_PATH = ".pipeline_state.json"
+
+# bags.ipynb thresholds
+DEFAULT_THRESHOLDS = {"Volume": 25, "Billed Wt": 35}
+
+
+# =========================
+# Stage Functions
+# =========================
+# Each runs in a worker process as run(inputs, outputs, params) and writes its outputs.
+def run_ingest(inputs, outputs, params):
+    data_path, org_path, des_path = outputs
+    if os.path.isdir(inputs[0]):
+        ingest.ingest_batch(inputs[0], data_path, org_path, des_path, pattern=params["pattern"])
+    else:
+        ingest.ingest(inputs[0], data_path, org_path, des_path)
+
+
+def run_summaries(inputs, outputs, params):
+    df_matrix = read_matrix_csv(inputs[0])
+    processing.build_org_summary(df_matrix).to_csv(outputs[0], index=False)
+    processing.build_des_summary(df_matrix).to_csv(outputs[1], index=False)
+
+
+def run_all_data(inputs, outputs, params):
+    processing.build_all_data(read_matrix_csv(inputs[0])).to_csv(outputs[0], index=False)
+
+
+def run_percentages(inputs, outputs, params):
+    processing.export_percentages(inputs[0], outputs[0])
+
+
+def run_bags(inputs, outputs, params):
+    df_long = processing.load_long_table(inputs[0])
+    processing.build_bag_summary(df_long, params["thresholds"]).to_csv(outputs[0], index=False)
+
+
+def _pct_long(abs_path):
+    return processing.load_long_table(abs_path)[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+
+
+def run_optimal(inputs, outputs, params):
+    bag_path, abs_path = inputs
+    df_optimal = processing.build_optimal_branches(
+        pd.read_csv(bag_path), _pct_long(abs_path), params["method"], params["target_pct"]
+    )
+    df_optimal.to_csv(outputs[0], index=False)
+
+
+def run_final_sorting(inputs, outputs, params):
+    optimal_path, des_path = inputs
+    processing.build_final_sorting(pd.read_csv(optimal_path), des_path).to_csv(outputs[0], index=False)
+
+
+def run_flows(inputs, outputs, params):
+    abs_path, optimal_path = inputs
+    df_flow, df_receiving = processing.build_flow_analysis(pd.read_csv(abs_path), pd.read_csv(optimal_path))
+    df_flow.to_csv(outputs[0], index=False)
+    df_receiving.to_csv(outputs[1], index=False)
+
+
+def run_threshold_grid(inputs, outputs, params):
+    abs_path, des_path = inputs
+    grid = processing.build_threshold_grid(
+        processing.load_long_table(abs_path), des_path=des_path, method=params["method"], target_pct=params["target_pct"]
+    )
+    processing.save_threshold_grid(grid, outputs[0], source=file_sha1(abs_path))
+
+
+def run_elbow_plots(inputs, outputs, params):
+    bag_path, abs_path = inputs
+    processing.save_elbow_plots(pd.read_csv(bag_path), _pct_long(abs_path), outputs[0])
+
+
+# =========================
+# Stage Graph
+# =========================
+class Stage:
+    """
+    One step of the artifact chain.
+
+    Stages are linked through files: a stage depends on every stage that writes
+    one of its inputs. code lists the modules whose source is part of the
+    stage's fingerprint, so editing them also makes the stage stale.
+    """
+
+    def __init__(self, name, run, inputs, outputs, params=None, code=("processing.py",)):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.code = list(code)
+
+
+def build_stages(raw=ingest.RAW_PATH, thresholds=None, pattern="*.csv",
+                 method=processing.DEFAULT_KNEE_METHOD, target_pct=processing.TARGET_CUMULATIVE_PCT):
+    """The notebook chain from the raw OD export to the flow CSVs and elbow plots"""
+    # Floats, so 25 and 25.0 fingerprint the same
+    thresholds = {k: float(v) for k, v in (DEFAULT_THRESHOLDS if thresholds is None else thresholds).items()}
+    matrix_code = ("processing.py", "algorithms.py")
+    return [
+        Stage("ingest", run_ingest, [raw], ["data.csv", "org_mappings.json", "des_mappings.json"],
+              {"pattern": pattern}, code=("ingest.py",)),
+        Stage("summaries", run_summaries, ["data.csv"], ["org_summary.csv", "des_summary.csv"], code=matrix_code),
+        Stage("all_data", run_all_data, ["data.csv"], ["all_data.csv"], code=matrix_code),
+        Stage("percentages", run_percentages, ["all_data.csv"], [processing.PCT_PATH]),
+        Stage("bags", run_bags, ["all_data.csv"], ["bag_summary.csv"], {"thresholds": thresholds}),
+        Stage("optimal", run_optimal, ["bag_summary.csv", "all_data.csv"], ["optimal_branches.csv"],
+              {"method": method, "target_pct": float(target_pct)}),
+        Stage("final_sorting", run_final_sorting, ["optimal_branches.csv", "des_mappings.json"],
+              ["final_sorting_location.csv"]),
+        Stage("flows", run_flows, ["all_data.csv", "optimal_branches.csv"],
+              ["region_to_region_flow_analysis.csv", "region_receiving_analysis.csv"]),
+        Stage("threshold_grid", run_threshold_grid, ["all_data.csv", "des_mappings.json"],
+              [processing.threshold_grid_path(method, target_pct)], {"method": method, "target_pct": float(target_pct)}),
+        Stage("elbow_plots", run_elbow_plots, ["bag_summary.csv", "all_data.csv"], [processing.ELBOW_PLOT_DIR]),
+    ]
+
+
+def upstream(stages):
+    """{stage name: names of the stages that write its inputs}"""
+    writers = {path: stage.name for stage in stages for path in stage.outputs}
+    return {
+        stage.name: sorted({writers[path] for path in stage.inputs if path in writers} - {stage.name})
+        for stage in stages
+    }
+
+
+def with_upstream(stages, names):
+    """names plus every stage they transitively depend on"""
+    deps = upstream(stages)
+    selected, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in deps:
+            raise ValueError(f"Unknown stage: {name}")
+        if name not in selected:
+            selected.add(name)
+            todo.extend(deps[name])
+    return selected
+
+
+# =========================
+# Fingerprints
+# =========================
+def file_digest(path, cache):
+    """
+    Content hash of a file, or of every file under a directory (None if missing).
+
+    cache maps path -> [mtime_ns, size, sha1]; files whose mtime and size still
+    match are not re-read.
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(f"{os.path.relpath(file_path, path)}:{file_digest(file_path, cache)}".encode())
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return None
+
+    stat = os.stat(path)
+    cached = cache.get(path)
+    if cached is not None and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return cached[2]
+    sha1 = file_sha1(path)
+    cache[path] = [stat.st_mtime_ns, stat.st_size, sha1]
+    return sha1
+
+
+def stage_fingerprint(stage, cache):
+    """Hash of the stage's name, parameters, input contents and code"""
+    key = {
+        "name": stage.name,
+        "params": stage.params,
+        "inputs": {path: file_digest(path, cache) for path in stage.inputs},
+        "code": {path: file_digest(path, cache) for path in stage.code},
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state(state_path=STATE_PATH):
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state, state_path=STATE_PATH):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+def stage_status(stage, state, force=False):
+    """
+    "stale", "fresh", "kept" (inputs missing but outputs present, e.g. no raw
+    export) or "blocked" (inputs and outputs missing), with the fingerprint.
+    A stage is stale when forced, when its fingerprint changed, or when one of
+    its outputs is missing or differs from what the last run wrote.
+    """
+    cache = state["files"]
+    outputs = {path: file_digest(path, cache) for path in stage.outputs}
+    if any(file_digest(path, cache) is None for path in stage.inputs):
+        return ("kept" if all(outputs.values()) else "blocked"), None
+
+    fingerprint = stage_fingerprint(stage, cache)
+    recorded = state["stages"].get(stage.name, {})
+    if force or recorded.get("fingerprint") != fingerprint or recorded.get("outputs") != outputs:
+        return "stale", fingerprint
+    return "fresh", fingerprint
+
+
+# =========================
+# Runner
+# =========================
+def _run_stage(stage):
+    start = time.perf_counter()
+    stage.run(stage.inputs, stage.outputs, stage.params)
+    return time.perf_counter() - start
+
+
+def run_pipeline(stages, targets=None, force=(), workers=None, state_path=STATE_PATH, dry_run=False, progress=None):
+    """
+    Bring the targets (default: every stage) and their upstream stages up to date.
+
+    Stages are checked in dependency order once their upstream stages are done;
+    stale ones run in a process pool, so independent stages run in parallel.
+    force names stages to re-run regardless. With dry_run nothing runs and
+    stages downstream of a stale one are reported as stale. Returns
+    {stage: {"status", "seconds"}} with status "ran", "fresh", "kept",
+    "failed", "blocked", "skipped" (an upstream stage failed) or "stale" (dry run).
+    A blocked stage does not stop the stages after it: they use whatever
+    outputs are already on disk.
+    """
+    selected = with_upstream(stages, targets) if targets else {stage.name for stage in stages}
+    stages = [stage for stage in stages if stage.name in selected]
+    deps = upstream(stages)
+    state = load_state(state_path)
+    force = set(force)
+    results = {}
+    pending = list(stages)
+    running = {}
+
+    def finish(name, status, seconds=0.0):
+        results[name] = {"status": status, "seconds": seconds}
+        if progress is not None:
+            progress(name, results[name])
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                upstream_status = [results.get(name, {}).get("status") for name in deps[stage.name]]
+                if None in upstream_status:
+                    continue
+                pending.remove(stage)
+                if any(status in ("failed", "skipped") for status in upstream_status):
+                    finish(stage.name, "skipped")
+                    continue
+                if dry_run and "stale" in upstream_status:
+                    finish(stage.name, "stale")
+                    continue
+
+                status, fingerprint = stage_status(stage, state, stage.name in force)
+                if status == "stale" and not dry_run:
+                    running[pool.submit(_run_stage, stage)] = (stage, fingerprint)
+                else:
+                    finish(stage.name, status)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, fingerprint = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    state["stages"].pop(stage.name, None)
+                    finish(stage.name, "failed")
+                    results[stage.name]["error"] = f"{type(e).__name__}: {e}"
+                    continue
+                state["stages"][stage.name] = {
+                    "fingerprint": fingerprint,
+                    "outputs": {path: file_digest(path, state["files"]) for path in stage.outputs},
+                }
+                save_state(state, state_path)
+                finish(stage.name, "ran", seconds)
+
+    if not dry_run:
+        save_state(state, state_path)
+    return results
+
+
+def _print_result(name, result):
+    line = f"  {name:<16} {result['status']}"
+    if result["status"] == "ran":
+        line += f" ({result['seconds']:.2f}s)"
+    if "error" in result:
+        line += f": {result['error']}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the optimizer artifacts, re-running only stale stages")
+    parser.add_argument("stages", nargs="*", help="Stages to bring up to date (default: all)")
+    parser.add_argument("--raw", default=ingest.RAW_PATH, help="Raw OD export CSV, or a directory of them")
+    parser.add_argument("--pattern", default="*.csv", help="File pattern inside a raw directory")
+    parser.add_argument("--volume-threshold", type=float, default=DEFAULT_THRESHOLDS["Volume"])
+    parser.add_argument("--billed-threshold", type=float, default=DEFAULT_THRESHOLDS["Billed Wt"])
+    parser.add_argument("--knee-method", choices=processing.KNEE_METHODS, default=processing.DEFAULT_KNEE_METHOD)
+    parser.add_argument("--target-pct", type=float, default=processing.TARGET_CUMULATIVE_PCT,
+                        help="Cumulative %% for --knee-method target")
+    parser.add_argument("--force", nargs="*", default=None,
+                        help="Re-run these stages even if fresh (no names: every selected stage)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for independent stages")
+    parser.add_argument("--state", default=STATE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages are stale")
+    parser.add_argument("--list", action="store_true", help="Print the stage graph and exit")
+    args = parser.parse_args()
+
+    thresholds = {"Volume": args.volume_threshold, "Billed Wt": args.billed_threshold}
+    stages = build_stages(args.raw, thresholds, args.pattern, args.knee_method, args.target_pct)
+    if args.list:
+        deps = upstream(stages)
+        for stage in stages:
+            print(f"  {stage.name:<16} {', '.join(stage.inputs)} -> {', '.join(stage.outputs)}"
+                  + (f"  (after {', '.join(deps[stage.name])})" if deps[stage.name] else ""))
+        return
+
+    force = args.force
+    if force is not None and not force:
+        force = [stage.name for stage in stages]
+    results = run_pipeline(stages, args.stages or None, force or (), args.workers, args.state,
+                           args.dry_run, progress=_print_result)
+    failed = [name for name, result in results.items() if result["status"] == "failed"]
+    if failed:
+        raise SystemExit(f"Failed stages: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+import pandas as pd
+
+import processing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the elbow plots of every bag-summary group, redrawing only changed ones")
+    parser.add_argument("--bags", default="bag_summary.csv", help="Bag summary CSV")
+    parser.add_argument("--abs", default="all_data.csv", help="Absolute values CSV the percentages come from")
+    parser.add_argument("--out", default=processing.ELBOW_PLOT_DIR, help="Plot directory (holds the manifest)")
+    parser.add_argument("--workers", type=int, default=None, help="Render processes (1 draws in-process)")
+    parser.add_argument("--force", action="store_true", help="Redraw every plot")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df_pct_long = processing.load_long_table(args.abs)[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    result = processing.save_elbow_plots(pd.read_csv(args.bags), df_pct_long, args.out, args.workers, args.force)
+    print(
+        f"{len(result['rendered'])} rendered, {len(result['kept'])} unchanged, {len(result['removed'])} removed "
+        f"in {time.perf_counter() - start:.1f}s; manifest {args.out}/{processing.ELBOW_MANIFEST}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,47 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 import json
 
+import perf
+from algorithms import to_csr, csr_rows
+
 # =========================
 # Load & Melt Data
 # =========================
+GROUP_KEYS = ["Region", "Type", "Service_Type"]
+PCT_PATH = "all_data_percentage.csv"
+
+
+def branch_percentages(values, totals):
+    """Each value as a percentage of its row Total (0 where the Total is 0), as bags.ipynb computes it"""
+    totals = np.asarray(totals, dtype=np.float64)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.asarray(values, dtype=np.float64) / totals * 100
+    return np.where(np.isnan(pct), 0.0, pct)
+
+
+def build_percentage_table(df_abs):
+    """all_data_percentage.csv from all_data.csv: the branch columns divided by Total, without Total"""
+    branches = [c for c in df_abs.columns if c not in GROUP_KEYS + ["Total"]]
+    df_pct = df_abs[GROUP_KEYS].copy()
+    pct = branch_percentages(df_abs[branches].to_numpy(), df_abs["Total"].to_numpy())
+    return pd.concat([df_pct, pd.DataFrame(pct, columns=branches, index=df_abs.index)], axis=1)
+
+
+def export_percentages(abs_path="all_data.csv", pct_path=PCT_PATH):
+    """Write all_data_percentage.csv for tools that still read it; the loaders no longer do"""
+    build_percentage_table(pd.read_csv(abs_path)).to_csv(pct_path, index=False)
+    return pct_path
+
+
+@perf.timed
 def load_data():
     df_abs = pd.read_csv("all_data.csv")
-    df_pct = pd.read_csv("all_data_percentage.csv")
+    df_pct = build_percentage_table(df_abs)
 
     df_abs_long = df_abs.melt(
         id_vars=["Region", "Type", "Service_Type", "Total"],
@@ -20,21 +54,246 @@ def load_data():
         value_name="Percentage"
     )
 
-    df_merge = pd.merge(
-        df_abs_long,
-        df_pct_long,
-        on=["Region", "Type", "Service_Type", "Branch"],
-        how="inner"
-    )
+    # Both frames melt the same rows and branches in the same order, so no join is needed
+    df_merge = df_abs_long.assign(Percentage=df_pct_long["Percentage"].to_numpy())
     return df_abs, df_pct, df_abs_long, df_pct_long, df_merge
 
 
+@perf.timed
+def load_long_table(abs_path="all_data.csv", dtype=np.float64, pct_path=None):
+    """
+    The canonical long table: load_data's df_merge, built without the wide and melted copies.
+
+    Region, Type, Service_Type and Branch are categoricals (keys sorted, branches
+    in column order), so a row costs a few small integer codes plus Total, Value
+    and Percentage. Rows come in df_merge order (branch by branch), which makes
+    the table usable wherever df_merge or df_pct_long is expected. Only the
+    returned frame outlives the call. Percentages are derived from Total unless
+    pct_path names a percentage CSV to read them from instead.
+    """
+    df_abs = pd.read_csv(abs_path)
+    branches = [c for c in df_abs.columns if c not in GROUP_KEYS + ["Total"]]
+    totals = df_abs["Total"].to_numpy(dtype=np.float64)
+    values = df_abs[branches].to_numpy(dtype=np.float64)
+    keys = df_abs[GROUP_KEYS]
+    if pct_path is None:
+        pcts = branch_percentages(values, totals)
+    else:
+        # Inner join on the group keys, as load_data used to do
+        df_pct = pd.read_csv(pct_path)
+        branches = [b for b in branches if b in df_pct.columns]
+        pct_row = pd.MultiIndex.from_frame(df_pct[GROUP_KEYS]).get_indexer(pd.MultiIndex.from_frame(keys))
+        rows = np.flatnonzero(pct_row >= 0)
+        values = df_abs[branches].to_numpy(dtype=np.float64)[rows]
+        pcts = df_pct[branches].to_numpy(dtype=np.float64)[pct_row[rows]]
+        keys, totals = keys.iloc[rows], totals[rows]
+        del df_pct
+    del df_abs
+
+    n_rows, n_branches = len(keys), len(branches)
+    columns = {
+        key: pd.Categorical(np.tile(keys[key].to_numpy(), n_branches), categories=sorted(keys[key].unique()))
+        for key in GROUP_KEYS
+    }
+    columns["Total"] = np.tile(totals, n_branches)
+    columns["Branch"] = pd.Categorical.from_codes(np.repeat(np.arange(n_branches), n_rows), categories=branches)
+    columns["Value"] = values.T.ravel().astype(dtype, copy=False)
+    columns["Percentage"] = pcts.T.ravel().astype(dtype, copy=False)
+    return pd.DataFrame(columns)
+
+
+def long_to_wide(df_long, column="Value"):
+    """all_data.csv-style wide frame (keys, one column per branch, Total) of one long-table column"""
+    wide = df_long.pivot_table(index=GROUP_KEYS, columns="Branch", values=column, observed=True, sort=False)
+    wide.columns = wide.columns.astype(object)
+    totals = df_long.groupby(GROUP_KEYS, observed=True, sort=False)["Total"].first()
+    wide = wide.reset_index()
+    wide["Total"] = totals.to_numpy()
+    for key in GROUP_KEYS:
+        wide[key] = wide[key].astype(object)
+    return wide
+
+
+def group_totals(df_long):
+    """Total per (Region, Service_Type, Type) group, indexed by plain (non-categorical) keys"""
+    keys = ["Region", "Service_Type", "Type"]
+    totals = df_long.groupby(keys, observed=True)["Total"].first().reset_index()
+    return totals.astype({key: object for key in keys}).set_index(keys)["Total"]
+
+
+# =========================
+# Tables From data.csv
+# =========================
+# Types written to org_summary.csv / des_summary.csv, in record order
+SUMMARY_TYPES = ["Volume", "Billed Wt"]
+
+
+@perf.timed
+def build_all_data(df_matrix):
+    """
+    all_data.csv from the parsed OD matrix (algorithms.read_matrix_csv), as bags.ipynb builds it.
+
+    One row per (Region, Type, Service_Type) of origin region, one column per
+    destination branch (sorted) and a Total. Flows into the origin region's own
+    branches (same code prefix, BRANCH_PREFIX_REGION) are zeroed.
+    """
+    # read_matrix_csv keeps the branch_name column as an all-zero "Unnamed" type; drop it
+    df_matrix = df_matrix.loc[:, df_matrix.columns.get_level_values("type").isin(SUMMARY_TYPES)]
+    by_row = df_matrix.groupby(level=["org_region", "service_type"]).sum()
+    by_cell = by_row.T.groupby(level=["type", "des_branch_code"]).sum().T
+    wide = by_cell.stack(level="type", future_stack=True)
+    wide.index = wide.index.set_names(["Region", "Service_Type", "Type"])
+    wide = wide.reorder_levels(GROUP_KEYS).sort_index()
+    wide = wide[sorted(wide.columns)]
+
+    region_prefix = {region: prefix for prefix, region in BRANCH_PREFIX_REGION.items()}
+    own = np.array([region_prefix.get(region) for region in wide.index.get_level_values("Region")], dtype=object)
+    first = np.array([str(b)[:1] for b in wide.columns], dtype=object)
+    values = np.where(own[:, None] == first[None, :], 0.0, wide.to_numpy(dtype=np.float64))
+
+    df_abs = pd.DataFrame(values, index=wide.index, columns=list(wide.columns)).reset_index()
+    df_abs["Total"] = values.sum(axis=1)
+    return df_abs
+
+
+@perf.timed
+def build_org_summary(df_matrix):
+    """org_summary.csv: sum per origin branch, service type and type (all destinations)"""
+    by_type = df_matrix.groupby(level=["org_branch_code", "service_type"]).sum().T.groupby(level="type").sum().T
+    types = [t for t in SUMMARY_TYPES if t in by_type.columns]
+    df_org = by_type[types].stack(future_stack=True).round(3).reset_index()
+    df_org.columns = ["org_branch_code", "service_type", "type", "sum"]
+    return df_org
+
+
+@perf.timed
+def build_des_summary(df_matrix):
+    """des_summary.csv: sum per destination branch, service type and type (all origins)"""
+    by_branch = df_matrix.groupby(level="service_type").sum().T.groupby(level=["type", "des_branch_code"]).sum()
+    types = [t for t in SUMMARY_TYPES if t in by_branch.index.get_level_values("type")]
+    by_branch = pd.concat([by_branch.xs(t, level="type", drop_level=False) for t in types])
+    df_des = by_branch.stack(future_stack=True).round(3).reset_index()
+    df_des.columns = ["type", "des_branch_code", "service_type", "sum"]
+    return df_des[["des_branch_code", "service_type", "type", "sum"]]
+
+
+# =========================
+# Branch Sets
+# =========================
+class BranchSets:
+    """
+    Branch membership of many groups as a boolean (group x branch) mask.
+
+    keys holds one row of group columns (e.g. Region, Service_Type, Type) per
+    set and branches is the branch-ID dictionary shared by all sets, so
+    membership, union, intersection and difference across every group are
+    single array operations. order, when given, is a (group x branch) score
+    that lists a set's branches highest first (ties in dictionary order);
+    comma-joined strings only come out of to_strings() for display and export.
+    """
+
+    def __init__(self, keys, branches, mask, order=None):
+        self.keys = keys.reset_index(drop=True)
+        self.branches = np.asarray(branches, dtype=object)
+        self.branch_index = pd.Index(self.branches)
+        self.mask = np.asarray(mask, dtype=bool)
+        self.order = order
+
+    @classmethod
+    def from_strings(cls, keys, strings, branches=None, order=None):
+        """Parse comma-joined branch strings (one per keys row); unknown branches extend the dictionary"""
+        codes = [
+            [b.strip() for b in s.split(",") if b.strip()] if isinstance(s, str) else []
+            for s in strings
+        ]
+        known = [] if branches is None else list(branches)
+        listed = pd.unique(pd.Series([b for c in codes for b in c], dtype=object))
+        branches = known + [b for b in listed if b not in pd.Index(known)]
+        index = pd.Index(branches)
+        mask = np.zeros((len(codes), len(branches)), dtype=bool)
+        rows = np.repeat(np.arange(len(codes)), [len(c) for c in codes])
+        mask[rows, index.get_indexer([b for c in codes for b in c])] = True
+        if order is not None and order.shape[1] < len(branches):
+            order = np.pad(order, ((0, 0), (0, len(branches) - order.shape[1])))
+        return cls(keys, branches, mask, order)
+
+    def _aligned(self, other):
+        """other's mask laid out on this object's keys and branch dictionary"""
+        # Sets from the same source (e.g. one ThresholdSweep) already share the layout
+        if (other.branches is self.branches or np.array_equal(other.branches, self.branches)) \
+                and other.keys.equals(self.keys):
+            return other.mask
+        rows = other.rows(self.keys)
+        cols = other.branch_index.get_indexer(self.branches)
+        padded = np.pad(other.mask, ((0, 1), (0, 1)))
+        return padded[np.ix_(rows, cols)]
+
+    def _with(self, mask):
+        return BranchSets(self.keys, self.branches, mask, self.order)
+
+    def union(self, other):
+        return self._with(self.mask | self._aligned(other))
+
+    def intersection(self, other):
+        return self._with(self.mask & self._aligned(other))
+
+    def difference(self, other):
+        return self._with(self.mask & ~self._aligned(other))
+
+    def contains(self, branches):
+        """(group x len(branches)) membership of the given branch codes"""
+        cols = self.branch_index.get_indexer(list(branches))
+        return np.pad(self.mask, ((0, 0), (0, 1)))[:, cols]
+
+    def counts(self):
+        return self.mask.sum(axis=1)
+
+    def rows(self, keys):
+        """
+        Position of every keys row among these sets, matched on the key columns
+        both share (-1 when absent; a repeated group resolves to its last row).
+        """
+        columns = [c for c in self.keys.columns if c in keys.columns]
+        index = pd.MultiIndex.from_frame(self.keys[columns])
+        last = pd.Series(np.arange(len(index)), index=index)[~index.duplicated(keep="last")]
+        found = last.reindex(pd.MultiIndex.from_frame(keys[columns]))
+        return found.fillna(-1).to_numpy(dtype=int)
+
+    def pairs(self):
+        """(set row, branch code) of every member, each set listed in its display order"""
+        rows, cols = np.nonzero(self.mask)
+        if self.order is not None:
+            sort = np.lexsort((cols, -self.order[rows, cols], rows))
+            rows, cols = rows[sort], cols[sort]
+        return rows, self.branches[cols]
+
+    def members(self):
+        """(key values..., branch code) of every member, e.g. to pass a difference() to FlowAnalysis.apply"""
+        rows, cols = np.nonzero(self.mask)
+        keys = self.keys.to_numpy(dtype=object)[rows]
+        return [(*key, branch) for key, branch in zip(keys.tolist(), self.branches[cols].tolist())]
+
+    def codes(self, row):
+        """Branch codes of one set in display order"""
+        rows, codes = self.pairs()
+        return list(codes[rows == row])
+
+    def to_strings(self, labels=None):
+        """One comma-joined string per set ("" when empty); labels maps a code to its display text"""
+        rows, codes = self.pairs()
+        if labels is not None:
+            codes = np.array([labels.get(c, c) for c in codes], dtype=object)
+        joined = pd.Series(codes, dtype=object).groupby(rows).agg(", ".join)
+        return joined.reindex(np.arange(len(self.keys)), fill_value="").to_numpy()
+
+
 # =========================
 # Bag Summary (Above Threshold)
 # =========================
+@perf.timed
 def build_bag_summary(df_merge, thresholds):
     results = []
-    for (region, stype, type_), group in df_merge.groupby(["Region", "Service_Type", "Type"]):
+    for (region, stype, type_), group in df_merge.groupby(["Region", "Service_Type", "Type"], observed=True):
         thresh = thresholds.get(type_, 0)
 
         filtered = group[group["Value"] >= thresh]
@@ -57,69 +316,721 @@ def build_bag_summary(df_merge, thresholds):
 # =========================
 # Elbow Finder
 # =========================
+# Distances within this fraction of the chord length count as ties, so the elbow is never
+# picked by floating-point noise (bags.ipynb's argmax was): the first tied point wins, and a
+# curve with no point off the chord (two branches, or equal percentages) has no elbow and
+# keeps every branch, as the "kneedle" method does for flat curves
+ELBOW_TIE_TOLERANCE = 1e-12
+
+
 def find_elbow(x, y):
+    """
+    Index of the point farthest (perpendicular) from the chord joining the first
+    and last points; ties follow ELBOW_TIE_TOLERANCE (the last point when none is off the chord).
+    """
     if len(x) < 2:   # not enough points
         return 0
-    p1, p2 = np.array([x[0], y[0]]), np.array([x[-1], y[-1]])
-    line_vec = (p2 - p1) / np.linalg.norm(p2 - p1)
-    distances = []
-    for i in range(len(x)):
-        p = np.array([x[i], y[i]])
-        proj_len = np.dot(p - p1, line_vec)
-        proj_point = p1 + proj_len * line_vec
-        distances.append(np.linalg.norm(p - proj_point))
-    return int(np.argmax(distances))
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    dx, dy = x[-1] - x[0], y[-1] - y[0]
+    norm = np.sqrt(dx * dx + dy * dy)
+    lx, ly = dx / norm, dy / norm
+
+    proj_len = (x - x[0]) * lx + (y - y[0]) * ly
+    ex = x - (x[0] + proj_len * lx)
+    ey = y - (y[0] + proj_len * ly)
+    dist = np.sqrt(ex * ex + ey * ey)
+    tolerance = ELBOW_TIE_TOLERANCE * norm
+    if dist.max() <= tolerance:
+        return len(x) - 1
+    return int(np.argmax(dist >= dist.max() - tolerance))
+
+
+@perf.timed
+def find_elbows(curves, lengths):
+    """
+    Batched find_elbow over padded curves.
+
+    curves is a (groups x max_len) array whose row g holds a cumulative curve in
+    its first lengths[g] entries (x = 1..lengths[g]); padding is ignored.
+    Returns the elbow index of every row, with ties as in find_elbow.
+    """
+    curves = np.asarray(curves, dtype=float)
+    lengths = np.asarray(lengths, dtype=np.intp)
+    n_groups, max_len = curves.shape
+    if n_groups == 0 or max_len == 0:
+        return np.zeros(n_groups, dtype=np.intp)
+
+    rows = np.arange(n_groups)
+    last = np.maximum(lengths - 1, 0)
+    y0 = curves[:, :1]
+    dx = last.astype(float)
+    dy = curves[rows, last] - y0[:, 0]
+    norm = np.sqrt(dx * dx + dy * dy)
+    norm[norm == 0] = 1.0
+    lx, ly = (dx / norm)[:, None], (dy / norm)[:, None]
+
+    x = np.arange(1, max_len + 1, dtype=float)[None, :]
+    proj_len = (x - 1.0) * lx + (curves - y0) * ly
+    ex = x - (1.0 + proj_len * lx)
+    ey = curves - (y0 + proj_len * ly)
+    dist = np.sqrt(ex * ex + ey * ey)
+    dist[x[0][None, :] > lengths[:, None]] = -np.inf
+
+    tolerance = ELBOW_TIE_TOLERANCE * norm
+    farthest = dist.max(axis=1)
+    elbows = np.argmax(dist >= (farthest - tolerance)[:, None], axis=1)
+    elbows = np.where(farthest <= tolerance, last, elbows)
+    elbows[lengths < 2] = 0
+    return elbows
+
+
+# =========================
+# Knee Methods
+# =========================
+# "chord" is find_elbows (the bags.ipynb method and the default everywhere)
+KNEE_METHODS = ("chord", "kneedle", "l_method", "curvature", "target")
+DEFAULT_KNEE_METHOD = "chord"
+# Cut-off of the "target" method: fewest branches whose cumulative percentage reaches it
+TARGET_CUMULATIVE_PCT = 80.0
+# Kneedle sensitivity S: a knee needs a normalized gap above S / (n - 1)
+KNEEDLE_SENSITIVITY = 1.0
+
+
+def _normalized(curves, lengths):
+    """x and y of every padded curve scaled to [0, 1] over its own points, plus the validity mask"""
+    n_groups, max_len = curves.shape
+    idx = np.arange(max_len)[None, :]
+    valid = idx < lengths[:, None]
+    last = np.maximum(lengths - 1, 0)
+    span_x = np.where(last > 0, last, 1).astype(float)[:, None]
+    y0 = curves[:, :1]
+    span_y = curves[np.arange(n_groups), last][:, None] - y0
+    span_y[span_y == 0] = 1.0
+    return idx / span_x, (curves - y0) / span_y, valid
+
+
+def _kneedle(curves, lengths, sensitivity=KNEEDLE_SENSITIVITY):
+    """
+    Kneedle (Satopaa et al.) on the normalized curves: the maximum of y - x.
+
+    Cumulative curves of descending percentages are concave, so the difference
+    curve has a single maximum and Kneedle's threshold scan reduces to checking
+    that it clears sensitivity / (n - 1); curves without a knee keep every branch.
+    """
+    xn, yn, valid = _normalized(curves, lengths)
+    diff = np.where(valid, yn - xn, -np.inf)
+    knees = np.argmax(diff, axis=1)
+    flat = diff.max(axis=1) <= sensitivity / np.maximum(lengths - 1, 1)
+    return np.where(flat, np.maximum(lengths - 1, 0), knees)
+
+
+def _l_method(curves, lengths):
+    """
+    L-method (Salvador & Chan): the split whose two least-squares lines fit best.
+
+    A split at c fits points 0..c and c+1..n-1 (two or more each) and scores
+    (c+1)/n * RMSE_left + (n-c-1)/n * RMSE_right; every split of every group
+    comes from prefix sums, so no line is fitted point by point. Curves under
+    four points fall back to the chord elbow.
+    """
+    n_groups, max_len = curves.shape
+    idx = np.arange(max_len, dtype=float)[None, :]
+    valid = idx < lengths[:, None]
+    y = np.where(valid, curves - curves[:, :1], 0.0)
+    # Sums over x = 0..c have closed forms; only the y sums need prefix passes
+    prefix = [np.broadcast_to(a, curves.shape) for a in (idx + 1, idx * (idx + 1) / 2, idx * (idx + 1) * (2 * idx + 1) / 6)]
+    prefix += [np.cumsum(a, axis=1) for a in (y, idx * y, y * y)]
+    last = np.maximum(lengths - 1, 0)
+    total = [a[np.arange(n_groups), last][:, None] for a in prefix]
+
+    def rmse(m, sx, sxx, sy, sxy, syy):
+        m_safe = np.maximum(m, 1.0)
+        cxx = sxx - sx * sx / m_safe
+        cxy = sxy - sx * sy / m_safe
+        cyy = syy - sy * sy / m_safe
+        sse = cyy - np.divide(cxy * cxy, cxx, out=np.zeros_like(cxx), where=cxx > 0)
+        return np.sqrt(np.maximum(sse, 0.0) / m_safe)
+
+    left = rmse(*prefix)
+    right = rmse(*[t - a for t, a in zip(total, prefix)])
+    n = np.maximum(lengths, 1).astype(float)[:, None]
+    score = (idx + 1) / n * left + (n - idx - 1) / n * right
+    score[(idx < 1) | (idx > lengths[:, None] - 3)] = np.inf
+    knees = np.argmin(score, axis=1)
+    short = lengths < 4
+    if short.any():
+        knees[short] = find_elbows(curves[short], lengths[short])
+    return knees
+
+
+def _curvature(curves, lengths):
+    """Interior point of largest discrete curvature |y''| / (1 + y'^2)^1.5 on the normalized curves"""
+    xn, yn, _ = _normalized(curves, lengths)
+    h = np.diff(xn, axis=1)[:, :1]
+    h[h == 0] = 1.0
+    kappa = np.full(curves.shape, -np.inf)
+    d1 = (yn[:, 2:] - yn[:, :-2]) / (2 * h)
+    d2 = (yn[:, 2:] - 2 * yn[:, 1:-1] + yn[:, :-2]) / (h * h)
+    kappa[:, 1:-1] = np.abs(d2) / (1 + d1 * d1) ** 1.5
+    idx = np.arange(curves.shape[1])[None, :]
+    kappa[(idx < 1) | (idx > lengths[:, None] - 2)] = -np.inf
+    knees = np.argmax(kappa, axis=1)
+    return np.where(lengths < 3, 0, knees)
+
+
+def _target(curves, lengths, target_pct=TARGET_CUMULATIVE_PCT):
+    """First point whose cumulative percentage reaches target_pct (every branch if none does)"""
+    valid = np.arange(curves.shape[1])[None, :] < lengths[:, None]
+    reached = valid & (curves >= target_pct)
+    return np.where(reached.any(axis=1), np.argmax(reached, axis=1), np.maximum(lengths - 1, 0))
+
+
+def find_knees(curves, lengths, method=DEFAULT_KNEE_METHOD, target_pct=TARGET_CUMULATIVE_PCT):
+    """
+    Knee index of every padded curve (find_elbows layout) under one of KNEE_METHODS.
+
+    All methods read the same curves, so the sort and accumulation done by
+    bag_curves or ThresholdSweep are shared between them.
+    """
+    curves = np.asarray(curves, dtype=float)
+    lengths = np.asarray(lengths, dtype=np.intp)
+    if curves.shape[0] == 0 or curves.shape[1] == 0:
+        return np.zeros(curves.shape[0], dtype=np.intp)
+    if method == "chord":
+        return find_elbows(curves, lengths)
+    if method == "kneedle":
+        knees = _kneedle(curves, lengths)
+    elif method == "l_method":
+        knees = _l_method(curves, lengths)
+    elif method == "curvature":
+        knees = _curvature(curves, lengths)
+    elif method == "target":
+        knees = _target(curves, lengths, target_pct)
+    else:
+        raise ValueError(f"Unknown knee method {method!r}; expected one of {KNEE_METHODS}")
+    return np.where(lengths < 2, 0, knees).astype(np.intp)
 
 
 # =========================
 # Optimal Branches (Elbow Method)
 # =========================
-def build_optimal_branches(df_bag, df_pct_long):
-    optimal_results = []
-    for _, row in df_bag.iterrows():
-        branches_str = row["Branches"]
-        if not isinstance(branches_str, str) or not branches_str.strip():
-            continue
-
-        branches = [b.strip() for b in branches_str.split(",")]
-        subset = df_pct_long[
-            (df_pct_long["Region"] == row["Region"]) &
-            (df_pct_long["Service_Type"] == row["Service_Type"]) &
-            (df_pct_long["Type"] == row["Type"]) &
-            (df_pct_long["Branch"].isin(branches))
-        ].copy()
-
-        if subset.empty:
-            continue
-
-        subset = subset.sort_values("Percentage", ascending=False).reset_index(drop=True)
-        subset["Cumulative_Percentage"] = subset["Percentage"].cumsum()
-
-        x = np.arange(1, len(subset) + 1)
-        y = subset["Cumulative_Percentage"].values
-        elbow_idx = find_elbow(x, y)
-
-        opt_num_branches = x[elbow_idx]
-        opt_cum_pct = y[elbow_idx]
-        opt_branches = subset.loc[:elbow_idx, "Branch"].tolist()
-
-        optimal_results.append({
-            "Region": row["Region"],
-            "Service_Type": row["Service_Type"],
-            "Type": row["Type"],
-            "Optimal_Num_Branches": opt_num_branches,
-            "Optimal_Cumulative_Percentage": opt_cum_pct,
-            "Branches": ", ".join(opt_branches)
-        })
+OPTIMAL_COLUMNS = [
+    "Region", "Service_Type", "Type",
+    "Optimal_Num_Branches", "Optimal_Cumulative_Percentage", "Branches"
+]
+
+
+@perf.timed
+def bag_curves(df_bag, df_pct_long):
+    """
+    Cumulative percentage curves of every bag-summary group, built in one pass.
+
+    Candidate branches of all groups are joined to their percentages at once and
+    sorted by (group, percentage desc); equal percentages keep the df_pct_long
+    order. (bags.ipynb's sort_values used numpy's unstable quicksort, whose tie
+    order depends on the array and the CPU's sort kernel.) Returns
+    None when no group has candidates, else a dict with "groups" (the group keys,
+    one row per curve), "curves" (groups x max_len, padded cumulative sums),
+    "lengths", and "branch"/"group_ids"/"pos" giving every sorted candidate's
+    branch, curve row and position on that curve.
+    """
+    keys = ["Region", "Service_Type", "Type"]
+    bag = df_bag[keys + ["Branches"]].reset_index(drop=True)
+    bag = bag[bag["Branches"].apply(lambda s: isinstance(s, str) and bool(s.strip()))]
+    if bag.empty:
+        return None
+
+    # One (group, branch) row per candidate branch
+    pairs = bag.assign(Group=bag.index, Branch=bag["Branches"].str.split(","))
+    pairs = pairs.explode("Branch")
+    pairs["Branch"] = pairs["Branch"].str.strip()
+    subset = df_pct_long.merge(pairs[keys + ["Branch", "Group"]], on=keys + ["Branch"], how="inner")
+    if subset.empty:
+        return None
+
+    # Sort once by group, then percentage (descending, stable)
+    group_ids, groups = pd.factorize(subset["Group"], sort=True)
+    order = np.lexsort((-subset["Percentage"].to_numpy(), group_ids))
+    group_ids = group_ids[order]
+    pct = subset["Percentage"].to_numpy(dtype=float)[order]
+
+    lengths = np.bincount(group_ids, minlength=len(groups))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    pos = np.arange(len(order)) - starts[group_ids]
+
+    # Padded cumulative curves, one row per group
+    curves = np.zeros((len(groups), lengths.max()))
+    curves[group_ids, pos] = pct
+    curves = curves.cumsum(axis=1)
+
+    return {
+        "groups": bag.loc[groups, keys].reset_index(drop=True),
+        "curves": curves,
+        "lengths": lengths,
+        "branch": subset["Branch"].to_numpy()[order],
+        "group_ids": group_ids,
+        "pos": pos,
+    }
+
+
+@perf.timed
+def build_optimal_branches(df_bag, df_pct_long, method=DEFAULT_KNEE_METHOD, target_pct=TARGET_CUMULATIVE_PCT):
+    """
+    Elbow-optimal branches for every bag-summary group in one pass.
+
+    The groups' cumulative curves come from bag_curves, so every elbow is found
+    by a single vectorized find_knees call; method picks one of KNEE_METHODS.
+    """
+    shared = bag_curves(df_bag, df_pct_long)
+    if shared is None:
+        return pd.DataFrame(columns=OPTIMAL_COLUMNS)
+    curves, group_ids, pos = shared["curves"], shared["group_ids"], shared["pos"]
+
+    elbows = find_knees(curves, shared["lengths"], method, target_pct)
+    keep = pos <= elbows[group_ids]
+    opt_branches = pd.Series(shared["branch"][keep]).groupby(group_ids[keep]).agg(", ".join)
+
+    df_optimal = shared["groups"].copy()
+    df_optimal["Optimal_Num_Branches"] = elbows + 1
+    df_optimal["Optimal_Cumulative_Percentage"] = curves[np.arange(len(curves)), elbows]
+    df_optimal["Branches"] = opt_branches.reindex(np.arange(len(curves))).to_numpy()
+    return df_optimal
+
+
+@perf.timed
+def compare_knees(df_bag, df_pct_long, methods=KNEE_METHODS, target_pct=TARGET_CUMULATIVE_PCT):
+    """
+    Optimal branch count and cumulative percentage of every group under each knee method.
+
+    One bag_curves pass feeds every method. Columns are the group keys,
+    Num_Branches, then <method>_Num_Branches and <method>_Cumulative_Percentage.
+    """
+    shared = bag_curves(df_bag, df_pct_long)
+    columns = ["Region", "Service_Type", "Type", "Num_Branches"]
+    columns += [f"{m}_{c}" for m in methods for c in ("Num_Branches", "Cumulative_Percentage")]
+    if shared is None:
+        return pd.DataFrame(columns=columns)
+    curves, lengths = shared["curves"], shared["lengths"]
+    df = shared["groups"].copy()
+    df["Num_Branches"] = lengths
+    for method in methods:
+        knees = find_knees(curves, lengths, method, target_pct)
+        df[f"{method}_Num_Branches"] = knees + 1
+        df[f"{method}_Cumulative_Percentage"] = curves[np.arange(len(curves)), knees]
+    return df[columns]
+
+
+# =========================
+# Elbow Plots
+# =========================
+ELBOW_PLOT_DIR = "elbow_plots"
+# index.json in the plot directory: which group each PNG shows and the curve it was drawn from
+ELBOW_MANIFEST = "index.json"
+# Bump when the figure layout changes, so every plot is redrawn once
+ELBOW_PLOT_VERSION = 1
+
+
+def elbow_plot_path(region, service_type, type_, out_dir=ELBOW_PLOT_DIR):
+    """elbow_plots/<Region>_<Service_Type>_<Type>.png, spaces replaced as bags.ipynb names them"""
+    return f"{out_dir}/{region}_{service_type}_{type_}.png".replace(" ", "_")
+
+
+def elbow_fingerprint(y, elbow):
+    """Digest of a cumulative curve and its elbow index; equal digests draw the same plot"""
+    digest = hashlib.sha1(np.round(np.asarray(y, dtype=np.float64), 9).tobytes())
+    digest.update(str(int(elbow)).encode())
+    return digest.hexdigest()
+
+
+def load_elbow_manifest(out_dir=ELBOW_PLOT_DIR):
+    """{png file name: entry} from the plot directory's manifest; empty when missing or from another layout version"""
+    try:
+        with open(os.path.join(out_dir, ELBOW_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest["plots"] if manifest.get("version") == ELBOW_PLOT_VERSION else {}
+
+
+def _render_elbow_plot(job):
+    """Draw one bags.ipynb elbow plot to job["path"] on the Agg canvas (safe in worker processes)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # plotting is optional for the rest of the module
+    from matplotlib.figure import Figure
+
+    x = np.arange(1, len(job["y"]) + 1)
+    y, elbow = job["y"], job["elbow"]
+    opt_num_branches, opt_cum_pct = x[elbow], y[elbow]
+
+    fig = Figure(figsize=(8, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(x, y, marker="o", label="Cumulative %")
+    ax.axvline(opt_num_branches, color="r", linestyle="--")
+    ax.axhline(opt_cum_pct, color="r", linestyle="--")
+    ax.scatter(opt_num_branches, opt_cum_pct, color="red", zorder=5, label="Elbow Point")
+    ax.text(opt_num_branches, opt_cum_pct,
+            f"Opt = {opt_num_branches} branches\nCum% = {opt_cum_pct:.2f}",
+            fontsize=9, ha="left", va="bottom", color="red")
+    ax.set_title(job["title"])
+    ax.set_xlabel("Number of Branches")
+    ax.set_ylabel("Cumulative Percentage")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(job["path"], dpi=150)
+    return job["path"]
+
+
+@perf.timed
+def save_elbow_plots(df_bag, df_pct_long, out_dir=ELBOW_PLOT_DIR, workers=None, force=False):
+    """
+    Write the bags.ipynb elbow plot of every bag-summary group, redrawing only changed ones.
+
+    Each group's curve and elbow are fingerprinted (elbow_fingerprint) against the
+    manifest from the previous run; groups whose PNG exists with the same
+    fingerprint are kept (unless force), the rest are drawn across a process pool of workers
+    (1 draws in-process). PNGs of groups that no longer exist are removed. The
+    manifest is rewritten last. Returns {"rendered", "kept", "removed"} path lists.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    previous = load_elbow_manifest(out_dir)
+    shared = bag_curves(df_bag, df_pct_long)
+    plots, jobs, kept = {}, [], []
+    if shared is not None:
+        elbows = find_elbows(shared["curves"], shared["lengths"])
+        for g, (region, stype, type_) in enumerate(shared["groups"].itertuples(index=False)):
+            y = shared["curves"][g, :shared["lengths"][g]]
+            path = elbow_plot_path(region, stype, type_, out_dir)
+            name = os.path.basename(path)
+            plots[name] = {
+                "region": region,
+                "service_type": stype,
+                "type": type_,
+                "fingerprint": elbow_fingerprint(y, elbows[g]),
+                "optimal_num_branches": int(elbows[g] + 1),
+                "optimal_cumulative_percentage": float(y[elbows[g]]),
+            }
+            unchanged = previous.get(name, {}).get("fingerprint") == plots[name]["fingerprint"]
+            if unchanged and not force and os.path.exists(path):
+                kept.append(path)
+            else:
+                jobs.append({"path": path, "y": y, "elbow": int(elbows[g]),
+                             "title": f"Elbow Plot - {region}, {stype}, {type_}"})
+
+    if workers == 1 or len(jobs) <= 1:
+        rendered = [_render_elbow_plot(job) for job in jobs]
+    else:
+        n_workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            rendered = list(pool.map(_render_elbow_plot, jobs, chunksize=max(1, len(jobs) // (4 * n_workers))))
 
-    return pd.DataFrame(optimal_results)
+    removed = []
+    for name in set(previous) - set(plots):
+        path = os.path.join(out_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+
+    with open(os.path.join(out_dir, ELBOW_MANIFEST), "w") as f:
+        json.dump({"version": ELBOW_PLOT_VERSION, "plots": plots}, f, indent=2)
+    return {"rendered": rendered, "kept": kept, "removed": removed}
+
+
+# =========================
+# Threshold Sweep
+# =========================
+# Integer thresholds the bags.py sliders can take
+SWEEP_THRESHOLDS = np.arange(0, 101)
+
+
+class ThresholdSweep:
+    """
+    Bag-summary and optimal-branch results for every sweep threshold and group.
+
+    A group's candidates above a threshold are a prefix of its values sorted in
+    descending order, so the branch count and cumulative percentage of every
+    (group, threshold) pair are computed once up front. bag_summary() and
+    optimal_branches() then only look up the precomputed tables and join the
+    branch names; thresholds outside the sweep fall back to the full builders.
+    Knee tables of a KNEE_METHODS entry are built from the same sorted curves the
+    first time that method is asked for, then kept.
+    """
+
+    @perf.timed
+    def __init__(self, df_merge, thresholds=SWEEP_THRESHOLDS, target_pct=TARGET_CUMULATIVE_PCT):
+        keys = ["Region", "Service_Type", "Type"]
+        self.thresholds = np.asarray(thresholds)
+        self.target_pct = target_pct
+        self._column = {t: i for i, t in enumerate(self.thresholds.tolist())}
+        self._df_merge = df_merge
+        self._frames = {}
+
+        grouped = df_merge.groupby(keys, observed=True)
+        gid = grouped.ngroup().to_numpy()
+        self.groups = grouped.size().index.to_frame(index=False).astype(object)
+        in_group = gid >= 0
+        self._gid = gid[in_group]
+        self._value = df_merge["Value"].to_numpy(dtype=float)[in_group]
+        self._pct = df_merge["Percentage"].to_numpy(dtype=float)[in_group]
+        self._branch = df_merge["Branch"].to_numpy()[in_group]
+        n_groups, n_rows = len(self.groups), len(self._gid)
+
+        # Branch-ID dictionary in df_merge (melt) order, and percentages by (group, branch)
+        self.branches = pd.unique(self._branch)
+        self._bid = pd.Index(self.branches).get_indexer(self._branch)
+        self._pct_matrix = np.zeros((n_groups, len(self.branches)))
+        self._pct_matrix[self._gid, self._bid] = self._pct
+
+        # Padded (group x position) values and percentages in descending value order
+        pos_in_merge = np.arange(n_rows)
+        order = np.lexsort((pos_in_merge, -self._value, self._gid))
+        lengths = np.bincount(self._gid, minlength=n_groups)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        pos = np.arange(n_rows) - starts[self._gid[order]]
+        width = max(int(lengths.max()), 1) if n_groups else 1
+        values = np.full((n_groups, width), -np.inf)
+        values[self._gid[order], pos] = np.nan_to_num(self._value[order], nan=-np.inf)
+        pcts = np.zeros((n_groups, width))
+        pcts[self._gid[order], pos] = self._pct[order]
+        cum_pcts = np.concatenate((np.zeros((n_groups, 1)), pcts.cumsum(axis=1)), axis=1)
+
+        # Descending-percentage rank of every row in its group (ties keep merge order)
+        pct_order = np.lexsort((pos_in_merge, -self._pct, self._gid))
+        self._pct_order = pct_order
+
+        shape = (n_groups, len(self.thresholds))
+        self.counts = np.zeros(shape, dtype=int)
+        self.cumulative = np.zeros(shape)
+        rows = np.arange(n_groups)
+        for i, t in enumerate(self.thresholds):
+            counts = (values >= t).sum(axis=1)
+            self.counts[:, i] = counts
+            self.cumulative[:, i] = cum_pcts[rows, counts]
+        self._pcts = pcts
+        self._knees = {}
+
+    @perf.timed
+    def knee_tables(self, method=DEFAULT_KNEE_METHOD):
+        """(optimal counts, optimal cumulative %) per (group, threshold), computed on a method's first use"""
+        if method not in KNEE_METHODS:
+            raise ValueError(f"Unknown knee method {method!r}; expected one of {KNEE_METHODS}")
+        if method not in self._knees:
+            n_groups, width = self._pcts.shape
+            rows = np.arange(n_groups)
+            optimal_counts = np.zeros(self.counts.shape, dtype=int)
+            optimal_cumulative = np.zeros(self.counts.shape)
+            for i in range(len(self.thresholds)):
+                counts = self.counts[:, i]
+
+                # Knee over the candidates' percentages, largest first
+                curves = np.where(np.arange(width)[None, :] < counts[:, None], self._pcts, -np.inf)
+                curves = -np.sort(-curves, axis=1)
+                curves[np.isinf(curves)] = 0.0
+                curves = curves.cumsum(axis=1)
+                curves = curves[:, :max(int(counts.max()), 1)]
+                knees = find_knees(curves, counts, method, self.target_pct)
+                optimal_counts[:, i] = np.where(counts > 0, knees + 1, 0)
+                optimal_cumulative[:, i] = np.where(counts > 0, curves[rows, knees], 0.0)
+            self._knees[method] = (optimal_counts, optimal_cumulative)
+        return self._knees[method]
+
+    def _columns(self, thresholds):
+        """Sweep column of every group under a {Type: threshold} mapping, or None if any is off the sweep"""
+        per_group = self.groups["Type"].map(lambda t: thresholds.get(t, 0))
+        cols = [self._column.get(t) for t in per_group]
+        return None if any(c is None for c in cols) else np.array(cols, dtype=int)
+
+    def summary(self, thresholds, method=DEFAULT_KNEE_METHOD):
+        """Per-group counts and cumulative percentages for a {Type: threshold} mapping"""
+        cols = self._columns(thresholds)
+        if cols is None:
+            raise KeyError(f"thresholds {thresholds} are not all in the sweep")
+        rows = np.arange(len(self.groups))
+        df = self.groups.copy()
+        df["Num_Branches"] = self.counts[rows, cols]
+        df["Cumulative_Percentage"] = self.cumulative[rows, cols]
+        optimal_counts, optimal_cumulative = self.knee_tables(method)
+        df["Optimal_Num_Branches"] = optimal_counts[rows, cols]
+        df["Optimal_Cumulative_Percentage"] = optimal_cumulative[rows, cols]
+        return df
+
+    @perf.timed
+    def _build(self, thresholds, method):
+        cols = self._columns(thresholds)
+        if cols is None:
+            df_bag = build_bag_summary(self._df_merge, thresholds)
+            df_pct_long = self._df_merge[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+            df_optimal = build_optimal_branches(df_bag, df_pct_long, method, self.target_pct)
+            bag = self.groups.merge(df_bag, how="left")
+            optimal = self.groups.merge(df_optimal, how="left")
+            bag_sets = BranchSets.from_strings(self.groups, bag["Branches"], self.branches)
+            optimal_sets = BranchSets.from_strings(
+                self.groups, optimal["Branches"], self.branches, self._pct_matrix
+            )
+            return df_bag, df_optimal, bag_sets, optimal_sets
+
+        summary = self.summary(thresholds, method)
+        thresh = self.thresholds[cols][self._gid]
+        candidate = self._value >= thresh
+        bag_mask = np.zeros(self._pct_matrix.shape, dtype=bool)
+        bag_mask[self._gid[candidate], self._bid[candidate]] = True
+
+        # Optimal branches are the top percentages among the candidates
+        order = self._pct_order[candidate[self._pct_order]]
+        gid = self._gid[order]
+        rank = np.arange(len(order)) - np.searchsorted(gid, gid)
+        keep = rank < summary["Optimal_Num_Branches"].to_numpy()[gid]
+        optimal_mask = np.zeros(self._pct_matrix.shape, dtype=bool)
+        optimal_mask[gid[keep], self._bid[order][keep]] = True
+
+        bag_sets = BranchSets(self.groups, self.branches, bag_mask)
+        optimal_sets = BranchSets(self.groups, self.branches, optimal_mask, self._pct_matrix)
+
+        df_bag = summary[["Region", "Service_Type", "Type", "Num_Branches", "Cumulative_Percentage"]].copy()
+        df_bag["Branches"] = bag_sets.to_strings()
+
+        has_candidates = (summary["Num_Branches"] > 0).to_numpy()
+        df_optimal = summary.loc[has_candidates, OPTIMAL_COLUMNS[:-1]].reset_index(drop=True)
+        df_optimal["Branches"] = optimal_sets.to_strings()[has_candidates]
+        return df_bag, df_optimal, bag_sets, optimal_sets
+
+    def _cached(self, thresholds, method):
+        if method not in KNEE_METHODS:
+            raise ValueError(f"Unknown knee method {method!r}; expected one of {KNEE_METHODS}")
+        key = (method,) + tuple(sorted(thresholds.items()))
+        if key not in self._frames:
+            self._frames[key] = self._build(thresholds, method)
+        return self._frames[key]
+
+    def bag_summary(self, thresholds, method=DEFAULT_KNEE_METHOD):
+        """build_bag_summary(df_merge, thresholds) from the sweep tables"""
+        return self._cached(thresholds, method)[0].copy()
+
+    def optimal_branches(self, thresholds, method=DEFAULT_KNEE_METHOD):
+        """build_optimal_branches of the matching bag summary from the sweep tables"""
+        return self._cached(thresholds, method)[1].copy()
+
+    def branch_sets(self, thresholds, method=DEFAULT_KNEE_METHOD):
+        """(bag, optimal) BranchSets over every sweep group, optimal ones ordered by percentage"""
+        return self._cached(thresholds, method)[2:]
+
+
+# =========================
+# Joint Threshold Grid
+# =========================
+GRID_PATH = "threshold_grid.npz"
+GRID_TYPES = {"Volume": "volume", "Billed Wt": "billed_wt"}
+
+
+def threshold_grid_path(method=DEFAULT_KNEE_METHOD, target_pct=TARGET_CUMULATIVE_PCT):
+    """Grid file of a knee method: GRID_PATH for the default, threshold_grid_<method>.npz otherwise"""
+    if method == DEFAULT_KNEE_METHOD:
+        return GRID_PATH
+    suffix = f"target{target_pct:g}" if method == "target" else method
+    root, ext = os.path.splitext(GRID_PATH)
+    return f"{root}_{suffix}{ext}"
+
+
+@perf.timed
+def build_threshold_grid(df_merge, volume_thresholds=SWEEP_THRESHOLDS,
+                         billed_wt_thresholds=SWEEP_THRESHOLDS, sweep=None, des_path="des_mappings.json",
+                         method=DEFAULT_KNEE_METHOD, target_pct=TARGET_CUMULATIVE_PCT):
+    """
+    Sorting_Location_Needed and % through optimal per region over a Volume x Billed Wt grid.
+
+    Each type's metrics depend only on its own threshold, so both are read off
+    one ThresholdSweep along their axis and broadcast over the grid; the
+    combined sorting requirement is their sum. Arrays are (region, volume, billed_wt),
+    with "All India" as the last region. NaN marks a region with no optimal
+    branches at that threshold (it has no build_final_sorting row). Optimal
+    branches come from the given knee method.
+    """
+    axes = {"Volume": np.asarray(volume_thresholds), "Billed Wt": np.asarray(billed_wt_thresholds)}
+    if (sweep is None or not all(np.isin(a, sweep.thresholds).all() for a in axes.values())
+            or (method == "target" and sweep.target_pct != target_pct)):
+        sweep = ThresholdSweep(df_merge, np.union1d(*axes.values()), target_pct)
+    optimal_counts, optimal_cumulative = sweep.knee_tables(method)
+    column = {t: i for i, t in enumerate(sweep.thresholds.tolist())}
+
+    regions = sorted(df_merge["Region"].unique())
+    region_pos = sweep.groups["Region"].map({r: i for i, r in enumerate(regions)}).to_numpy()
+    self_branches = (
+        load_region_branch_counts(des_path).set_index("Region")["Self_Branches"].reindex(regions).to_numpy(dtype=float)
+    )
+    group_total = group_totals(df_merge).reindex(pd.MultiIndex.from_frame(sweep.groups)).fillna(0).to_numpy()
+
+    grid = {
+        "regions": np.array(regions + ["All India"]),
+        "method": np.array(method),
+        "target_pct": np.array(float(target_pct)),
+        "volume_thresholds": axes["Volume"],
+        "billed_wt_thresholds": axes["Billed Wt"],
+    }
+    shape = (len(grid["regions"]), len(axes["Volume"]), len(axes["Billed Wt"]))
+    sorting_total = np.zeros(shape)
+    for type_name, suffix in GRID_TYPES.items():
+        cols = [column[t] for t in axes[type_name].tolist()]
+        in_type = (sweep.groups["Type"] == type_name).to_numpy()
+
+        # (region x threshold) sums of this type's rows of a per-group table, plus an All India row
+        def by_region(table):
+            out = np.zeros((len(regions), len(cols)))
+            np.add.at(out, region_pos[in_type], table[in_type][:, cols])
+            return out
+
+        optimal_count = by_region(optimal_counts)
+        has_optimal = by_region((optimal_counts > 0).astype(float)) > 0
+        sorting = np.where(has_optimal, optimal_count + 60 + 2 * self_branches[:, None], np.nan)
+        sorting = np.vstack((sorting, np.nansum(sorting, axis=0)))
+
+        units = by_region(np.repeat(group_total[:, None], len(sweep.thresholds), axis=1))
+        optimal_units = by_region(group_total[:, None] * optimal_cumulative / 100)
+        units = np.vstack((units, units.sum(axis=0)))
+        optimal_units = np.vstack((optimal_units, optimal_units.sum(axis=0)))
+        pct = np.where(units > 0, optimal_units / np.where(units > 0, units, 1) * 100, 0.0)
+
+        # Broadcast this type's threshold axis over the other one
+        expand = (slice(None), slice(None), None) if type_name == "Volume" else (slice(None), None, slice(None))
+        grid[f"sorting_location_needed_{suffix}"] = np.broadcast_to(sorting[expand], shape)
+        grid[f"pct_through_optimal_{suffix}"] = np.broadcast_to(pct[expand], shape)
+        sorting_total = sorting_total + sorting[expand]
+    grid["sorting_location_needed"] = sorting_total
+    return grid
+
+
+def save_threshold_grid(grid, path=GRID_PATH, source=None):
+    """
+    Write a threshold grid as compressed float32 arrays.
+
+    source (the sha1 of the all_data.csv it was built from) is stored alongside,
+    so readers can tell a stale grid. The file is written under a temporary name
+    and swapped in, so a reader never sees it half-written.
+    """
+    arrays = {k: (np.asarray(v).astype(np.float32) if np.asarray(v).dtype.kind == "f" else v) for k, v in grid.items()}
+    if source is not None:
+        arrays["source"] = np.array(source)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_threshold_grid(path=GRID_PATH):
+    """Read a grid written by save_threshold_grid"""
+    with np.load(path, allow_pickle=False) as f:
+        return {k: f[k] for k in f.files}
 
 
 # =========================
 # Final Sorting Locations
 # =========================
-def build_final_sorting(df_optimal):
-    with open("des_mappings.json", "r") as f:
+def load_region_branch_counts(des_path="des_mappings.json"):
+    """Self_Branches per destination region, from des_mappings.json"""
+    with open(des_path, "r") as f:
         mapping = json.load(f)
 
     rows = []
@@ -136,7 +1047,12 @@ def build_final_sorting(df_optimal):
                     })
     df_mapping = pd.DataFrame(rows)
 
-    df_region_counts = df_mapping.groupby("Region").size().reset_index(name="Self_Branches")
+    return df_mapping.groupby("Region").size().reset_index(name="Self_Branches")
+
+
+@perf.timed
+def build_final_sorting(df_optimal, des_path="des_mappings.json"):
+    df_region_counts = load_region_branch_counts(des_path)
 
     df_sum_opt = df_optimal.groupby(["Region", "Type"])["Optimal_Num_Branches"].sum().reset_index()
     df_sum_opt = df_sum_opt.rename(columns={"Optimal_Num_Branches": "Sorting_Locations_for_Optimal_Branches"})
@@ -148,6 +1064,396 @@ def build_final_sorting(df_optimal):
     return df_fd
 
 
+# =========================
+# Region Flow Engine
+# =========================
+# Destination region of a branch, keyed by the first letter of its code
+BRANCH_PREFIX_REGION = {
+    'A': 'AMD', 'B': 'BLR', 'C': 'CHE', 'E': 'CJB', 'H': 'HYD',
+    'I': 'IDR', 'J': 'HHPT', 'K': 'CCU', 'M': 'MUM', 'N': 'DDL',
+    'O': 'COK', 'P': 'PNQ', 'Q': 'JAI', 'R': 'NGP', 'T': 'PAT',
+    'U': 'UPT', 'V': 'VJA', 'W': 'BBI', 'X': 'GAU'
+}
+FLOW_ID_COLUMNS = ["Region", "Type", "Service_Type", "Total"]
+
+
+def _flow_inputs(df_abs, type_name):
+    """Branch values of one type plus the index maps every flow computation shares"""
+    regions = df_abs["Region"].unique()
+    region_index = pd.Index(regions)
+    rows = df_abs[df_abs["Type"] == type_name]
+    branch_cols = [col for col in df_abs.columns if col not in FLOW_ID_COLUMNS]
+    service_types = rows["Service_Type"].unique()
+
+    # Destination region of every branch column; unknown prefixes map to -1
+    dest = region_index.get_indexer([BRANCH_PREFIX_REGION.get(str(b)[:1]) for b in branch_cols])
+    return {
+        "regions": regions,
+        "service_types": service_types,
+        "branch_cols": branch_cols,
+        "keys": list(zip(rows["Region"], rows["Service_Type"])),
+        "dest": dest,
+        "service": pd.Index(service_types).get_indexer(rows["Service_Type"]),
+        "origin": region_index.get_indexer(rows["Region"]),
+        "values": np.nan_to_num(rows[branch_cols].to_numpy(dtype=float)),
+    }
+
+
+def _optimal_sets(optimal, type_name):
+    """BranchSets of one type's optimal branches, from BranchSets or an optimal_branches frame"""
+    if not isinstance(optimal, BranchSets):
+        optimal = BranchSets.from_strings(optimal[["Region", "Service_Type", "Type"]], optimal["Branches"])
+    of_type = (optimal.keys["Type"] == type_name).to_numpy()
+    return BranchSets(optimal.keys[of_type], optimal.branches, optimal.mask[of_type])
+
+
+def _optimal_membership(inputs, optimal, type_name):
+    """Boolean (row x branch) mask of cells whose branch is optimal for the row's group"""
+    sets = _optimal_sets(optimal, type_name)
+    rows = sets.rows(pd.DataFrame(inputs["keys"], columns=["Region", "Service_Type"]))
+    cols = sets.branch_index.get_indexer(inputs["branch_cols"])
+    return np.pad(sets.mask, ((0, 1), (0, 1)))[np.ix_(rows, cols)]
+
+
+def _flow_products(inputs, member):
+    """Total, optimal and non-optimal (service type x origin x destination) tensors from a few matrix products"""
+    values, dest = inputs["values"], inputs["dest"]
+    n_regions, n_rows = len(inputs["regions"]), len(values)
+
+    # Branch -> destination region indicator
+    to_region = np.zeros((len(dest), n_regions))
+    to_region[np.flatnonzero(dest >= 0), dest[dest >= 0]] = 1.0
+    sent = values @ to_region
+    sent_optimal = np.where(member, values, 0.0) @ to_region
+    sent_non_optimal = np.where(member, 0.0, values) @ to_region
+
+    # Fold rows into their (service type, origin region) cell
+    shape = (len(inputs["service_types"]), n_regions, n_regions)
+    fold = np.zeros((shape[0] * n_regions, n_rows))
+    fold[inputs["service"] * n_regions + inputs["origin"], np.arange(n_rows)] = 1.0
+    return {
+        "regions": inputs["regions"],
+        "service_types": inputs["service_types"],
+        "flow": (fold @ sent).reshape(shape),
+        "optimal": (fold @ sent_optimal).reshape(shape),
+        "non_optimal": (fold @ sent_non_optimal).reshape(shape),
+    }
+
+
+def build_flow_tensor(df_abs, df_optimal, type_name):
+    """Sum one type's branch flows into (service type, origin region, destination region) tensors"""
+    inputs = _flow_inputs(df_abs, type_name)
+    return _flow_products(inputs, _optimal_membership(inputs, df_optimal, type_name))
+
+
+def _flow_pct(part, total):
+    safe = np.where(total > 0, total, 1.0)
+    return np.where(total > 0, np.round(part / safe * 100, 2), 0.0)
+
+
+def flow_tables(tensor, service_type=None):
+    """Origin x destination flow and per-region receiving tables, for one service type or all combined"""
+    regions = tensor["regions"]
+    selected = [i for i, s in enumerate(tensor["service_types"]) if service_type is None or s == service_type]
+    flow, optimal, non_optimal = (tensor[k][selected].sum(axis=0) for k in ("flow", "optimal", "non_optimal"))
+
+    # Receiving is the destination-side total of the same flows
+    received, optimal_received, non_optimal_received = flow.sum(axis=0), optimal.sum(axis=0), non_optimal.sum(axis=0)
+
+    matrices = {
+        "flow": flow,
+        "optimal": optimal,
+        "non_optimal": non_optimal,
+        "optimal_pct": _flow_pct(optimal, flow),
+        "non_optimal_pct": _flow_pct(non_optimal, flow),
+    }
+    series = {
+        "receiving": received,
+        "optimal_receiving": optimal_received,
+        "non_optimal_receiving": non_optimal_received,
+        "optimal_receiving_pct": _flow_pct(optimal_received, received),
+        "non_optimal_receiving_pct": _flow_pct(non_optimal_received, received),
+    }
+    tables = {k: pd.DataFrame(v, index=regions, columns=regions) for k, v in matrices.items()}
+    tables.update({k: pd.Series(v, index=regions) for k, v in series.items()})
+    return tables
+
+
+class FlowAnalysis:
+    """
+    Flow tensors for one type that follow edits to the optimal branch set.
+
+    Adding or removing a (group, branch) membership moves that branch's value
+    between the optimal and non-optimal tensors of its row's cell, so apply()
+    costs time proportional to the number of changed memberships rather than a
+    full rebuild: only the edited cells are read and written. update() moves to
+    a whole new optimal set with one mask comparison instead. verify() compares
+    the running tensors with a rebuild.
+    """
+
+    # Deltas larger than this are cheaper to apply as a full rebuild
+    rebuild_above = 1000
+
+    @perf.timed
+    def __init__(self, df_abs, optimal, type_name):
+        self.type_name = type_name
+        self._inputs = _flow_inputs(df_abs, type_name)
+        self._col = {b: c for c, b in enumerate(self._inputs["branch_cols"])}
+        self._rows = {}
+        for r, key in enumerate(self._inputs["keys"]):
+            self._rows.setdefault(key, []).append(r)
+
+        self.member = _optimal_membership(self._inputs, optimal, type_name)
+        self.tensor = _flow_products(self._inputs, self.member)
+
+    def _apply_cells(self, r, c, state):
+        """Set member[r, c] = state for cells that currently differ, moving their values between tensors"""
+        if len(r) > self.rebuild_above:
+            self.member[r, c] = state
+            self.tensor = _flow_products(self._inputs, self.member)
+            return len(r)
+
+        dest = self._inputs["dest"][c]
+        known = dest >= 0
+        cell = (self._inputs["service"][r[known]], self._inputs["origin"][r[known]], dest[known])
+        delta = np.where(state, 1.0, -1.0)[known] * self._inputs["values"][r[known], c[known]]
+        np.add.at(self.tensor["optimal"], cell, delta)
+        np.add.at(self.tensor["non_optimal"], cell, -delta)
+        self.member[r, c] = state
+        return len(r)
+
+    @perf.timed
+    def apply(self, added=(), removed=()):
+        """
+        Apply (Region, Service_Type, Branch) memberships entering and leaving the
+        optimal set (e.g. BranchSets.difference(...).members() of this type).
+        Returns the number of cells that changed.
+        """
+        rows, cols, states = [], [], []
+        for state, edits in ((True, added), (False, removed)):
+            for region, stype, branch in edits:
+                c = self._col.get(branch)
+                r = self._rows.get((region, stype), ())
+                if c is not None and r:
+                    rows.extend(r)
+                    cols.extend([c] * len(r))
+                    states.extend([state] * len(r))
+        if not rows:
+            return 0
+
+        r, c, state = np.array(rows), np.array(cols), np.array(states, dtype=bool)
+        # The last edit of a cell wins, and edits restating the current membership are dropped
+        _, last = np.unique((r * len(self._col) + c)[::-1], return_index=True)
+        keep = len(r) - 1 - last
+        r, c, state = r[keep], c[keep], state[keep]
+        changed = self.member[r, c] != state
+        return self._apply_cells(r[changed], c[changed], state[changed])
+
+    @perf.timed
+    def update(self, optimal):
+        """Move to the optimal set of an optimal_branches frame or BranchSets (compares the whole mask)"""
+        member = _optimal_membership(self._inputs, optimal, self.type_name)
+        r, c = np.nonzero(member != self.member)
+        return self._apply_cells(r, c, member[r, c])
+
+    def tables(self, service_type=None):
+        """flow_tables of the current tensors"""
+        return flow_tables(self.tensor, service_type)
+
+    def verify(self, atol=1e-6):
+        """True when the running tensors match a full rebuild from the current memberships"""
+        rebuilt = _flow_products(self._inputs, self.member)
+        return all(
+            np.allclose(self.tensor[k], rebuilt[k], atol=atol) for k in ("flow", "optimal", "non_optimal")
+        )
+
+
+@perf.timed
+def build_flow_analysis(df_abs, df_optimal):
+    """
+    Rows of region_to_region_flow_analysis.csv and region_receiving_analysis.csv for every type.
+
+    df_abs may also be a to_sparse_table result.
+    """
+    sparse = isinstance(df_abs, dict)
+    build = build_sparse_flow_tensor if sparse else build_flow_tensor
+    flow_frames, receiving_frames = [], []
+    for type_name in (df_abs["ids"] if sparse else df_abs)["Type"].unique():
+        t = flow_tables(build(df_abs, df_optimal, type_name))
+        regions = t["receiving"].index
+        flow_frames.append(pd.DataFrame({
+            "Type": type_name,
+            "Origin_Region": np.repeat(regions, len(regions)),
+            "Destination_Region": np.tile(regions, len(regions)),
+            "Total_Flow_Units": t["flow"].to_numpy().ravel(),
+            "Optimal_Flow_Units": t["optimal"].to_numpy().ravel(),
+            "Non_Optimal_Flow_Units": t["non_optimal"].to_numpy().ravel(),
+            "Optimal_Flow_Percentage": t["optimal_pct"].to_numpy().ravel(),
+            "Non_Optimal_Flow_Percentage": t["non_optimal_pct"].to_numpy().ravel(),
+        }))
+        receiving_frames.append(pd.DataFrame({
+            "Type": type_name,
+            "Region": regions,
+            "Total_Units_Received": t["receiving"].to_numpy(),
+            "Optimal_Units_Received": t["optimal_receiving"].to_numpy(),
+            "Non_Optimal_Units_Received": t["non_optimal_receiving"].to_numpy(),
+            "Optimal_Percentage": t["optimal_receiving_pct"].to_numpy(),
+            "Non_Optimal_Percentage": t["non_optimal_receiving_pct"].to_numpy(),
+        }))
+    return pd.concat(flow_frames, ignore_index=True), pd.concat(receiving_frames, ignore_index=True)
+
+
+# =========================
+# Sparse Wide Tables
+# =========================
+BAG_KEYS = ["Region", "Service_Type", "Type"]
+
+
+def to_sparse_table(df_abs, df_pct=None):
+    """
+    CSR copy of the all_data.csv branch block, with the matching percentages.
+
+    Only cells whose value or percentage is nonzero are stored; the id columns
+    stay a small dense frame. Percentages are aligned to all_data.csv rows on
+    (Region, Type, Service_Type), and branches or rows missing from df_pct are
+    flagged so they drop out of the bag summary as in load_data's inner merge.
+    """
+    branches = [c for c in df_abs.columns if c not in FLOW_ID_COLUMNS]
+    values = df_abs[branches].to_numpy(dtype=float)
+    table = {
+        "ids": df_abs[[c for c in df_abs.columns if c in FLOW_ID_COLUMNS]].reset_index(drop=True),
+        "branches": np.array(branches, dtype=object),
+        "columns": list(df_abs.columns),
+        "pct_columns": None,
+    }
+    nonzero = values != 0
+    if df_pct is not None:
+        pct_keys = ["Region", "Type", "Service_Type"]
+        pct = df_pct.set_index(pct_keys).reindex(pd.MultiIndex.from_frame(df_abs[pct_keys]))
+        pct = pct.reindex(columns=branches).to_numpy(dtype=float)
+        table["pct_columns"] = list(df_pct.columns)
+        table["pct_branches"] = np.isin(branches, df_pct.columns)
+        table["pct_rows"] = pd.MultiIndex.from_frame(df_abs[pct_keys]).isin(
+            pd.MultiIndex.from_frame(df_pct[pct_keys])
+        )
+        nonzero |= pct != 0
+        table["percentages"] = pct[nonzero]
+    table["values"] = to_csr(values, nonzero)
+    return table
+
+
+def _table_block(table, rows, key="values"):
+    """Dense (rows x branch) block of the stored values or percentages for the given rows"""
+    csr = table["values"]
+    data = csr["data"] if key == "values" else table["percentages"]
+    position = np.full(csr["shape"][0], -1)
+    position[rows] = np.arange(len(rows))
+    entry_row = position[csr_rows(csr)]
+    stored = entry_row >= 0
+    block = np.zeros((len(rows), csr["shape"][1]))
+    block[entry_row[stored], csr["indices"][stored]] = data[stored]
+    return block
+
+
+def from_sparse_table(table):
+    """(df_abs, df_pct) in the all_data.csv / all_data_percentage.csv layouts"""
+    rows = np.arange(table["values"]["shape"][0])
+    branches = list(table["branches"])
+    df_abs = pd.concat(
+        [table["ids"], pd.DataFrame(_table_block(table, rows), columns=branches)], axis=1
+    )[table["columns"]]
+    if table["pct_columns"] is None:
+        return df_abs, None
+
+    pct_rows = rows[table["pct_rows"]]
+    df_pct = pd.concat([
+        table["ids"].loc[pct_rows, ["Region", "Type", "Service_Type"]].reset_index(drop=True),
+        pd.DataFrame(_table_block(table, pct_rows, "percentages"), columns=branches),
+    ], axis=1)
+    return df_abs, df_pct[table["pct_columns"]]
+
+
+@perf.timed
+def build_sparse_bag_summary(table, thresholds):
+    """
+    build_bag_summary(df_merge, thresholds) from a sparse table with percentages.
+
+    A cell that is not stored has value 0, so it only passes a threshold <= 0;
+    rows with such a threshold are expanded to dense, every other row only
+    scans its stored cells.
+    """
+    ids = table["ids"]
+    csr = table["values"]
+    n_cols = csr["shape"][1]
+    usable = table["pct_rows"]
+    gid = np.full(len(ids), -1)
+    grouped = ids[usable].groupby(BAG_KEYS)
+    gid[usable] = grouped.ngroup().to_numpy()
+    groups = grouped.size().index.to_frame(index=False)
+    thresh = ids["Type"].map(lambda t: thresholds.get(t, 0)).to_numpy(dtype=float)
+
+    row, col = csr_rows(csr), csr["indices"]
+    value, pct = csr["data"], table["percentages"]
+    dense_rows = np.flatnonzero(usable & (thresh <= 0))
+    if len(dense_rows):
+        sparse_entry = ~np.isin(row, dense_rows)
+        row = np.concatenate((row[sparse_entry], np.repeat(dense_rows, n_cols)))
+        col = np.concatenate((col[sparse_entry], np.tile(np.arange(n_cols), len(dense_rows))))
+        value = np.concatenate((value[sparse_entry], _table_block(table, dense_rows).ravel()))
+        pct = np.concatenate((pct[sparse_entry], _table_block(table, dense_rows, "percentages").ravel()))
+
+    candidate = (gid[row] >= 0) & table["pct_branches"][col] & (value >= thresh[row])
+    row, col, pct = row[candidate], col[candidate], pct[candidate]
+    # df_merge lists a group's cells branch by branch (melt order)
+    order = np.lexsort((row, col, gid[row]))
+    entry_gid, col, pct = gid[row][order], col[order], pct[order]
+
+    df_bag = groups[BAG_KEYS].copy()
+    df_bag["Num_Branches"] = np.bincount(entry_gid, minlength=len(groups))
+    df_bag["Cumulative_Percentage"] = np.bincount(entry_gid, weights=np.nan_to_num(pct), minlength=len(groups))
+    branch_lists = pd.Series(table["branches"][col]).groupby(entry_gid).agg(", ".join)
+    df_bag["Branches"] = branch_lists.reindex(np.arange(len(groups)), fill_value="").to_numpy()
+    return df_bag
+
+
+def build_sparse_flow_tensor(table, df_optimal, type_name):
+    """build_flow_tensor from a sparse table, scattering only the stored cells"""
+    ids = table["ids"]
+    csr = table["values"]
+    regions = ids["Region"].unique()
+    region_index = pd.Index(regions)
+    of_type = (ids["Type"] == type_name).to_numpy()
+    service_types = ids.loc[of_type, "Service_Type"].unique()
+    dest = region_index.get_indexer([BRANCH_PREFIX_REGION.get(str(b)[:1]) for b in table["branches"]])
+    service = pd.Index(service_types).get_indexer(ids["Service_Type"])
+    origin = region_index.get_indexer(ids["Region"])
+
+    # Optimal membership of every stored cell, through its row's set and its branch's ID
+    sets = _optimal_sets(df_optimal, type_name)
+    set_row = sets.rows(ids[["Region", "Service_Type"]])
+    set_col = sets.branch_index.get_indexer(table["branches"])
+    padded = np.pad(sets.mask, ((0, 1), (0, 1)))
+
+    row, col = csr_rows(csr), csr["indices"]
+    keep = of_type[row] & (dest[col] >= 0)
+    row, col, value = row[keep], col[keep], np.nan_to_num(csr["data"][keep])
+    member = padded[set_row[row], set_col[col]]
+
+    n_regions = len(regions)
+    shape = (len(service_types), n_regions, n_regions)
+    cell = (service[row] * n_regions + origin[row]) * n_regions + dest[col]
+    size = shape[0] * n_regions * n_regions
+    flow = np.bincount(cell, weights=value, minlength=size)
+    optimal = np.bincount(cell[member], weights=value[member], minlength=size)
+    return {
+        "regions": regions,
+        "service_types": service_types,
+        "flow": flow.reshape(shape),
+        "optimal": optimal.reshape(shape),
+        "non_optimal": (flow - optimal).reshape(shape),
+    }
+
+
 # =========================
 # Flow Analysis Functions
 # =========================
@@ -0,0 +1,129 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import processing
+from algorithms import COL_LEVELS, ROW_LEVELS, read_matrix_csv
+
+# Real service types first, then numbered extras
+SERVICE_TYPES = ["Air Red", "Air White", "Ground"]
+ZONES = ["North", "South", "East", "West"]
+TYPES = ["Volume", "Billed Wt"]
+
+
+# =========================
+# Synthetic OD Matrix
+# =========================
+def synthetic_matrix(n_regions=19, n_branches=380, n_service_types=3, density=0.05, seed=0):
+    """
+    A code-keyed OD matrix shaped like an ingested data.csv, with branch names.
+
+    Regions are the real region codes (processing.BRANCH_PREFIX_REGION), so
+    branch code prefixes keep mapping to their region the way the flow analysis
+    and all_data.csv expect; that caps n_regions at 19. Branches are spread
+    round-robin over the regions, with one city per five branches and one
+    product per service type. density is the share of non-zero cells; values
+    are heavy-tailed per-day units, with Billed Wt a noisy multiple of Volume.
+    Returns (frame, origin names, destination names) as ingest._read_ingested does.
+    """
+    prefixes = sorted(processing.BRANCH_PREFIX_REGION.items(), key=lambda item: item[1])
+    if not 1 <= n_regions <= len(prefixes):
+        raise ValueError(f"n_regions must be between 1 and {len(prefixes)} (one code prefix per region)")
+    if n_branches < n_regions:
+        raise ValueError("Need at least one branch per region")
+    rng = np.random.default_rng(seed)
+
+    branches = []
+    per_region = -(-n_branches // n_regions)
+    width = max(2, len(str(per_region - 1)))
+    for k in range(n_branches):
+        r = k % n_regions
+        prefix, region = prefixes[r]
+        number = k // n_regions
+        branches.append((ZONES[r % len(ZONES)], region, f"{region} CITY {number // 5}", f"{prefix}{number:0{width}d}"))
+    names = {code: f"{city} BRANCH {code}" for _, _, city, code in branches}
+
+    service_types = SERVICE_TYPES[:n_service_types] + [
+        f"Service {k}" for k in range(len(SERVICE_TYPES), n_service_types)
+    ]
+    rows = pd.MultiIndex.from_tuples(
+        [b + (s, f"P{j}") for b in branches for j, s in enumerate(service_types)], names=ingest.ROW_KEYS
+    )
+    cols = pd.MultiIndex.from_tuples([(t,) + b for t in TYPES for b in branches], names=ingest.COL_KEYS)
+
+    shape = (len(rows), n_branches)
+    volume = np.where(rng.random(shape) < density, np.round(rng.pareto(1.2, shape) * 5, 3), 0.0)
+    billed = np.round(volume * rng.lognormal(1.0, 0.5, shape), 3)
+    return pd.DataFrame(np.hstack([volume, billed]), index=rows, columns=cols), names, names
+
+
+def synthetic_store(n_rows, n_cols, density, rng):
+    """
+    An OD matrix store (algorithms.load_matrix_store layout) of random heavy-tailed
+    values, with density the share of non-zero cells and the row and column
+    levels cut into evenly sized blocks. rng is a numpy Generator.
+    """
+    values = np.where(rng.random((n_rows, n_cols)) < density, rng.pareto(1.5, (n_rows, n_cols)), 0.0)
+    row_codes = np.column_stack([
+        np.arange(n_rows) // 600, np.arange(n_rows) // 200, np.arange(n_rows) // 40,
+        np.arange(n_rows) // 3, np.arange(n_rows) % 3, np.arange(n_rows) % 3,
+    ]).astype(np.int32)
+    col_codes = np.column_stack([
+        np.arange(n_cols) % 2, np.arange(n_cols) // 800, np.arange(n_cols) // 200,
+        np.arange(n_cols) // 40, np.arange(n_cols) // 2,
+    ]).astype(np.int32)
+    store = {
+        "values": values,
+        "row_codes": row_codes,
+        "col_codes": col_codes,
+        "row_dims": {lvl: [f"{lvl}{i}" for i in range(row_codes[:, k].max() + 1)]
+                     for k, lvl in enumerate(ROW_LEVELS)},
+        "col_dims": {lvl: [f"{lvl}{i}" for i in range(col_codes[:, k].max() + 1)]
+                     for k, lvl in enumerate(COL_LEVELS)},
+    }
+    store["row_lookup"] = {lvl: {v: i for i, v in enumerate(c)} for lvl, c in store["row_dims"].items()}
+    store["col_lookup"] = {lvl: {v: i for i, v in enumerate(c)} for lvl, c in store["col_dims"].items()}
+    return store
+
+
+def write_synthetic_data(out_dir, n_regions=19, n_branches=380, n_service_types=3, density=0.05, seed=0):
+    """
+    Write data.csv, org_mappings.json, des_mappings.json and all_data.csv for a
+    synthetic matrix into out_dir, in the same layouts as the real pipeline.
+    Returns the paths plus the matrix shape.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "data": os.path.join(out_dir, "data.csv"),
+        "org_mappings": os.path.join(out_dir, "org_mappings.json"),
+        "des_mappings": os.path.join(out_dir, "des_mappings.json"),
+        "all_data": os.path.join(out_dir, "all_data.csv"),
+    }
+    df, org_names, des_names = synthetic_matrix(n_regions, n_branches, n_service_types, density, seed)
+    origins = ingest._write_matrix(df, org_names, des_names, paths["data"])
+    ingest._write_mappings(paths["data"], origins, paths["org_mappings"], paths["des_mappings"])
+    processing.build_all_data(read_matrix_csv(paths["data"])).to_csv(paths["all_data"], index=False)
+    return {**paths, "rows": df.shape[0], "columns": df.shape[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic data.csv/all_data.csv-shaped inputs")
+    parser.add_argument("out_dir")
+    parser.add_argument("--regions", type=int, default=19)
+    parser.add_argument("--branches", type=int, default=380)
+    parser.add_argument("--service-types", type=int, default=3)
+    parser.add_argument("--density", type=float, default=0.05, help="Share of non-zero OD cells")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = write_synthetic_data(
+        args.out_dir, args.regions, args.branches, args.service_types, args.density, args.seed
+    )
+    print(f"{result['rows']:,} origin rows x {result['columns']:,} columns written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import processing  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def repo_file(name):
+    return os.path.join(REPO_DIR, name)
+
+
+@pytest.fixture(scope="session")
+def shipped_long():
+    """Long table of the shipped all_data.csv"""
+    path = repo_file("all_data.csv")
+    if not os.path.exists(path):
+        pytest.skip("all_data.csv is not present")
+    return processing.load_long_table(path)
+
+
+@pytest.fixture(scope="session")
+def synthetic_files(tmp_path_factory):
+    """data.csv, mapping JSONs and all_data.csv of a small synthetic network (no shipped data needed)"""
+    return synthetic.write_synthetic_data(str(tmp_path_factory.mktemp("synthetic")), 10, 190, 3, density=0.1)
+
+
+@pytest.fixture(scope="session")
+def synthetic_long(synthetic_files):
+    return processing.load_long_table(synthetic_files["all_data"])
+
+
+@pytest.fixture(scope="session", params=["shipped", "synthetic"])
+def long_table(request):
+    """Every test using this runs on the shipped all_data.csv and on the synthetic one"""
+    return request.getfixturevalue(f"{request.param}_long")
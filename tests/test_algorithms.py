@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import algorithms
+import synthetic
+
+
+@pytest.fixture(scope="module")
+def stores():
+    dense = synthetic.synthetic_store(3000, 2000, 0.02, np.random.default_rng(0))
+    sparse = {k: v for k, v in dense.items() if k != "values"}
+    sparse["csr"] = algorithms.to_csr(dense["values"])
+    return dense, sparse
+
+
+def test_csr_round_trip(stores):
+    dense, sparse = stores
+    np.testing.assert_array_equal(algorithms.csr_to_dense(sparse["csr"]), dense["values"])
+
+
+def test_store_flows_match_masked_sums(stores):
+    dense, sparse = stores
+    origin = dense["row_dims"]["org_region"][1]
+    type_ = dense["col_dims"]["type"][0]
+    flows = algorithms.store_flows(dense, "org_branch_code", "des_region", 25, org_region=origin, type_=type_)
+    assert len(flows) == 25
+
+    row_names = np.asarray(dense["row_dims"]["org_branch_code"])[dense["row_codes"][:, 3]]
+    col_names = np.asarray(dense["col_dims"]["des_region"])[dense["col_codes"][:, 2]]
+    rows = dense["row_codes"][:, 1] == dense["row_lookup"]["org_region"][origin]
+    cols = dense["col_codes"][:, 0] == dense["col_lookup"]["type"][type_]
+    for org, des, total in flows.itertuples(index=False):
+        expected = dense["values"][rows & (row_names == org)][:, cols & (col_names == des)].sum()
+        assert np.isclose(round(expected, 3), total)
+
+    sparse_flows = algorithms.store_flows(sparse, "org_branch_code", "des_region", 25, org_region=origin, type_=type_)
+    assert flows.equals(sparse_flows)
+
+
+def test_sparse_cube_matches_dense(stores):
+    dense, sparse = stores
+    np.testing.assert_allclose(algorithms.build_rollup_cube(dense)["prefix"], algorithms.build_rollup_cube(sparse)["prefix"])
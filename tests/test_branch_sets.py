@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import processing
+from conftest import repo_file
+
+KEYS = ["Region", "Service_Type", "Type"]
+
+
+def percentage_matrix(df_pct_long, keys, branches):
+    pct = df_pct_long.pivot_table(index=KEYS, columns="Branch", values="Percentage", aggfunc="last", observed=True)
+    return pct.reindex(pd.MultiIndex.from_frame(keys[KEYS]), columns=branches).fillna(0).to_numpy()
+
+
+def assert_same_lists(df, sets, pct):
+    """Lists run by descending percentage; branches tied on percentage may be listed in either order"""
+    lookup = pd.Index(sets.branches)
+    for row, (expected, actual) in enumerate(zip(df["Branches"].fillna(""), sets.to_strings())):
+        expected, actual = expected.split(", "), actual.split(", ")
+        assert sorted(expected) == sorted(actual)
+        assert np.array_equal(pct[row, lookup.get_indexer(expected)], pct[row, lookup.get_indexer(actual)])
+
+
+@pytest.fixture(scope="module")
+def built(long_table):
+    df_pct_long = long_table[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    bag = processing.build_bag_summary(long_table, {"Volume": 25, "Billed Wt": 35})
+    return df_pct_long, bag, processing.build_optimal_branches(bag, df_pct_long)
+
+
+def test_bag_strings_round_trip(built):
+    df_pct_long, bag, _ = built
+    branches = pd.unique(df_pct_long["Branch"])
+    sets = processing.BranchSets.from_strings(bag[KEYS], bag["Branches"], branches)
+    assert sets.to_strings().tolist() == bag["Branches"].fillna("").tolist()
+    assert sets.counts().tolist() == bag["Num_Branches"].tolist()
+
+
+def test_optimal_strings_round_trip(built):
+    df_pct_long, _, optimal = built
+    branches = pd.unique(df_pct_long["Branch"])
+    pct = percentage_matrix(df_pct_long, optimal, branches)
+    assert_same_lists(optimal, processing.BranchSets.from_strings(optimal[KEYS], optimal["Branches"], branches, pct), pct)
+
+
+def test_shipped_strings_round_trip(shipped_long):
+    df_pct_long = shipped_long[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    branches = pd.unique(df_pct_long["Branch"])
+
+    bag = pd.read_csv(repo_file("bag_summary.csv"))
+    rendered = processing.BranchSets.from_strings(bag[KEYS], bag["Branches"], branches).to_strings()
+    assert rendered.tolist() == bag["Branches"].fillna("").tolist()
+
+    optimal = pd.read_csv(repo_file("optimal_branches.csv"))
+    pct = percentage_matrix(df_pct_long, optimal, branches)
+    assert_same_lists(optimal, processing.BranchSets.from_strings(optimal[KEYS], optimal["Branches"], branches, pct), pct)
+
+
+def test_set_operations(built):
+    df_pct_long, bag, optimal = built
+    branches = pd.unique(df_pct_long["Branch"])
+    bag_sets = processing.BranchSets.from_strings(bag[KEYS], bag["Branches"], branches)
+    optimal_sets = processing.BranchSets.from_strings(optimal[KEYS], optimal["Branches"], branches)
+
+    # Every optimal branch is a bag candidate, whatever the row order of either frame
+    assert not optimal_sets.difference(bag_sets).mask.any()
+    assert (bag_sets.union(optimal_sets).mask == bag_sets.mask).all()
+    assert bag_sets.intersection(optimal_sets).counts().sum() == optimal_sets.counts().sum()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import processing
+from conftest import repo_file
+
+STEPS = [(25, 35), (26, 35), (26, 40), (0, 0), (25, 35)]
+
+
+def assert_same_frame(actual, expected):
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for column in actual.columns:
+        if actual[column].dtype == object:
+            assert actual[column].tolist() == expected[column].tolist(), column
+        else:
+            np.testing.assert_allclose(actual[column], expected[column], err_msg=column)
+
+
+@pytest.fixture(scope="module")
+def flow_inputs(long_table):
+    """all_data.csv frame, sweep and optimal BranchSets of every STEPS threshold pair"""
+    sweep = processing.ThresholdSweep(long_table)
+    optimal = [sweep.branch_sets({"Volume": vol, "Billed Wt": wt})[1] for vol, wt in STEPS]
+    return processing.long_to_wide(long_table), sweep, optimal
+
+
+def test_matches_shipped_csvs(shipped_long):
+    df_flow, df_receiving = processing.build_flow_analysis(
+        pd.read_csv(repo_file("all_data.csv")), pd.read_csv(repo_file("optimal_branches.csv"))
+    )
+    assert_same_frame(df_flow, pd.read_csv(repo_file("region_to_region_flow_analysis.csv")))
+    assert_same_frame(df_receiving, pd.read_csv(repo_file("region_receiving_analysis.csv")))
+
+
+def test_sparse_matches_dense(long_table, flow_inputs):
+    df_abs, sweep, _ = flow_inputs
+    df_pct = processing.long_to_wide(long_table, "Percentage")
+    table = processing.to_sparse_table(df_abs, df_pct)
+    thresholds = {"Volume": 25, "Billed Wt": 35}
+
+    bag = processing.build_sparse_bag_summary(table, thresholds)
+    assert bag["Branches"].tolist() == processing.build_bag_summary(long_table, thresholds)["Branches"].tolist()
+
+    df_optimal = sweep.optimal_branches(thresholds)
+    for actual, expected in zip(processing.build_flow_analysis(table, df_optimal),
+                                processing.build_flow_analysis(df_abs, df_optimal)):
+        assert_same_frame(actual, expected)
+
+
+def test_apply_follows_rebuilds(flow_inputs):
+    df_abs, _, optimal = flow_inputs
+    for type_name in df_abs["Type"].unique():
+        def memberships(sets):
+            return [(r, s, b) for r, s, t, b in sets.members() if t == type_name]
+
+        analysis = processing.FlowAnalysis(df_abs, optimal[0], type_name)
+        for previous, sets in zip(optimal, optimal[1:]):
+            analysis.apply(memberships(sets.difference(previous)), memberships(previous.difference(sets)))
+            rebuilt = processing.build_flow_tensor(df_abs, sets, type_name)
+            for k in ("flow", "optimal", "non_optimal"):
+                np.testing.assert_allclose(analysis.tensor[k], rebuilt[k], atol=1e-6)
+            assert analysis.verify()
+
+
+def test_update_follows_rebuilds(flow_inputs):
+    df_abs, _, optimal = flow_inputs
+    for type_name in df_abs["Type"].unique():
+        analysis = processing.FlowAnalysis(df_abs, optimal[0], type_name)
+        for sets in optimal[1:]:
+            analysis.update(sets)
+            rebuilt = processing.build_flow_tensor(df_abs, sets, type_name)
+            for k in ("flow", "optimal", "non_optimal"):
+                np.testing.assert_allclose(analysis.tensor[k], rebuilt[k], atol=1e-6)
+
+
+def test_apply_counts_changed_cells(flow_inputs):
+    df_abs, _, optimal = flow_inputs
+    type_name = df_abs["Type"].iloc[0]
+    analysis = processing.FlowAnalysis(df_abs, optimal[0], type_name)
+    members = [(r, s, b) for r, s, t, b in optimal[0].members() if t == type_name]
+
+    # Restating the current memberships changes nothing, and a cell edited twice keeps the last edit (removals)
+    assert analysis.apply(members[:5]) == 0
+    removed = analysis.apply(members[:1], members[:1])
+    assert removed > 0
+    assert analysis.apply(removed=members[:1]) == 0
+    assert analysis.apply(added=members[:1]) == removed
+    assert analysis.verify()
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import processing
+from conftest import repo_file
+
+THRESHOLDS = [(0, 0), (5, 5), (10, 15), (25, 35), (40, 60), (60, 80), (100, 100)]
+KEYS = ["Region", "Service_Type", "Type"]
+
+
+# -------------------- bags.ipynb reference --------------------
+def reference_elbow(x, y):
+    """The pre-vectorization find_elbow, plus whether its argmax broke a floating-point tie"""
+    if len(x) < 2:
+        return 0, False
+    p1, p2 = np.array([x[0], y[0]]), np.array([x[-1], y[-1]])
+    norm = np.linalg.norm(p2 - p1)
+    line_vec = (p2 - p1) / norm
+    distances = []
+    for i in range(len(x)):
+        p = np.array([x[i], y[i]])
+        proj_len = np.dot(p - p1, line_vec)
+        proj_point = p1 + proj_len * line_vec
+        distances.append(np.linalg.norm(p - proj_point))
+    distances = np.array(distances)
+    tolerance = processing.ELBOW_TIE_TOLERANCE * norm
+    tied = distances.max() <= tolerance or (distances >= distances.max() - tolerance).sum() > 1
+    return int(np.argmax(distances)), tied
+
+
+def reference_optimal_branches(df_bag, df_pct_long):
+    """
+    The pre-vectorization build_optimal_branches. The only change is a stable
+    sort: the original quicksort left the order of equal percentages unspecified.
+    """
+    rows = []
+    for _, row in df_bag.iterrows():
+        branches_str = row["Branches"]
+        if not isinstance(branches_str, str) or not branches_str.strip():
+            continue
+        branches = [b.strip() for b in branches_str.split(",")]
+        subset = df_pct_long[
+            (df_pct_long["Region"] == row["Region"]) &
+            (df_pct_long["Service_Type"] == row["Service_Type"]) &
+            (df_pct_long["Type"] == row["Type"]) &
+            (df_pct_long["Branch"].isin(branches))
+        ].copy()
+        if subset.empty:
+            continue
+        subset = subset.sort_values("Percentage", ascending=False, kind="stable").reset_index(drop=True)
+        y = subset["Percentage"].cumsum().to_numpy()
+        elbow_idx, tied = reference_elbow(np.arange(1, len(subset) + 1), y)
+        rows.append({
+            "Region": row["Region"],
+            "Service_Type": row["Service_Type"],
+            "Type": row["Type"],
+            "Optimal_Num_Branches": elbow_idx + 1,
+            "Optimal_Cumulative_Percentage": y[elbow_idx],
+            "Branches": ", ".join(subset.loc[:elbow_idx, "Branch"]),
+            "Candidates": subset["Branch"].tolist(),
+            "Curve": y,
+            "Tied": tied,
+        })
+    return pd.DataFrame(rows)
+
+
+# -------------------- Equivalence --------------------
+@pytest.mark.parametrize("thresholds", THRESHOLDS, ids=lambda t: f"{t[0]}-{t[1]}")
+def test_matches_reference(long_table, thresholds):
+    df_pct_long = long_table[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    df_bag = processing.build_bag_summary(long_table, dict(zip(["Volume", "Billed Wt"], thresholds)))
+
+    actual = processing.build_optimal_branches(df_bag, df_pct_long)
+    expected = reference_optimal_branches(df_bag, df_pct_long)
+
+    assert actual[KEYS].astype(str).values.tolist() == expected[KEYS].astype(str).values.tolist()
+    untied = ~expected["Tied"].to_numpy()
+    assert untied.any()
+    assert actual["Optimal_Num_Branches"].to_numpy()[untied].tolist() == \
+        expected["Optimal_Num_Branches"].to_numpy()[untied].tolist()
+    assert actual["Branches"].to_numpy()[untied].tolist() == expected["Branches"].to_numpy()[untied].tolist()
+    np.testing.assert_allclose(
+        actual["Optimal_Cumulative_Percentage"].to_numpy()[untied],
+        expected["Optimal_Cumulative_Percentage"].to_numpy()[untied],
+    )
+
+    # Where the reference's argmax broke a tie by floating-point noise, the documented rule applies
+    for (_, act), (_, exp) in zip(actual[~untied].iterrows(), expected[~untied].iterrows()):
+        elbow = processing.find_elbow(np.arange(1, len(exp["Curve"]) + 1), exp["Curve"])
+        assert act["Optimal_Num_Branches"] == elbow + 1
+        assert act["Branches"] == ", ".join(exp["Candidates"][:elbow + 1])
+
+
+def test_matches_shipped_output(shipped_long):
+    """optimal_branches.csv was written by bags.ipynb from bag_summary.csv"""
+    df_pct_long = shipped_long[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    df_bag = pd.read_csv(repo_file("bag_summary.csv"))
+    shipped = pd.read_csv(repo_file("optimal_branches.csv"))
+    actual = processing.build_optimal_branches(df_bag, df_pct_long)
+    tied = reference_optimal_branches(df_bag, df_pct_long)[KEYS + ["Tied"]]
+
+    merged = actual.merge(shipped, on=KEYS, suffixes=("", "_shipped"), validate="one_to_one").merge(tied, on=KEYS)
+    assert len(merged) == len(shipped) == len(actual)
+    merged = merged[~merged["Tied"]]
+    assert (merged["Optimal_Num_Branches"] == merged["Optimal_Num_Branches_shipped"]).all()
+    # The notebook's quicksort ordered equal percentages arbitrarily, so compare memberships
+    assert [set(b.split(", ")) for b in merged["Branches"]] == \
+        [set(b.split(", ")) for b in merged["Branches_shipped"]]
+
+
+# -------------------- Tie rules --------------------
+def test_two_points_keep_both():
+    assert processing.find_elbow([1, 2], [60.0, 100.0]) == 1
+
+
+def test_equal_percentages_keep_every_branch():
+    y = np.cumsum([10.0] * 5)
+    assert processing.find_elbow(np.arange(1, 6), y) == 4
+    assert processing.find_elbows(np.vstack([y, y]), [5, 3]).tolist() == [4, 2]
+
+
+def test_interior_tie_takes_first_point():
+    # Points 2 and 3 lie on a segment parallel to the chord, so they are equally far from it
+    y = np.array([0.0, 10.0, 12.5, 15.0, 15.0])
+    x = np.arange(1, 6)
+    assert processing.find_elbow(x, y) == processing.find_elbows(y[None, :], [5])[0] == 1
+
+
+def test_batched_matches_single_curve():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 40, size=200)
+    curves = np.zeros((len(lengths), lengths.max()))
+    for g, n in enumerate(lengths):
+        curves[g, :n] = np.cumsum(np.sort(rng.pareto(1.2, n))[::-1])
+    expected = [processing.find_elbow(np.arange(1, n + 1), curves[g, :n]) for g, n in enumerate(lengths)]
+    assert processing.find_elbows(curves, lengths).tolist() == expected
+
+
+def test_equal_percentages_keep_input_order():
+    df_pct_long = pd.DataFrame({
+        "Region": "R", "Type": "Volume", "Service_Type": "Ground",
+        "Branch": ["P27", "L27", "A01", "B02"],
+        "Percentage": [5.0, 5.0, 40.0, 1.0],
+    })
+    df_bag = pd.DataFrame([{"Region": "R", "Service_Type": "Ground", "Type": "Volume", "Branches": "B02, L27, P27, A01"}])
+    curves = processing.bag_curves(df_bag, df_pct_long)
+    assert curves["branch"].tolist() == ["A01", "P27", "L27", "B02"]
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import processing
+from conftest import REPO_DIR, repo_file
+
+
+@pytest.fixture(params=["shipped", "synthetic"])
+def data_dir(request):
+    """Directory holding an all_data.csv"""
+    if request.param == "synthetic":
+        return os.path.dirname(request.getfixturevalue("synthetic_files")["all_data"])
+    if not os.path.exists(repo_file("all_data.csv")):
+        pytest.skip("all_data.csv is not present")
+    return REPO_DIR
+
+
+def test_long_table_matches_load_data(data_dir, monkeypatch):
+    monkeypatch.chdir(data_dir)
+    df_merge = processing.load_data()[4]
+    df_long = processing.load_long_table()
+
+    assert list(df_long.columns) == list(df_merge.columns)
+    for column in df_merge.columns:
+        assert (df_long[column].astype(object).to_numpy() == df_merge[column].to_numpy()).all(), column
+
+
+def test_long_to_wide_round_trip(data_dir):
+    path = os.path.join(data_dir, "all_data.csv")
+    df_abs = pd.read_csv(path)
+    wide = processing.long_to_wide(processing.load_long_table(path))
+    pd.testing.assert_frame_equal(wide, df_abs, check_dtype=False, check_categorical=False, check_names=False)
+
+
+def test_derived_percentages_match_csv(shipped_long):
+    from_csv = processing.load_long_table(repo_file("all_data.csv"), pct_path=repo_file("all_data_percentage.csv"))
+    assert len(from_csv) == len(shipped_long)
+    np.testing.assert_allclose(from_csv["Percentage"], shipped_long["Percentage"], atol=1e-6)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import processing
+
+PAIRS = [(25, 35), (0, 0), (100, 100), (5, 10), (60, 80), (37, 13)]
+
+
+@pytest.fixture(scope="module")
+def sweep(long_table):
+    return processing.ThresholdSweep(long_table)
+
+
+def assert_same_frame(actual, expected, number):
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for column in expected.columns:
+        if column == number:
+            np.testing.assert_allclose(actual[column], expected[column])
+        else:
+            assert actual[column].tolist() == expected[column].tolist(), column
+
+
+@pytest.mark.parametrize("vol, wt", PAIRS)
+def test_lookups_match_full_build(long_table, sweep, vol, wt):
+    thresholds = {"Volume": vol, "Billed Wt": wt}
+    df_pct_long = long_table[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    bag = processing.build_bag_summary(long_table, thresholds)
+
+    assert_same_frame(sweep.bag_summary(thresholds), bag, "Cumulative_Percentage")
+    assert_same_frame(
+        sweep.optimal_branches(thresholds),
+        processing.build_optimal_branches(bag, df_pct_long),
+        "Optimal_Cumulative_Percentage",
+    )
+
+
+@pytest.mark.parametrize("method", processing.KNEE_METHODS)
+@pytest.mark.parametrize("vol, wt", [(25, 35), (0, 0), (60, 80)])
+def test_knee_methods_match_full_build(long_table, sweep, method, vol, wt):
+    thresholds = {"Volume": vol, "Billed Wt": wt}
+    df_pct_long = long_table[["Region", "Type", "Service_Type", "Branch", "Percentage"]]
+    bag = processing.build_bag_summary(long_table, thresholds)
+
+    actual = sweep.optimal_branches(thresholds, method)
+    expected = processing.build_optimal_branches(bag, df_pct_long, method)
+    assert len(actual) == len(expected)
+    assert actual["Optimal_Num_Branches"].tolist() == expected["Optimal_Num_Branches"].tolist()
+    assert actual["Branches"].tolist() == expected["Branches"].tolist()
+    np.testing.assert_allclose(actual["Optimal_Cumulative_Percentage"], expected["Optimal_Cumulative_Percentage"])
+
+
+def test_unknown_knee_method(sweep):
+    with pytest.raises(ValueError):
+        sweep.knee_tables("elbowish")